@@ -30,6 +30,7 @@ from .routes import (
     ObjectController,
     ProjectController,
     ProjectTaskController,
+    ProjectTileController,
 )
 from .tasks import BackgroudTasksService
 
@@ -54,9 +55,17 @@ def add_mime_types(app: Litestar):
     # 添加 las MIME 类型
     mimetypes.add_type("application/vnd.las", ".las")
 
+    # 添加 laz MIME 类型
+    mimetypes.add_type("application/vnd.laz", ".laz")
+
 
 backgroud_tasks_service = BackgroudTasksService()
-route_handlers = [ObjectController, ProjectTaskController, ConversationController]
+route_handlers = [
+    ObjectController,
+    ProjectTaskController,
+    ProjectTileController,
+    ConversationController,
+]
 
 app = Litestar(
     route_handlers=route_handlers,
@@ -1,3 +1,4 @@
+import json
 import os
 
 from dotenv import load_dotenv
@@ -37,11 +38,158 @@ POTREE_BASE_URL = os.getenv("POTREE_BASE_URL", default=f"{PUBLIC_BASE_URL}/potre
 POTREE_SERVER_ROOT = os.getenv("POTREE_SERVER_ROOT", default="/srv/www/potree")
 POTREE_CLOUD_FOLDER = os.getenv("POTREE_CLOUD_FOLDER", default="pointclouds")
 POTREE_VIEWER_FOLDER = os.getenv("POTREE_VIEWER_FOLDER", default="viewer")
+# Potree页面和点云在Minio中的前缀
+POTREE_PREFIX = os.getenv("POTREE_PREFIX", default="potree")
+# Potree发布任务排队和运行状态的过期时间（秒）
+POTREE_LOCK_TTL = int(os.getenv("POTREE_LOCK_TTL", default="3600"))
+# Potree发布失败后不再重试的时间（秒）
+POTREE_FAILED_TTL = int(os.getenv("POTREE_FAILED_TTL", default="600"))
 
 TMPDIR = os.getenv("TMPDIR", default="/tmp")
 
 # 任务队列
 TASK_QUEUE = os.getenv("TASK_QUEUE", default="tasks")
+# 后台任务的worker数量，默认与CPU核数相同
+TASK_WORKERS = int(os.getenv("TASK_WORKERS", default=str(os.cpu_count() or 4)))
+# 每种任务类型的最大并发数，只有列出的类型会被后台任务读取
+TASK_TYPE_CONCURRENCY = json.loads(
+    os.getenv(
+        "TASK_TYPE_CONCURRENCY",
+        default=json.dumps(
+            {
+                "2d_detection": 2,
+                "2d_segmentation": 2,
+                "2d_change_detection": 2,
+                "2d_segmentation_tile": 2,
+                "3d_segmentation": 1,
+                "potree": 1,
+            }
+        ),
+    )
+)
+# 任务优先级及其调度权重，权重越大越常被优先读取
+TASK_PRIORITIES = json.loads(
+    os.getenv("TASK_PRIORITIES", default=json.dumps({"urgent": 4, "normal": 1}))
+)
+# 已取出任务的租约时间（秒），执行中的任务会定期续期，过期未确认的任务重新放回队列
+TASK_VISIBILITY_TIMEOUT = int(os.getenv("TASK_VISIBILITY_TIMEOUT", default="300"))
+# 任务失败或停滞后的最大重试次数，超过后放入死信队列
+TASK_MAX_RETRIES = int(os.getenv("TASK_MAX_RETRIES", default="3"))
+TASK_PROCESSING_QUEUE = f"{TASK_QUEUE}:processing"
+TASK_LEASES = f"{TASK_QUEUE}:leases"
+TASK_DEAD_LETTER_QUEUE = f"{TASK_QUEUE}:dead"
+# 已入队任务的去重键集合，同一类型和项目的任务只入队一次
+TASK_KEYS = f"{TASK_QUEUE}:keys"
+# 正在执行的任务锁的前缀，避免同一任务在多个worker上同时执行
+TASK_LOCK_PREFIX = f"{TASK_QUEUE}:running"
+# 执行锁被占用的重复任务延后放回队列，不计入重试次数，按放回时间排序
+TASK_DELAYED_QUEUE = f"{TASK_QUEUE}:delayed"
+TASK_DEFER_DELAY = int(os.getenv("TASK_DEFER_DELAY", default="60"))
+# 可以合并推理的任务类型及每批的最大任务数
+TASK_BATCH_SIZES = json.loads(
+    os.getenv(
+        "TASK_BATCH_SIZES",
+        default=json.dumps(
+            {"2d_detection": 4, "2d_segmentation": 4, "2d_segmentation_tile": 4}
+        ),
+    )
+)
+# 合并任务时等待同类任务的最长时间（秒）
+TASK_BATCH_WAIT = float(os.getenv("TASK_BATCH_WAIT", default="0.5"))
+# 从队列取出但尚未执行的任务数上限，达到上限后任务留在Redis中
+TASK_BACKLOG = int(os.getenv("TASK_BACKLOG", default=str(TASK_WORKERS)))
+# 保存推理结果的后处理线程数，推理线程将结果交给后处理线程后立即执行下一个任务
+TASK_POSTPROCESS_WORKERS = int(os.getenv("TASK_POSTPROCESS_WORKERS", default="2"))
+# 等待后处理的任务数上限，达到上限后推理线程等待
+TASK_POSTPROCESS_BACKLOG = int(
+    os.getenv("TASK_POSTPROCESS_BACKLOG", default=str(TASK_POSTPROCESS_WORKERS))
+)
+# 预取后续任务输入文件的磁盘预算（字节），0表示不预取
+PREFETCH_CACHE_SIZE = int(os.getenv("PREFETCH_CACHE_SIZE", default=str(20 * 1024**3)))
+# 同时预取的文件数和预取文件未被使用时的保留时间（秒）
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", default="2"))
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", default="600"))
+
+# 推理方式: server 使用常驻的模型推理进程, subprocess 每个任务启动一次推理脚本
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", default="server")
+# 各模型所在的micromamba环境和推理脚本
+INFERENCE_MODELS = json.loads(
+    os.getenv(
+        "INFERENCE_MODELS",
+        default=json.dumps(
+            {
+                "2d_segmentation": {
+                    "env": "zyb",
+                    "script": "/root/autodl-tmp/Zhaoyibei/2D_seg/DPA/predict.py",
+                },
+                "2d_detection": {
+                    "env": "zyb",
+                    "script": "/root/autodl-tmp/Zhaoyibei/2D_seg/yolo_det/track.py",
+                },
+            }
+        ),
+    )
+)
+# 推理结果缓存: on 相同输入和模型版本的任务直接使用已有结果, off 每次都推理
+# 更新模型权重而配置和推理脚本不变时，修改INFERENCE_MODELS中的version使缓存失效
+RESULT_CACHE_MODE = os.getenv("RESULT_CACHE_MODE", default="on")
+# 模型推理进程空闲多久后退出（秒）
+INFERENCE_IDLE_TIMEOUT = int(os.getenv("INFERENCE_IDLE_TIMEOUT", default="600"))
+# 模型推理进程启动和加载模型的最长时间（秒）
+INFERENCE_START_TIMEOUT = int(os.getenv("INFERENCE_START_TIMEOUT", default="300"))
+# 单次推理的最长时间（秒）
+INFERENCE_TIMEOUT = int(os.getenv("INFERENCE_TIMEOUT", default="3600"))
+
+# 分割叠加图缓存的最大字节数
+OVERLAY_CACHE_SIZE = int(os.getenv("OVERLAY_CACHE_SIZE", default=str(256 * 2**20)))
+
+# 矢量瓦片在Redis中的缓存时间（秒）
+MVT_CACHE_TTL = int(os.getenv("MVT_CACHE_TTL", default=str(7 * 24 * 3600)))
+
+# 影像栅格瓦片缓存的最大字节数
+TILE_CACHE_SIZE = int(os.getenv("TILE_CACHE_SIZE", default=str(512 * 2**20)))
+# Minio对象在本地的缓存副本的最大总字节数，用于矢量瓦片等需要随机读取原文件的请求
+OBJECT_CACHE_SIZE = int(os.getenv("OBJECT_CACHE_SIZE", default=str(5 * 2**30)))
+
+# 上传TIFF时转换为COG的方式: off 不转换, replace 替换原图, alongside 与原图一起保存
+# replace会改变用户下载到的文件，默认不转换
+COG_INGEST_MODE = os.getenv("COG_INGEST_MODE", default="off")
+# COG的无损压缩算法: DEFLATE 或 ZSTD
+COG_COMPRESS = os.getenv("COG_COMPRESS", default="DEFLATE")
+
+# 上传点云时保存COPC副本的方式: off 不保存, alongside 与原点云一起保存，需要安装PDAL
+COPC_INGEST_MODE = os.getenv("COPC_INGEST_MODE", default="off")
+
+# 缩放裁剪等派生文件在Minio中的前缀和最大总字节数
+DERIVATIVE_PREFIX = os.getenv("DERIVATIVE_PREFIX", default="derivatives")
+DERIVATIVE_CACHE_SIZE = int(os.getenv("DERIVATIVE_CACHE_SIZE", default=str(10 * 2**30)))
+# 渲染图像的最大边长
+RENDER_MAX_DIMENSION = int(os.getenv("RENDER_MAX_DIMENSION", default="4096"))
+# 点云在Minio中的存储格式: las 原样保存, laz 压缩为LAZ后保存
+POINTCLOUD_STORAGE_FORMAT = os.getenv("POINTCLOUD_STORAGE_FORMAT", default="las")
+
+# 上传点云时是否构建空间索引: off 不构建, on 构建，索引瓦片保存在Minio的前缀下
+POINTCLOUD_INDEX_MODE = os.getenv("POINTCLOUD_INDEX_MODE", default="off")
+POINTCLOUD_INDEX_PREFIX = os.getenv("POINTCLOUD_INDEX_PREFIX", default="indexes")
+
+# 点云预览的默认点数和最大点数
+PREVIEW_DEFAULT_BUDGET = int(os.getenv("PREVIEW_DEFAULT_BUDGET", default="200000"))
+PREVIEW_MAX_BUDGET = int(os.getenv("PREVIEW_MAX_BUDGET", default="2000000"))
+
+# 大幅影像2D分割的分块方式: off 整图推理, auto 超过像素数阈值的TIFF分块推理后拼接
+SEGMENTATION_2D_TILE_MODE = os.getenv("SEGMENTATION_2D_TILE_MODE", default="off")
+SEGMENTATION_2D_TILE_THRESHOLD = int(
+    os.getenv("SEGMENTATION_2D_TILE_THRESHOLD", default=str(8192 * 8192))
+)
+# 分块边长和相邻分块的重叠像素数，重叠应大于模型感受野
+SEGMENTATION_2D_TILE_SIZE = int(os.getenv("SEGMENTATION_2D_TILE_SIZE", default="2048"))
+SEGMENTATION_2D_TILE_OVERLAP = int(
+    os.getenv("SEGMENTATION_2D_TILE_OVERLAP", default="256")
+)
+# 分块、分块清单和分块推理结果在Minio中的前缀，所有worker共享
+SEGMENTATION_2D_TILE_PREFIX = os.getenv(
+    "SEGMENTATION_2D_TILE_PREFIX", default="2d_seg_tiles"
+)
 
 # 2d分割颜色映射
 SEGMENTATION_2D_BGR = {
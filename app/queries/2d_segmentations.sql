@@ -45,6 +45,7 @@ SET
 	2d_seg.plot_image_id = :plot_image_id,
 	2d_seg.mask_image_id = :mask_image_id,
 	2d_seg.mask_svg_id = :mask_svg_id,
+	2d_seg.mask_layers = :mask_layers,
 	p.modified_time = NOW(),
 	p.status = 'completed'
 WHERE
@@ -3,8 +3,52 @@ INSERT INTO images (object_id, channel_count, height, width)
 VALUES (:object_id, :channel_count, :height, :width);
 
 -- :name insert_pointcloud :insert
-INSERT INTO pointclouds (object_id, point_count)
-VALUES (:object_id, :point_count);
+INSERT INTO pointclouds (
+	object_id,
+	point_count,
+	point_format,
+	las_version,
+	min_x,
+	min_y,
+	min_z,
+	max_x,
+	max_y,
+	max_z,
+	scale_x,
+	scale_y,
+	scale_z,
+	offset_x,
+	offset_y,
+	offset_z,
+	crs,
+	is_classified,
+	class_counts,
+	z_histogram,
+	density
+)
+VALUES (
+	:object_id,
+	:point_count,
+	:point_format,
+	:las_version,
+	:min_x,
+	:min_y,
+	:min_z,
+	:max_x,
+	:max_y,
+	:max_z,
+	:scale_x,
+	:scale_y,
+	:scale_z,
+	:offset_x,
+	:offset_y,
+	:offset_z,
+	:crs,
+	:is_classified,
+	:class_counts,
+	:z_histogram,
+	:density
+);
 
 -- :name insert_video :insert
 INSERT INTO videos (object_id, duration, codec, container, width, height)
@@ -37,6 +81,11 @@ INSERT INTO objects (
 	:origin_type
 );
 
+-- :name update_image_cog_id :affected
+UPDATE images
+SET cog_id = :cog_id
+WHERE id = :id;
+
 -- :name update_thumbnail_id :affected
 UPDATE objects
 SET thumbnail_id = :thumbnail_image_id
@@ -338,3 +387,30 @@ WHERE
 	is_deleted = FALSE
 	AND type IN :types
 	AND origin_type IN :origin_types;
+
+-- :name get_potree_path :scalar
+SELECT p.potree_path
+FROM
+	pointclouds AS p,
+	objects AS o
+WHERE
+	p.object_id = o.id
+	AND o.etag = :etag
+	AND p.potree_path IS NOT NULL
+LIMIT 1;
+
+-- :name update_potree_path :affected
+UPDATE pointclouds AS p
+JOIN objects AS o ON p.object_id = o.id
+SET p.potree_path = :potree_path
+WHERE o.etag = :etag;
+
+-- :name update_pointcloud_copc_id :affected
+UPDATE pointclouds
+SET copc_id = :copc_id
+WHERE id = :id;
+
+-- :name update_pointcloud_index_path :affected
+UPDATE pointclouds
+SET index_path = :index_path
+WHERE id = :id;
@@ -23,8 +23,8 @@ WHERE
 	AND status IN :statuses;
 
 -- :name create_project :insert
-INSERT INTO projects (name, type, cover_image_id, status)
-VALUES (:name, :type, :cover_image_id, :status);
+INSERT INTO projects (name, type, cover_image_id, status, priority)
+VALUES (:name, :type, :cover_image_id, :status, :priority);
 
 -- :name delete_project :affected
 UPDATE projects
@@ -40,3 +40,8 @@ WHERE id = :id;
 UPDATE projects
 SET cover_image_id = :cover_image_id
 WHERE id = :id;
+
+-- :name update_project_status :affected
+UPDATE projects
+SET status = :status
+WHERE id = :id;
@@ -0,0 +1,24 @@
+-- :name get_task_result :one
+SELECT *
+FROM task_results
+WHERE
+	type = :type
+	AND input_etags = :input_etags
+	AND model_version = :model_version;
+
+-- :name save_task_result :affected
+INSERT INTO task_results (type, input_etags, model, model_version, result)
+VALUES (:type, :input_etags, :model, :model_version, :result)
+ON DUPLICATE KEY UPDATE
+	result = VALUES(result),
+	created_time = NOW();
+
+-- :name delete_task_result :affected
+DELETE FROM task_results
+WHERE id = :id;
+
+-- :name delete_task_results :affected
+DELETE FROM task_results
+WHERE
+	(:model IS NULL OR model = :model)
+	AND (:type IS NULL OR type = :type);
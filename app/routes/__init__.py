@@ -1,11 +1,13 @@
 from .conversation_route import ConversationController
 from .object_route import ObjectController
 from .project_route import ProjectController
+from .project_tile_route import ProjectTileController
 from .project_task_route import ProjectTaskController
 
 __all__ = (
     "ProjectController",
     "ProjectTaskController",
+    "ProjectTileController",
     "ObjectController",
     "ConversationController",
 )
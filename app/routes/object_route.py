@@ -9,6 +9,7 @@ from litestar.datastructures import State, UploadFile
 from litestar.di import Provide
 from litestar.enums import RequestEncodingType
 from litestar.params import Body
+from litestar.response import Redirect
 from litestar.status_codes import (
     HTTP_200_OK,
     HTTP_201_CREATED,
@@ -16,11 +17,19 @@ from litestar.status_codes import (
     HTTP_404_NOT_FOUND,
 )
 from loguru import logger
+import numpy as np
 
+from app.config import (
+    PREVIEW_DEFAULT_BUDGET,
+    PREVIEW_MAX_BUDGET,
+    RENDER_MAX_DIMENSION,
+)
 from app.schemas import ResponseWrapper
 from app.schemas.respone_schema import Pagination
 from app.services import get_services
 from app.utils.connections_manager import ConnectionsManager
+from app.utils.overlay_funcs import RENDER_FORMATS
+from app.utils.tile_funcs import parse_tile_name
 
 
 class ObjectController(Controller):
@@ -105,6 +114,212 @@ class ObjectController(Controller):
                 )
             )
 
+    @get(path="/{id:int}/tiles", sync_to_thread=True)
+    def get_tile_info(self, id: int) -> ResponseWrapper | Response:
+        with ConnectionsManager() as connections_manager:
+            services = get_services(
+                connections_manager.queries,
+                connections_manager.minio_client,
+                connections_manager.redis_client,
+            )
+            object_service = services.object_service
+
+            tile_info = object_service.get_image_tile_info(id)
+            if tile_info is None:
+                return Response(
+                    ResponseWrapper(code=2, message=f"Image with id {id} not found"),
+                    status_code=HTTP_404_NOT_FOUND,
+                )
+
+            return ResponseWrapper(tile_info)
+
+    @get(path="/{id:int}/tiles/{z:int}/{x:int}/{tile:str}", sync_to_thread=True)
+    def get_tile(self, id: int, z: int, x: int, tile: str) -> Response:
+        try:
+            y, format = parse_tile_name(tile)
+        except ValueError as e:
+            return Response(
+                ResponseWrapper(code=3, message=str(e)),
+                status_code=HTTP_400_BAD_REQUEST,
+            )
+
+        if format not in RENDER_FORMATS:
+            return Response(
+                ResponseWrapper(code=3, message="Invalid tile format"),
+                status_code=HTTP_400_BAD_REQUEST,
+            )
+
+        with ConnectionsManager() as connections_manager:
+            services = get_services(
+                connections_manager.queries,
+                connections_manager.minio_client,
+                connections_manager.redis_client,
+            )
+            object_service = services.object_service
+
+            logger.debug(f"Getting tile {z}/{x}/{y} of image {id}")
+
+            image_tile = object_service.get_image_tile(id, z, x, y, format=format)
+            if image_tile is None:
+                return Response(
+                    ResponseWrapper(code=2, message=f"Tile {z}/{x}/{y} not found"),
+                    status_code=HTTP_404_NOT_FOUND,
+                )
+
+            _, media_type = RENDER_FORMATS[format]
+            return Response(image_tile, media_type=media_type)
+
+    @get(path="/{id:int}/render", sync_to_thread=True)
+    def render(
+        self,
+        id: int,
+        width: int | None = None,
+        height: int | None = None,
+        crop: str | None = None,
+        format: str = "webp",
+        quality: int = 85,
+    ) -> Redirect | Response:
+        # 裁剪区域的格式为 x0,y0,x1,y1
+        try:
+            crop_box = tuple(int(v) for v in crop.split(",")) if crop else None
+        except ValueError:
+            crop_box = ()
+
+        if (
+            format not in RENDER_FORMATS
+            or not 1 <= quality <= 100
+            or (crop_box is not None and len(crop_box) != 4)
+            or any(
+                v is not None and not 0 < v <= RENDER_MAX_DIMENSION
+                for v in (width, height)
+            )
+        ):
+            return Response(
+                ResponseWrapper(code=3, message="Invalid render parameters"),
+                status_code=HTTP_400_BAD_REQUEST,
+            )
+
+        with ConnectionsManager() as connections_manager:
+            services = get_services(
+                connections_manager.queries,
+                connections_manager.minio_client,
+                connections_manager.redis_client,
+            )
+            object_service = services.object_service
+
+            logger.debug(f"Rendering image {id}")
+
+            try:
+                link = object_service.render_image(
+                    id,
+                    width=width,
+                    height=height,
+                    crop=crop_box,
+                    format=format,
+                    quality=quality,
+                )
+            except ValueError as e:
+                return Response(
+                    ResponseWrapper(code=3, message=str(e)),
+                    status_code=HTTP_400_BAD_REQUEST,
+                )
+
+            if link is None:
+                return Response(
+                    ResponseWrapper(code=2, message=f"Image with id {id} not found"),
+                    status_code=HTTP_404_NOT_FOUND,
+                )
+
+            # 重定向到Minio中的派生文件，由存储直接提供
+            return Redirect(path=link)
+
+    @get(path="/{id:int}/preview", sync_to_thread=True)
+    def preview(
+        self, id: int, budget: int = PREVIEW_DEFAULT_BUDGET
+    ) -> Redirect | Response:
+        if not 0 < budget <= PREVIEW_MAX_BUDGET:
+            return Response(
+                ResponseWrapper(code=3, message="Invalid preview budget"),
+                status_code=HTTP_400_BAD_REQUEST,
+            )
+
+        with ConnectionsManager() as connections_manager:
+            services = get_services(
+                connections_manager.queries,
+                connections_manager.minio_client,
+                connections_manager.redis_client,
+            )
+            object_service = services.object_service
+
+            logger.debug(f"Getting preview of pointcloud {id}")
+
+            link = object_service.get_pointcloud_preview(id, budget=budget)
+            if link is None:
+                return Response(
+                    ResponseWrapper(
+                        code=2, message=f"Pointcloud with id {id} not found"
+                    ),
+                    status_code=HTTP_404_NOT_FOUND,
+                )
+
+            # 重定向到Minio中的预览文件，由存储直接提供
+            return Redirect(path=link)
+
+    @get(path="/{id:int}/points", sync_to_thread=True)
+    def query_points(
+        self, id: int, bbox: str | None = None, polygon: str | None = None
+    ) -> Response:
+        # 范围的格式为 min_x,min_y,max_x,max_y，多边形的格式为 x1,y1,x2,y2,...
+        try:
+            bbox_values = tuple(float(v) for v in bbox.split(",")) if bbox else None
+            polygon_values = (
+                np.array([float(v) for v in polygon.split(",")]).reshape(-1, 2)
+                if polygon
+                else None
+            )
+        except ValueError:
+            bbox_values, polygon_values = (), None
+
+        if (
+            (bbox_values is None and polygon_values is None)
+            or (bbox_values is not None and len(bbox_values) != 4)
+            or (polygon_values is not None and len(polygon_values) < 3)
+        ):
+            return Response(
+                ResponseWrapper(code=3, message="Invalid query range"),
+                status_code=HTTP_400_BAD_REQUEST,
+            )
+
+        with ConnectionsManager() as connections_manager:
+            services = get_services(
+                connections_manager.queries,
+                connections_manager.minio_client,
+                connections_manager.redis_client,
+            )
+            object_service = services.object_service
+
+            logger.debug(f"Querying points of pointcloud {id}")
+
+            try:
+                data = object_service.query_pointcloud(
+                    id, bbox=bbox_values, polygon=polygon_values
+                )
+            except ValueError as e:
+                return Response(
+                    ResponseWrapper(code=3, message=str(e)),
+                    status_code=HTTP_400_BAD_REQUEST,
+                )
+
+            if data is None:
+                return Response(
+                    ResponseWrapper(
+                        code=2, message=f"Pointcloud with id {id} not found"
+                    ),
+                    status_code=HTTP_404_NOT_FOUND,
+                )
+
+            return Response(data, media_type="application/octet-stream")
+
     @post(path="/", sync_to_thread=True)
     def create(
         self,
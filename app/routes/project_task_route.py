@@ -13,10 +13,12 @@ from litestar.status_codes import (
 )
 from loguru import logger
 
+from app.config import RENDER_MAX_DIMENSION, TASK_PRIORITIES
 from app.schemas import ResponseWrapper
 from app.schemas.respone_schema import Pagination
 from app.services import get_services
 from app.utils.connections_manager import ConnectionsManager
+from app.utils.overlay_funcs import RENDER_FORMATS
 
 
 class ProjectTaskController(Controller):
@@ -105,6 +107,65 @@ class ProjectTaskController(Controller):
 
             return ResponseWrapper(result)
 
+    @get(path="/{project_id:int}/overlay", sync_to_thread=True)
+    def overlay(
+        self,
+        project_id: int,
+        width: int | None = None,
+        height: int | None = None,
+        classes: list[str] | None = None,
+        opacity: float = 0.5,
+        format: str = "png",
+    ) -> Response:
+        if (
+            format not in RENDER_FORMATS
+            or not 0 <= opacity <= 1
+            or any(
+                v is not None and not 0 < v <= RENDER_MAX_DIMENSION
+                for v in (width, height)
+            )
+        ):
+            return Response(
+                ResponseWrapper(code=3, message="Invalid overlay parameters"),
+                status_code=HTTP_400_BAD_REQUEST,
+            )
+
+        with ConnectionsManager() as connections_manager:
+            services = get_services(
+                connections_manager.queries,
+                connections_manager.minio_client,
+                connections_manager.redis_client,
+            )
+            segmentation_2d_service = services.segmentation_2d_service
+
+            logger.debug(f"Rendering overlay for project {project_id}")
+
+            try:
+                overlay = segmentation_2d_service.render_overlay(
+                    project_id,
+                    width=width,
+                    height=height,
+                    classes=classes,
+                    opacity=opacity,
+                    format=format,
+                )
+            except ValueError as e:
+                return Response(
+                    ResponseWrapper(code=3, message=str(e)),
+                    status_code=HTTP_400_BAD_REQUEST,
+                )
+
+            if overlay is None:
+                return Response(
+                    ResponseWrapper(
+                        code=2, message=f"Project with id {project_id} not found"
+                    ),
+                    status_code=HTTP_404_NOT_FOUND,
+                )
+
+            _, media_type = RENDER_FORMATS[format]
+            return Response(overlay, media_type=media_type)
+
     @put(path="/{id:int}", sync_to_thread=True)
     def update(self, data: dict, id: int) -> ResponseWrapper | Response:
         with ConnectionsManager() as connections_manager:
@@ -148,6 +209,13 @@ class ProjectTaskController(Controller):
 
             logger.debug(f"Creating 2d detection with data {data}")
 
+            # 紧急任务进入高优先级队列
+            if data.get("priority", "normal") not in TASK_PRIORITIES:
+                return Response(
+                    ResponseWrapper(code=3, message="Invalid priority"),
+                    status_code=HTTP_400_BAD_REQUEST,
+                )
+
             match data["type"]:
                 case "2d_detection":
                     task_info = detection_2d_service.create(**data)
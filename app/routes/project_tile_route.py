@@ -0,0 +1,70 @@
+from litestar import Controller, Response, get
+from litestar.status_codes import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
+from loguru import logger
+
+from app.schemas import ResponseWrapper
+from app.services import get_services
+from app.utils.connections_manager import ConnectionsManager
+from app.utils.tile_funcs import parse_tile_name
+
+
+class ProjectTileController(Controller):
+    path = "/project"
+
+    @get(path="/{project_id:int}/tiles", sync_to_thread=True)
+    def get_tile_info(self, project_id: int) -> ResponseWrapper | Response:
+        with ConnectionsManager() as connections_manager:
+            services = get_services(
+                connections_manager.queries,
+                connections_manager.minio_client,
+                connections_manager.redis_client,
+            )
+            segmentation_2d_service = services.segmentation_2d_service
+
+            tile_info = segmentation_2d_service.get_tile_info(project_id)
+            if tile_info is None:
+                return Response(
+                    ResponseWrapper(
+                        code=2, message=f"Project with id {project_id} not found"
+                    ),
+                    status_code=HTTP_404_NOT_FOUND,
+                )
+
+            return ResponseWrapper(tile_info)
+
+    @get(path="/{project_id:int}/tiles/{z:int}/{x:int}/{tile:str}", sync_to_thread=True)
+    def get_vector_tile(self, project_id: int, z: int, x: int, tile: str) -> Response:
+        try:
+            y, format = parse_tile_name(tile)
+        except ValueError as e:
+            return Response(
+                ResponseWrapper(code=3, message=str(e)),
+                status_code=HTTP_400_BAD_REQUEST,
+            )
+
+        if format not in ("mvt", "pbf"):
+            return Response(
+                ResponseWrapper(code=3, message="Invalid tile format"),
+                status_code=HTTP_400_BAD_REQUEST,
+            )
+
+        with ConnectionsManager() as connections_manager:
+            services = get_services(
+                connections_manager.queries,
+                connections_manager.minio_client,
+                connections_manager.redis_client,
+            )
+            segmentation_2d_service = services.segmentation_2d_service
+
+            logger.debug(f"Getting vector tile {z}/{x}/{y} of project {project_id}")
+
+            vector_tile = segmentation_2d_service.get_vector_tile(project_id, z, x, y)
+            if vector_tile is None:
+                return Response(
+                    ResponseWrapper(code=2, message=f"Tile {z}/{x}/{y} not found"),
+                    status_code=HTTP_404_NOT_FOUND,
+                )
+
+            return Response(
+                vector_tile, media_type="application/vnd.mapbox-vector-tile"
+            )
@@ -10,6 +10,7 @@ from .conversation_service import ConversationService
 from .detection_2d_service import Detection2DService
 from .object_service import ObjectService
 from .project_service import ProjectService
+from .result_cache_service import ResultCacheService
 from .segmentation_2d_service import Segmentation2DService
 from .segmentation_3d_service import Segmentation3DService
 
@@ -23,12 +24,13 @@ class Services:
     segmentation_3d_service: Segmentation3DService
     detection_2d_service: Detection2DService
     change_detection_2d_service: ChangeDetection2DService
+    result_cache_service: ResultCacheService
 
 
 def get_services(queries: Module, minio_client: Minio, redis_client: Redis):
     services = {
-        "object_service": ObjectService(queries, minio_client),
-        "project_service": ProjectService(queries, minio_client),
+        "object_service": ObjectService(queries, minio_client, redis_client),
+        "project_service": ProjectService(queries, minio_client, redis_client),
         "conversation_service": ConversationService(queries, minio_client),
         "segmentation_2d_service": Segmentation2DService(
             queries, minio_client, redis_client
@@ -40,6 +42,7 @@ def get_services(queries: Module, minio_client: Minio, redis_client: Redis):
         "change_detection_2d_service": ChangeDetection2DService(
             queries, minio_client, redis_client
         ),
+        "result_cache_service": ResultCacheService(queries),
     }
 
     return Services(**services)
@@ -53,5 +56,6 @@ __all__ = (
     "ProjectService",
     "ObjectService",
     "ConversationService",
+    "ResultCacheService",
     "get_services",
 )
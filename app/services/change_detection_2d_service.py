@@ -19,12 +19,18 @@ from .project_service import ProjectService
 class ChangeDetection2DService:
     def __init__(self, queries: Module, minio_client: Minio, redis_client: Redis):
         self.queries = queries
-        self.project_service = ProjectService(queries, minio_client)
-        self.object_service = ObjectService(queries, minio_client)
+        self.project_service = ProjectService(queries, minio_client, redis_client)
+        self.object_service = ObjectService(queries, minio_client, redis_client)
         self.redis_client = redis_client
 
     def create(
-        self, image1_id, image2_id, project_id=None, project_name=None, **kwargs
+        self,
+        image1_id,
+        image2_id,
+        project_id=None,
+        project_name=None,
+        priority="normal",
+        **kwargs,
     ):
         with self.queries.transaction() as tx:
             if project_id:
@@ -44,6 +50,7 @@ class ChangeDetection2DService:
                     type="2d_change_detection",
                     name=project_name,
                     cover_image_id=cover_image_id,
+                    priority=priority,
                 )
 
             last_id = self.queries.create_2d_change_detection(
@@ -60,6 +67,7 @@ class ChangeDetection2DService:
             "type": "2d_change_detection",
             "id": last_id,
             "project_id": project_id,
+            "priority": priority,
         }
         push_task(self.redis_client, task_info)
 
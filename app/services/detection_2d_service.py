@@ -5,26 +5,34 @@ from pathlib import Path
 from box import Box, BoxList
 from loguru import logger
 from minio import Minio
-from plumbum.cmd import micromamba
 from pugsql.compiler import Module
 from redis import Redis
 
+from app.utils.inference_funcs import run_inference, run_inference_batch
 from app.utils.tasks_funcs import push_task
 from app.utils.video_funcs import convert_video
 
 from .object_service import ObjectService
 from .project_service import ProjectService
+from .result_cache_service import ResultCacheService
 
 
 class Detection2DService:
     def __init__(self, queries: Module, minio_client: Minio, redis_client: Redis):
         self.queries = queries
-        self.project_service = ProjectService(queries, minio_client)
-        self.object_service = ObjectService(queries, minio_client)
+        self.project_service = ProjectService(queries, minio_client, redis_client)
+        self.object_service = ObjectService(queries, minio_client, redis_client)
+        self.result_cache_service = ResultCacheService(queries)
         self.redis_client = redis_client
 
     def create(
-        self, image_id=None, video_id=None, project_id=None, project_name=None, **kwargs
+        self,
+        image_id=None,
+        video_id=None,
+        project_id=None,
+        project_name=None,
+        priority="normal",
+        **kwargs,
     ):
         with self.queries.transaction() as tx:
             if project_id:
@@ -53,6 +61,7 @@ class Detection2DService:
                     type="2d_detection",
                     name=project_name,
                     cover_image_id=cover_image_id,
+                    priority=priority,
                 )
 
             last_id = self.queries.create_2d_detection(
@@ -65,7 +74,12 @@ class Detection2DService:
                 raise ValueError(msg)
 
         # 将任务推送到redis队列
-        task_info = {"type": "2d_detection", "id": last_id, "project_id": project_id}
+        task_info = {
+            "type": "2d_detection",
+            "id": last_id,
+            "project_id": project_id,
+            "priority": priority,
+        }
         push_task(self.redis_client, task_info)
 
         return task_info
@@ -96,6 +110,31 @@ class Detection2DService:
             msg = "Either id or project_id must be provided"
             raise ValueError(msg)
 
+    def get_input_objects(
+        self, id: int | None = None, project_id: int | None = None, **kwargs
+    ) -> list[dict]:
+        """
+        获取任务的输入对象，供后台预取
+
+        :param id: 2D检测任务ID
+        :param project_id: 项目ID
+        :return: 输入的图像或视频数据
+        """
+        project_info = self.get(id=id, project_id=project_id)
+        if not project_info:
+            return []
+
+        if project_info.image_id:
+            data_info = self.object_service.get_image(
+                id=project_info.image_id, should_thumbnail=False
+            )
+        elif project_info.video_id:
+            data_info = self.object_service.get_video(id=project_info.video_id)
+        else:
+            return []
+
+        return [data_info] if data_info else []
+
     def run(self, id: int | None = None, project_id: int | None = None, **kwargs):
         """
         Run 2D detection task
@@ -104,15 +143,140 @@ class Detection2DService:
             id (int, optional): 2D detection task ID. Defaults to None.
             project_id (int, optional): Project ID. Defaults to None.
         """
+        if self._link_cached_result(id=id, project_id=project_id):
+            return
+
+        job = self._prepare(id=id, project_id=project_id)
+        if not job:
+            return
+
+        # 运行预测脚本
+        run_inference(self.redis_client, "2d_detection", **job.args)
+        logger.debug(f"2d detection task completed: {job.project_info}")
+
+        self.complete(job)
+
+    def run_batch(self, tasks: list[dict]) -> list[Exception | None]:
+        """
+        批量运行2D检测任务，所有任务在一次推理调用中完成
+
+        Args:
+            tasks (list[dict]): 任务信息，包含id和project_id
+
+        Returns:
+            list[Exception | None]: 每个任务的异常，成功时为None
+        """
+        # 将结果分别保存到各自的项目
+        errors: list[Exception | None] = []
+        for result in self.infer_batch(tasks):
+            if not isinstance(result, Box):
+                errors.append(result)
+                continue
+
+            try:
+                self.complete(result)
+                errors.append(None)
+            except Exception as e:
+                logger.error(f"2d detection task failed: {result.project_info.id}: {e}")
+                errors.append(e)
+
+        return errors
+
+    def infer_batch(self, tasks: list[dict]) -> list[Box | Exception | None]:
+        """
+        批量推理2D检测任务，不保存结果，由调用方对返回的任务调用complete
 
-        # 获取任务
+        Args:
+            tasks (list[dict]): 任务信息，包含id和project_id
+
+        Returns:
+            list[Box | Exception | None]: 每个任务推理完成后待保存的任务，
+                推理失败时为异常，不需要保存结果时为None
+        """
+        results: list[Box | Exception | None] = [None] * len(tasks)
+
+        jobs = {}
+        for i, task in enumerate(tasks):
+            try:
+                if self._link_cached_result(
+                    id=task.get("id"), project_id=task.get("project_id")
+                ):
+                    continue
+
+                job = self._prepare(
+                    id=task.get("id"), project_id=task.get("project_id")
+                )
+            except Exception as e:
+                results[i] = e
+                continue
+            if job:
+                jobs[i] = job
+
+        if not jobs:
+            return results
+
+        # 运行预测脚本
+        batch = [job.args for job in jobs.values()]
+        try:
+            inference_errors = run_inference_batch(
+                self.redis_client, "2d_detection", batch
+            )
+        except Exception as e:
+            inference_errors = [str(e)] * len(jobs)
+        logger.debug(f"2d detection batch inferred: {len(jobs)} tasks")
+
+        for (i, job), error in zip(jobs.items(), inference_errors):
+            if error:
+                logger.error(
+                    f"2d detection task failed: {job.project_info.id}: {error}"
+                )
+                msg = f"Inference failed: {error}"
+                results[i] = RuntimeError(msg)
+            else:
+                results[i] = job
+
+        return results
+
+    def _link_cached_result(
+        self, id: int | None = None, project_id: int | None = None
+    ) -> bool:
+        # 相同图片或视频和模型版本已有推理结果时直接关联到任务，不再推理
+        if not self.result_cache_service.enabled:
+            return False
+
+        input_objects = self.get_input_objects(id=id, project_id=project_id)
+        etags = [object_data["etag"] for object_data in input_objects]
+        cached = self.result_cache_service.get("2d_detection", etags, "2d_detection")
+        if not cached:
+            return False
+
+        # 结果图片或视频已删除时重新推理
+        result = cached.result
+        if result.plot_image_id:
+            exists = self.queries.get_image(id=result.plot_image_id, object_id=None)
+        else:
+            exists = self.queries.get_video(id=result.plot_video_id, object_id=None)
+        if not exists:
+            logger.info(f"Cached 2d detection result is gone: {cached.id}")
+            self.result_cache_service.delete(cached.id)
+            return False
+
+        self.queries.complete_2d_detection(id=id, project_id=project_id, **result)
+        logger.info(
+            f"2d detection task completed from cached result: "
+            f"id={id}, project_id={project_id}"
+        )
+        return True
+
+    def _prepare(self, id: int | None = None, project_id: int | None = None):
+        # 获取任务和输入文件，生成推理参数
         project_info = self.get(id=id, project_id=project_id)
 
         if not project_info:
             logger.error(
                 f"detection 2D task not found: id={id}, project_id={project_id}"
             )
-            return
+            return None
 
         project_info = Box(project_info)
 
@@ -124,7 +288,7 @@ class Detection2DService:
             data_info = self.object_service.get_video(id=project_info.video_id)
         else:
             logger.error("Neither image_id nor video_id found")
-            return
+            return None
 
         data_info = Box(data_info)
 
@@ -144,22 +308,23 @@ class Detection2DService:
         if project_info.video_id:
             result_origin_name = result_origin_name.with_suffix(".mp4")
 
-        # 运行预测脚本
-        cmd = micromamba[
-            "run",
-            "-n",
-            "zyb",
-            "python",
-            "/root/autodl-tmp/Zhaoyibei/2D_seg/yolo_det/track.py",
-            "--input",
-            input_path,
-            "--output",
-            output_path,
-        ]
-
-        logger.debug(f"Running command: {cmd}")
-        cmd()
-        logger.debug(f"2d detection task completed: {project_info}")
+        return Box(
+            id=id,
+            project_id=project_id,
+            project_info=project_info,
+            input_path=input_path,
+            output_path=output_path,
+            result_origin_name=result_origin_name,
+            input_etags=[data_info.etag],
+            args={"input": input_path, "output": output_path},
+        )
+
+    def complete(self, job: Box):
+        # 保存推理结果并更新数据库
+        project_info = job.project_info
+        input_path = job.input_path
+        output_path = job.output_path
+        result_origin_name = job.result_origin_name
 
         # 保存输出文件
         if project_info.image_id:
@@ -188,11 +353,14 @@ class Detection2DService:
             plot_video_id = results.id
 
         # 更新数据库
+        result = {"plot_image_id": plot_image_id, "plot_video_id": plot_video_id}
         self.queries.complete_2d_detection(
-            id=id,
-            project_id=project_id,
-            plot_image_id=plot_image_id,
-            plot_video_id=plot_video_id,
+            id=job.id, project_id=job.project_id, **result
+        )
+
+        # 相同图片或视频和模型版本的任务直接使用该结果
+        self.result_cache_service.save(
+            "2d_detection", job.get("input_etags"), "2d_detection", result
         )
 
         # 删除临时文件
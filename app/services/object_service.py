@@ -1,4 +1,6 @@
 from base64 import b64encode
+from io import BytesIO
+import json
 import mimetypes
 import os
 from pathlib import Path
@@ -8,41 +10,119 @@ import traceback
 from typing import Optional
 
 from box import Box, BoxList
+import einops as ep
 from furl import furl
-import laspy
 from loguru import logger
 from minio import Minio
+import numpy as np
 from PIL import Image
 import pillow_avif
 from plumbum.cmd import PotreePublisher
 from pugsql.compiler import Module
+import rasterio
+from rasterio.enums import Resampling
+from redis import Redis
 
 from app.config import (
+    COG_COMPRESS,
+    COG_INGEST_MODE,
+    COPC_INGEST_MODE,
+    DERIVATIVE_CACHE_SIZE,
+    DERIVATIVE_PREFIX,
     MINIO_BUCKET,
-    POTREE_BASE_URL,
+    OBJECT_CACHE_SIZE,
+    POINTCLOUD_INDEX_MODE,
+    POINTCLOUD_INDEX_PREFIX,
+    POINTCLOUD_STORAGE_FORMAT,
     POTREE_CLOUD_FOLDER,
+    POTREE_FAILED_TTL,
+    POTREE_LOCK_TTL,
+    POTREE_PREFIX,
     POTREE_SERVER_ROOT,
     POTREE_VIEWER_FOLDER,
+    RENDER_MAX_DIMENSION,
     SHARE_LINK_BASE_URL,
+    TILE_CACHE_SIZE,
     TMPDIR,
 )
-from app.utils.image_funcs import get_metadata, tiff2img
+from app.utils.cache_funcs import DerivativeCache, LRUCache, evict_files
+from app.utils.image_funcs import (
+    get_metadata,
+    is_cog,
+    read_image_region,
+    read_tiff_region,
+    tiff2cog,
+    tiff2img,
+)
 from app.utils.img2svg import ImageToSvgConverter
+from app.utils.las_funcs import (
+    convert_las,
+    TILE_POINT_DTYPE,
+    LasStats,
+    build_tile_index,
+    encode_preview,
+    filter_tile_points,
+    get_index_tiles,
+    get_las_metadata,
+    get_las_stats,
+    is_compressed,
+    is_copc,
+    las2copc,
+    las2thumbnail,
+    voxel_downsample,
+)
 from app.utils.object_funcs import (
     get_available_object_name,
+    get_folder_version,
     get_object_base64,
     get_object_name,
+    upload_folder,
+)
+from app.utils.overlay_funcs import RENDER_FORMATS, encode_image, get_fit_size
+from app.utils.prefetch_funcs import prefetcher
+from app.utils.tasks_funcs import push_task
+from app.utils.tile_funcs import (
+    TILE_SIZE,
+    get_display_indexes,
+    get_max_zoom,
+    get_stretch_range,
+    get_tile_window,
+    read_window,
+    stretch_to_uint8,
 )
 from app.utils.url import rewrite_base_url
 from app.utils.video_funcs import get_video_info
 
+# 影像瓦片缓存，键中包含etag，对象更新后旧瓦片不再命中并被逐渐淘汰
+tile_cache = LRUCache(TILE_CACHE_SIZE)
+
+# 影像的拉伸范围，键为etag
+stretch_ranges: dict[str, tuple[float, float]] = {}
+
+# 点云空间索引清单，键为etag
+index_manifests: dict[str, dict] = {}
+
 
 class ObjectService:
-    def __init__(self, queries: Module, minio_client: Minio):
+    def __init__(
+        self, queries: Module, minio_client: Minio, redis_client: Redis | None = None
+    ):
         self.queries = queries
         self.minio_client = minio_client
+        self.redis_client = redis_client
         self.bucket_name = MINIO_BUCKET
 
+        # 派生文件缓存需要Redis记录访问时间
+        self.derivative_cache = None
+        if redis_client is not None:
+            self.derivative_cache = DerivativeCache(
+                minio_client,
+                redis_client,
+                self.bucket_name,
+                prefix=DERIVATIVE_PREFIX,
+                max_size=DERIVATIVE_CACHE_SIZE,
+            )
+
     def save_image(
         self,
         name: str,
@@ -53,27 +133,57 @@ class ObjectService:
         thumbnail_format: str = "jpg",
         mask_colors_map: dict | None = None,
         mask_color_mode: str = "rgb",
+        mask_layers: bool = False,
     ):
         if content_type is None:
             content_type = mimetypes.guess_type(file_path, strict=False)[0]
 
-        # 保存图像文件到Minio并将元数据存储到数据库中
-        image_info = self._save_image(
-            name, file_path, content_type=content_type, origin_type=origin_type
-        )
-        image_info = Box(image_info)
-
-        # 测试图像是否为tif格式，如果是则还要缩略图
-        if content_type != "image/tiff":
-            return Box(image_info=image_info)
-
-        results = self._save_thumbnail(
-            name,
-            file_path,
-            thumbnail_format=thumbnail_format,
-            mask_colors_map=mask_colors_map,
-            mask_color_mode=mask_color_mode,
-        )
+        # 将TIFF转换为COG，分类结果图的金字塔使用最近邻以保留颜色
+        cog_path = None
+        if content_type == "image/tiff" and COG_INGEST_MODE != "off":
+            cog_path = self._convert_cog(
+                file_path,
+                overview_resampling="NEAREST" if mask_colors_map else "AVERAGE",
+            )
+
+        try:
+            # 保存图像文件到Minio并将元数据存储到数据库中
+            upload_path = (
+                cog_path if cog_path and COG_INGEST_MODE == "replace" else file_path
+            )
+            image_info = self._save_image(
+                name, upload_path, content_type=content_type, origin_type=origin_type
+            )
+            image_info = Box(image_info)
+
+            # 与原图一起保存COG
+            if cog_path and COG_INGEST_MODE == "alongside":
+                cog_name = Path(name).with_stem(f"{Path(name).stem}_cog")
+                cog_info = self._save_image(
+                    cog_name, cog_path, content_type="image/tiff", origin_type="cog"
+                )
+                if cog_info:
+                    self.queries.update_image_cog_id(
+                        id=image_info.id, cog_id=cog_info["id"]
+                    )
+
+            # 测试图像是否为tif格式，如果是则还要缩略图
+            if content_type != "image/tiff":
+                return Box(image_info=image_info)
+
+            # COG带有金字塔，从COG生成缩略图无需解码整幅图像
+            results = self._save_thumbnail(
+                name,
+                cog_path or file_path,
+                thumbnail_format=thumbnail_format,
+                mask_colors_map=mask_colors_map,
+                mask_color_mode=mask_color_mode,
+                mask_layers=mask_layers,
+            )
+        finally:
+            # 删除临时文件
+            if cog_path:
+                cog_path.unlink(missing_ok=True)
 
         # 更新对象的缩略图ID
         self.queries.update_thumbnail_id(
@@ -84,6 +194,34 @@ class ObjectService:
         results.image_info = image_info
         return results
 
+    def _convert_cog(
+        self, file_path: str | Path, *, overview_resampling: str = "AVERAGE"
+    ) -> Path | None:
+        """
+        将TIFF转换为Cloud-Optimized GeoTIFF
+
+        :param file_path: TIFF文件路径
+        :param overview_resampling: 金字塔重采样方法
+        :return: COG临时文件路径，如果已经是COG或转换失败则返回None
+        """
+        try:
+            if is_cog(file_path):
+                logger.info(f"文件已经是COG，无需转换: {file_path}")
+                return None
+
+            cog_path = tiff2cog(
+                file_path,
+                compress=COG_COMPRESS,
+                overview_resampling=overview_resampling,
+            )
+        except Exception as e:
+            # 转换失败时保存原图，不影响上传
+            logger.error(f"转换COG时发生错误: {e}")
+            logger.error(traceback.format_exc())
+            return None
+        else:
+            return Path(cog_path)
+
     def _save_thumbnail(
         self,
         name: str,
@@ -92,6 +230,7 @@ class ObjectService:
         thumbnail_format: str = "jpg",
         mask_colors_map: dict = None,
         mask_color_mode: str = "rgb",
+        mask_layers: bool = False,
     ) -> dict | None:
         """
         保存缩略图文件到Minio并将元数据存储到数据库中
@@ -100,6 +239,7 @@ class ObjectService:
         :param file_path: 原文件路径
         :param object_id: 原对象ID
         :param thumbnail_format: 缩略图格式
+        :param mask_layers: 是否额外为每个类别生成单独的mask_svg图层
         :return: 保存的缩略图信息，如果保存失败则返回None
         """
 
@@ -144,6 +284,12 @@ class ObjectService:
             # 删除临时文件
             mask_svg_path.unlink(missing_ok=True)
 
+            # 为每个类别生成单独的图层，便于前端按需加载
+            if mask_layers:
+                results.mask_layers = self._save_mask_layers(
+                    name, thumbnail_path, img2svg
+                )
+
         # 删除临时文件
         thumbnail_path = Path(thumbnail_path)
         thumbnail_path.unlink(missing_ok=True)
@@ -151,6 +297,46 @@ class ObjectService:
         # 返回缩略图信息和mask_svg信息
         return results
 
+    def _save_mask_layers(
+        self, name: str, thumbnail_path: str | Path, img2svg: ImageToSvgConverter
+    ) -> dict:
+        """
+        将缩略图按类别转换为多个SVG图层并保存到Minio
+
+        :param name: 原对象名
+        :param thumbnail_path: 缩略图路径
+        :param img2svg: SVG转换器
+        :return: 图层清单，键为类别名称，值包含图层图像ID、颜色和多边形数量
+        """
+        layers_dir = Path(tempfile.mkdtemp(dir=TMPDIR))
+
+        try:
+            manifest = img2svg.convert_layers(thumbnail_path, layers_dir)
+
+            mask_layers = {}
+            for label, layer in manifest.items():
+                layer_name = Path(name).with_name(f"{Path(name).stem}_{label}.svg")
+                layer_info = self._save_image(
+                    layer_name,
+                    layer["path"],
+                    origin_type="mask_svg",
+                    content_type="image/svg+xml",
+                )
+                if not layer_info:
+                    logger.error(f"保存mask_svg图层失败: {layer_name}")
+                    continue
+
+                mask_layers[label] = {
+                    "id": layer_info["id"],
+                    "color": layer["color"],
+                    "polygon_count": layer["polygon_count"],
+                }
+        finally:
+            # 删除临时目录
+            shutil.rmtree(layers_dir, ignore_errors=True)
+
+        return mask_layers
+
     def _save_image(
         self,
         name: str,
@@ -303,6 +489,25 @@ class ObjectService:
             folders = "pointclouds"
             origin_name = name
 
+            # 以LAZ格式保存时先压缩，减少存储和传输的数据量
+            # 分块统计类别点数、高程直方图和点密度，压缩时在同一次遍历中完成
+            upload_path, laz_path = file_path, None
+            if POINTCLOUD_STORAGE_FORMAT == "laz" and not is_compressed(file_path):
+                with tempfile.NamedTemporaryFile(
+                    dir=TMPDIR, suffix=".laz", delete=False
+                ) as temp_file:
+                    laz_path = Path(temp_file.name)
+
+                stats = LasStats.from_file(file_path)
+                upload_path = convert_las(
+                    file_path, laz_path, compress=True, stats=stats
+                )
+                las_stats = stats.result()
+                name = Path(name).with_suffix(".laz").name
+                content_type = "application/vnd.laz"
+            else:
+                las_stats = get_las_stats(file_path)
+
             # 获取可行的Minio对象名
             object_name = Path(folders) / name
             object_name = str(object_name)
@@ -311,11 +516,16 @@ class ObjectService:
             )
             name = Path(object_name).name
 
-            # 读取点云文件
-            las = laspy.read(file_path)
-            point_count = las.header.point_count
+            # 只读取点云文件头，是否已分类根据全部点的类别统计判断
+            las_metadata = get_las_metadata(file_path, sample_size=0)
+            las_metadata |= {
+                "class_counts": json.dumps(las_stats["class_counts"]),
+                "z_histogram": json.dumps(las_stats["z_histogram"]),
+                "density": las_stats["density"],
+                "is_classified": las_stats["is_classified"],
+            }
             metadata = {
-                "point_count": point_count,
+                "point_count": las_metadata["point_count"],
                 "origin_name": origin_name,
                 "type": "pointcloud",
             }
@@ -324,7 +534,7 @@ class ObjectService:
             self.minio_client.fput_object(
                 self.bucket_name,
                 object_name,
-                str(file_path),
+                str(upload_path),
                 content_type=content_type,
                 metadata=metadata,
             )
@@ -340,7 +550,32 @@ class ObjectService:
 
             # 保存点云元数据到数据库
             pointcloud_id = self.queries.insert_pointcloud(
-                object_id=object_id, **metadata
+                object_id=object_id, **las_metadata
+            )
+
+            # 渲染俯视缩略图，已分类的点云按类别着色
+            thumbnail_id = self._save_pointcloud_thumbnail(
+                name,
+                file_path,
+                object_id=object_id,
+                color_by="class" if las_metadata["is_classified"] else "height",
+            )
+
+            # 构建空间索引，范围查询只读取相交的瓦片
+            if POINTCLOUD_INDEX_MODE == "on":
+                self._save_pointcloud_index(file_path, pointcloud_id, object_id)
+
+            # 保存COPC副本，查看器可以通过 `/file` 路由直接按需读取
+            if COPC_INGEST_MODE == "alongside":
+                copc_id = self._save_copc(name, file_path, origin_name=origin_name)
+                if copc_id:
+                    self.queries.update_pointcloud_copc_id(
+                        id=pointcloud_id, copc_id=copc_id
+                    )
+
+            # 推送Potree发布任务
+            self._populate_potree_status(
+                self.queries.get_pointcloud(id=pointcloud_id, object_id=None)
             )
 
             logger.info(f"成功保存点云: {name}, ID: {pointcloud_id}")
@@ -349,8 +584,141 @@ class ObjectService:
             logger.error(traceback.format_exc())
             return None
         else:
-            pointcloud_info = {"id": pointcloud_id, "object_id": object_id}
+            pointcloud_info = {
+                "id": pointcloud_id,
+                "object_id": object_id,
+                "thumbnail_id": thumbnail_id,
+            }
             return Box(pointcloud_info)
+        finally:
+            # 删除压缩后的临时文件
+            if laz_path:
+                laz_path.unlink(missing_ok=True)
+
+    def _save_pointcloud_thumbnail(
+        self, name: str, file_path: Path, *, object_id: int, color_by: str
+    ) -> int | None:
+        """
+        渲染点云的俯视缩略图并保存，渲染失败不影响原点云的保存
+
+        :param name: 点云文件名
+        :param file_path: 点云文件路径
+        :param object_id: 点云的对象ID
+        :param color_by: 着色方式，height 或 class
+        :return: 缩略图的图像ID，如果保存失败则返回None
+        """
+        thumbnail_path = Path(TMPDIR) / f"{Path(file_path).stem}_thumbnail.jpg"
+        try:
+            las2thumbnail(file_path, thumbnail_path, color_by=color_by)
+
+            thumbnail_info = self._save_image(
+                Path(name).with_suffix(".jpg").name,
+                thumbnail_path,
+                origin_type="thumbnail",
+            )
+            self.queries.update_thumbnail_id(
+                object_id=object_id, thumbnail_image_id=thumbnail_info["id"]
+            )
+        except Exception as e:
+            logger.error(f"保存点云缩略图时发生错误: {e}")
+            logger.error(traceback.format_exc())
+            return None
+        else:
+            return thumbnail_info["id"]
+        finally:
+            thumbnail_path.unlink(missing_ok=True)
+
+    def _save_pointcloud_index(
+        self, file_path: Path, pointcloud_id: int, object_id: int
+    ) -> str | None:
+        """
+        构建点云的空间索引，将瓦片和索引清单保存到Minio，构建失败不影响原点云的保存
+
+        :param file_path: 点云文件路径
+        :param pointcloud_id: 点云ID
+        :param object_id: 点云的对象ID
+        :return: 索引清单的对象名，如果保存失败则返回None
+        """
+        try:
+            etag = self.queries.get_object(id=object_id)["etag"]
+            prefix = f"{POINTCLOUD_INDEX_PREFIX}/{etag}"
+
+            with tempfile.TemporaryDirectory(dir=TMPDIR) as tmp_dir:
+                manifest = build_tile_index(file_path, tmp_dir)
+                upload_folder(self.minio_client, self.bucket_name, tmp_dir, prefix)
+
+            index_path = f"{prefix}/index.json"
+            data = json.dumps(manifest).encode("utf-8")
+            self.minio_client.put_object(
+                self.bucket_name,
+                index_path,
+                BytesIO(data),
+                len(data),
+                content_type="application/json",
+            )
+            self.queries.update_pointcloud_index_path(
+                id=pointcloud_id, index_path=index_path
+            )
+
+            logger.info(f"成功保存点云空间索引: {index_path}")
+        except Exception as e:
+            logger.error(f"保存点云空间索引时发生错误: {e}")
+            logger.error(traceback.format_exc())
+            return None
+        else:
+            return index_path
+
+    def _save_copc(self, name: str, file_path: Path, *, origin_name: str) -> int | None:
+        """
+        将点云转换为COPC并保存到Minio，转换失败不影响原点云的保存
+
+        :param name: 原点云的文件名
+        :param file_path: 原点云的文件路径
+        :param origin_name: 原始上传的名称
+        :return: COPC对象的ID，如果保存失败则返回None
+        """
+        copc_path = None
+        try:
+            # 已经是COPC时直接上传，不再转换
+            if is_copc(file_path):
+                upload_path = file_path
+            else:
+                copc_path = las2copc(
+                    file_path, Path(TMPDIR) / f"{Path(file_path).stem}.copc.laz"
+                )
+                upload_path = copc_path
+
+            folders = "pointclouds/copc"
+            object_name = get_available_object_name(
+                self.minio_client,
+                self.bucket_name,
+                f"{folders}/{Path(name).stem}.copc.laz",
+            )
+
+            self.minio_client.fput_object(
+                self.bucket_name,
+                object_name,
+                str(upload_path),
+                content_type="application/vnd.laszip+copc",
+            )
+            object_id = self._save_object_metadata(
+                Path(object_name).name,
+                folders,
+                type="pointcloud",
+                origin_name=origin_name,
+                origin_type="copc",
+            )
+
+            logger.info(f"成功保存COPC: {object_name}, 对象ID: {object_id}")
+        except Exception as e:
+            logger.error(f"保存COPC时发生错误: {e}")
+            logger.error(traceback.format_exc())
+            return None
+        else:
+            return object_id
+        finally:
+            if copc_path:
+                Path(copc_path).unlink(missing_ok=True)
 
     def delete(self, id) -> bool:
         """
@@ -716,58 +1084,33 @@ class ObjectService:
             logger.error(f"获取分享链接时发生错误: {e}")
             logger.error(traceback.format_exc())
 
-    def _populate_potree(
-        self,
-        object_data: dict,
-        *,
-        is_classified: bool,
-        origin_name: str | None = None,
-        use_origin_name: bool = False,
-    ):
+    def _populate_potree(self, object_data: dict, *, is_classified: bool):
         """
-        填充对象数据的Potree分享链接
+        将点云转换为Potree并上传到Minio，填充对象数据的Potree分享链接
+
+        PotreePublisher在本地POTREE_SERVER_ROOT中生成文件，上传后删除本地的点云和页面，
+        所有节点都通过 `/file` 路由访问Minio中的Potree文件。
 
         :param object_data: 对象数据
+        :param is_classified: 点云是否已分类
         :return: 填充后的对象数据
         """
-        try:
-            # 利用etag生成唯一的临时文件名
-            etag = object_data["etag"]
-            tmp_file_path = f"{TMPDIR}/{etag}.las"
+        # 利用etag生成唯一的临时文件名
+        etag = object_data["etag"]
+        tmp_file_path = Path(TMPDIR) / f"{etag}{Path(object_data['name']).suffix}"
 
-            # 获取Potree分享链接
-            potree_link = furl(
-                f"{POTREE_BASE_URL}/{POTREE_VIEWER_FOLDER}/{etag}.html"
-            ).url
-
-            # 检测生成文件是否已经存在
-            potree_html_path = (
-                Path(POTREE_SERVER_ROOT) / POTREE_VIEWER_FOLDER / f"{etag}.html"
-            )
-
-            # 如果直接提供了 origin_name，则使用该名称
-            if origin_name and use_origin_name:
-                origin_name = Path(origin_name).stem
-                potree_html_path = (
-                    Path(POTREE_SERVER_ROOT)
-                    / POTREE_VIEWER_FOLDER
-                    / f"{origin_name}.html"
-                )
-                potree_link = furl(
-                    f"{POTREE_BASE_URL}/{POTREE_VIEWER_FOLDER}/{origin_name}.html"
-                ).url
-
-            if potree_html_path.is_file():
-                logger.info(f"Potree文件已存在: {tmp_file_path}")
-                object_data["potree_link"] = potree_link
-                return object_data
-            # return
+        potree_root = Path(POTREE_SERVER_ROOT)
+        potree_html_path = potree_root / POTREE_VIEWER_FOLDER / f"{etag}.html"
+        potree_cloud_path = potree_root / POTREE_CLOUD_FOLDER / etag
 
+        try:
             # 获取 Minio 对象名
             object_name = get_object_name(object_data["name"], object_data["folders"])
 
             # 从 Minio 下载文件
-            self.minio_client.fget_object(self.bucket_name, object_name, tmp_file_path)
+            self.minio_client.fget_object(
+                self.bucket_name, object_name, str(tmp_file_path)
+            )
 
             # 运行 PotreePublisher
             is_classified = "--classified" if is_classified else "--no-classified"
@@ -778,8 +1121,27 @@ class ObjectService:
             logger.debug(f"运行PotreePublisher: {cmd}")
             cmd()
 
+            # 上传页面和点云，保持与本地相同的目录结构，页面中的相对路径无需修改
+            self._sync_potree_libs()
+            potree_path = f"{POTREE_PREFIX}/{POTREE_VIEWER_FOLDER}/{etag}.html"
+            self.minio_client.fput_object(
+                self.bucket_name,
+                potree_path,
+                str(potree_html_path),
+                content_type="text/html",
+            )
+            upload_folder(
+                self.minio_client,
+                self.bucket_name,
+                potree_cloud_path,
+                f"{POTREE_PREFIX}/{POTREE_CLOUD_FOLDER}/{etag}",
+            )
+
             # 填充对象数据
-            object_data["potree_link"] = potree_link
+            object_data["potree_path"] = potree_path
+            object_data["potree_link"] = furl(
+                f"{SHARE_LINK_BASE_URL}/{MINIO_BUCKET}/{potree_path}"
+            ).url
 
         except Exception as e:
             logger.error(f"填充Potree分享链接时发生错误: {e}")
@@ -788,8 +1150,121 @@ class ObjectService:
         else:
             return object_data
         finally:
-            # 删除临时文件
-            Path(tmp_file_path).unlink(missing_ok=True)
+            # 删除临时文件和本地生成的Potree文件
+            tmp_file_path.unlink(missing_ok=True)
+            potree_html_path.unlink(missing_ok=True)
+            shutil.rmtree(potree_cloud_path, ignore_errors=True)
+
+    def _sync_potree_libs(self):
+        """
+        将Potree页面依赖的静态文件上传到Minio，所有点云共用一份
+
+        Redis中记录已上传的版本，本地静态文件更新后重新上传。
+        """
+        exclude = (POTREE_VIEWER_FOLDER, POTREE_CLOUD_FOLDER)
+        version = get_folder_version(POTREE_SERVER_ROOT, exclude=exclude)
+        libs_key = f"{POTREE_PREFIX}:libs"
+        if self.redis_client.get(libs_key) == version.encode():
+            return
+
+        upload_folder(
+            self.minio_client,
+            self.bucket_name,
+            POTREE_SERVER_ROOT,
+            POTREE_PREFIX,
+            exclude=exclude,
+        )
+        self.redis_client.set(libs_key, version)
+        logger.info(f"同步Potree静态文件, 版本: {version}")
+
+    def _populate_potree_status(self, pointcloud_data: dict):
+        """
+        填充点云的Potree发布状态和分享链接，尚未发布时推送发布任务
+
+        同一etag只有第一个请求能写入排队状态并推送任务，其余请求直接返回当前状态。
+        排队和运行状态带有过期时间，任务丢失后后续请求会重新推送。
+
+        :param pointcloud_data: 点云数据
+        :return: 填充后的点云数据
+        """
+        etag = pointcloud_data["etag"]
+        potree_path = pointcloud_data.get("potree_path")
+        if potree_path:
+            pointcloud_data["potree_status"] = "completed"
+            pointcloud_data["potree_link"] = furl(
+                f"{SHARE_LINK_BASE_URL}/{MINIO_BUCKET}/{potree_path}"
+            ).url
+            return pointcloud_data
+
+        if self.redis_client is None:
+            logger.warning("未配置Redis，无法推送Potree发布任务")
+            pointcloud_data["potree_status"] = None
+            return pointcloud_data
+
+        status_key = f"potree:{etag}:status"
+        if self.redis_client.set(status_key, "queued", nx=True, ex=POTREE_LOCK_TTL):
+            task_info = {"type": "potree", "id": pointcloud_data["id"]}
+            push_task(self.redis_client, task_info)
+            logger.info(f"推送Potree发布任务: {task_info}")
+
+            status = "queued"
+        else:
+            status = self.redis_client.get(status_key)
+            status = status.decode("utf-8") if status else "queued"
+
+        pointcloud_data["potree_status"] = status
+        return pointcloud_data
+
+    def publish_potree(self, id: int, **kwargs) -> bool:
+        """
+        将点云发布为Potree，由后台任务调用
+
+        :param id: 点云ID
+        :return: 发布是否成功
+        """
+        pointcloud_data = self.get_pointcloud(id=id, should_potree=False)
+        if not pointcloud_data:
+            return False
+
+        etag = pointcloud_data.etag
+        status_key = f"potree:{etag}:status"
+        lock_key = f"potree:{etag}:lock"
+
+        # 相同文件的其他点云已经发布时直接复用
+        potree_path = self.queries.get_potree_path(etag=etag)
+        if potree_path:
+            self.queries.update_potree_path(etag=etag, potree_path=potree_path)
+            logger.info(f"复用已发布的Potree: {potree_path}")
+            return True
+
+        # 同一点云的重复任务只有获得锁的worker执行
+        if not self.redis_client.set(lock_key, 1, nx=True, ex=POTREE_LOCK_TTL):
+            logger.info(f"Potree正在由其他任务发布: {etag}")
+            return False
+
+        try:
+            self.redis_client.set(status_key, "running", ex=POTREE_LOCK_TTL)
+
+            # 旧数据没有分类信息时，按是否为系统生成判断
+            is_classified = pointcloud_data.get("is_classified")
+            if is_classified is None:
+                is_classified = pointcloud_data.origin_type == "system"
+
+            self._populate_potree(pointcloud_data, is_classified=is_classified)
+            self.queries.update_potree_path(
+                etag=etag, potree_path=pointcloud_data.potree_path
+            )
+        except Exception as e:
+            logger.error(f"发布Potree时发生错误: {e}")
+            # 失败状态保留一段时间，避免每次请求都重新转换损坏的文件
+            self.redis_client.set(status_key, "failed", ex=POTREE_FAILED_TTL)
+            return False
+        else:
+            self.redis_client.delete(status_key)
+            logger.info(f"成功发布Potree: {pointcloud_data.name}, ID: {id}")
+            return True
+        finally:
+            self.redis_client.delete(lock_key)
 
     def get_pointcloud(
         self,
@@ -820,17 +1295,23 @@ class ObjectService:
             pointcloud_data = Box(pointcloud_data)
             logger.debug(f"获取到的点云数据: {pointcloud_data}")
 
+            # 解析JSON格式的统计信息
+            for key in ["class_counts", "z_histogram"]:
+                if isinstance(pointcloud_data.get(key), str):
+                    pointcloud_data[key] = json.loads(pointcloud_data[key])
+
             # 填充点云数据
             self._populate_object(pointcloud_data)
 
-            # 填充Potree分享链接
+            # 填充COPC分享链接
+            if pointcloud_data.get("copc_id"):
+                copc_data = self.queries.get_object(id=pointcloud_data.copc_id)
+                if copc_data:
+                    pointcloud_data.copc_link = self._get_share_link(copc_data)
+
+            # 填充Potree发布状态，未发布时只推送任务，不等待转换
             if should_potree:
-                is_classified = pointcloud_data.origin_type == "system"
-                self._populate_potree(
-                    pointcloud_data,
-                    is_classified=is_classified,
-                    origin_name=pointcloud_data.origin_name,
-                )
+                self._populate_potree_status(pointcloud_data)
 
             logger.info(f"成功获取点云: {pointcloud_data.name}, ID: {id}")
         except Exception as e:
@@ -943,33 +1424,423 @@ class ObjectService:
         return object_id
 
     def copy2local(
-        self, object_data: dict, output_path: str | Path | None = None
+        self,
+        object_data: dict,
+        output_path: str | Path | None = None,
+        *,
+        decompress: bool = False,
     ) -> Path | None:
         """
         将Minio对象复制到本地文件
 
         :param object_data: 对象数据
         :param output_path: 输出路径
+        :param decompress: 是否将LAZ点云解压为LAS，供只支持LAS的工具使用
         :return: 本地文件路径
         """
         try:
             # 获取Minio对象名
             object_name = get_object_name(object_data["name"], object_data["folders"])
+            decompress = decompress and Path(object_name).suffix.casefold() == ".laz"
+            suffix = ".las" if decompress else Path(object_name).suffix
 
             if output_path is None:
                 # 生成临时命名文件
                 with tempfile.NamedTemporaryFile(
-                    delete=False, suffix=Path(object_name).suffix
+                    delete=False, suffix=suffix
                 ) as temp_file:
                     temp_file_path = Path(temp_file.name)
 
                 output_path = temp_file_path
 
-            # 从Minio下载文件
-            self.minio_client.fget_object(self.bucket_name, object_name, output_path)
+            if not decompress:
+                self._download(object_data, object_name, output_path)
+                return output_path
+
+            # 下载压缩文件后解压到输出路径
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".laz") as temp_file:
+                laz_path = Path(temp_file.name)
+            try:
+                self._download(object_data, object_name, laz_path)
+                convert_las(laz_path, output_path, compress=False)
+            finally:
+                laz_path.unlink(missing_ok=True)
 
-            return output_path
+            return Path(output_path)
         except Exception as e:
             logger.error(f"复制Minio对象到临时文件夹时发生错误: {e}")
             logger.error(traceback.format_exc())
             return None
+
+    def _download(self, object_data: dict, object_name: str, output_path: str | Path):
+        # 优先使用后台预取的文件，未预取时从Minio下载
+        etag = object_data.get("etag")
+        if etag and prefetcher.take(etag, output_path):
+            return
+
+        self.minio_client.fget_object(self.bucket_name, object_name, output_path)
+
+    def prefetch(self, object_data: dict) -> bool:
+        """
+        在后台将Minio对象下载到本地，之后的copy2local直接使用下载好的文件
+
+        :param object_data: 对象数据
+        :return: 是否已预取或开始预取，超出磁盘预算时返回False
+        """
+        if not object_data.get("etag"):
+            return False
+
+        object_name = get_object_name(object_data["name"], object_data["folders"])
+        size = object_data.get("size")
+        if size is None:
+            size = self.minio_client.stat_object(self.bucket_name, object_name).size
+
+        return prefetcher.prefetch(
+            object_data["etag"],
+            Path(object_name).suffix,
+            size,
+            lambda path: self.minio_client.fget_object(
+                self.bucket_name, object_name, str(path)
+            ),
+        )
+
+    def get_cached_copy(self, object_data: dict) -> Path | None:
+        """
+        获取Minio对象在本地的缓存副本，缓存文件以etag命名，对象更新后自动失效
+
+        缓存总大小超过OBJECT_CACHE_SIZE时按最近使用时间淘汰。
+
+        :param object_data: 对象数据
+        :return: 本地缓存文件路径
+        """
+        suffix = Path(object_data["name"]).suffix
+        cache_path = Path(TMPDIR) / "objects" / f"{object_data['etag']}{suffix}"
+        if cache_path.is_file():
+            try:
+                # 更新修改时间作为最近使用时间，淘汰时保留最近使用的文件
+                os.utime(cache_path)
+                return cache_path
+            except FileNotFoundError:
+                # 刚被其他进程淘汰，重新下载
+                pass
+
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # 先下载到同目录的临时文件再原子重命名，避免并发请求读到不完整的文件
+        with tempfile.NamedTemporaryFile(
+            dir=cache_path.parent, suffix=".part", delete=False
+        ) as temp_file:
+            temp_path = Path(temp_file.name)
+
+        if self.copy2local(object_data, temp_path) is None:
+            temp_path.unlink(missing_ok=True)
+            return None
+
+        temp_path.replace(cache_path)
+        logger.info(f"缓存Minio对象到本地: {cache_path}")
+
+        evict_files(cache_path.parent, OBJECT_CACHE_SIZE, keep=cache_path)
+
+        return cache_path
+
+    def get_image_tile_info(self, id: int) -> Box | None:
+        """
+        获取影像瓦片金字塔的信息
+
+        :param id: 图像ID
+        :return: 原图尺寸、瓦片边长和缩放级别范围，如果图像不存在则返回None
+        """
+        image_data = self.queries.get_image(id=id, object_id=None)
+        if not image_data:
+            logger.warning(f"未找到ID为{id}的图像")
+            return None
+
+        width, height = image_data["width"], image_data["height"]
+        return Box(
+            width=width,
+            height=height,
+            tile_size=TILE_SIZE,
+            min_zoom=0,
+            max_zoom=get_max_zoom(width, height),
+        )
+
+    def get_image_tile(
+        self, id: int, z: int, x: int, y: int, *, format: str = "webp"
+    ) -> bytes | None:
+        """
+        获取影像的XYZ瓦片，只通过HTTP范围请求读取瓦片覆盖的窗口
+
+        :param id: 图像ID
+        :param z: 缩放级别
+        :param x: 瓦片列号
+        :param y: 瓦片行号
+        :param format: 瓦片格式
+        :return: 瓦片字节，如果图像或瓦片不存在则返回None
+        """
+        image_data = self.queries.get_image(id=id, object_id=None)
+        if not image_data:
+            logger.warning(f"未找到ID为{id}的图像")
+            return None
+
+        image_data = Box(image_data)
+
+        window = get_tile_window(z, x, y, image_data.width, image_data.height)
+        if window is None:
+            logger.warning(f"瓦片超出图像范围: {z}/{x}/{y}")
+            return None
+
+        # 命中缓存则直接返回
+        cache_key = (image_data.etag, z, x, y, format)
+        if (tile := tile_cache.get(cache_key)) is not None:
+            logger.debug(f"影像瓦片缓存命中: {cache_key}")
+            return tile
+
+        # 优先从COG读取
+        source_data = image_data
+        if image_data.get("cog_id"):
+            source_data = Box(
+                self.queries.get_image(id=image_data.cog_id, object_id=None)
+            )
+
+        # 通过预签名URL读取，GDAL只会请求瓦片所需的字节范围
+        object_name = get_object_name(source_data.name, source_data.folders)
+        url = self.minio_client.presigned_get_object(self.bucket_name, object_name)
+
+        col_off, row_off, span = window
+        with (
+            rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR"),
+            rasterio.open(url) as src,
+        ):
+            indexes = get_display_indexes(src)
+            data = read_window(
+                src,
+                col_off,
+                row_off,
+                span,
+                TILE_SIZE,
+                indexes=indexes,
+                resampling=Resampling.bilinear,
+                with_alpha=True,
+            )
+
+            # 非8位影像按整幅图像的统计范围拉伸
+            if data.dtype != np.uint8 and image_data.etag not in stretch_ranges:
+                # 只保存少量影像的拉伸范围，超出时整体清空
+                if len(stretch_ranges) >= 1024:
+                    stretch_ranges.clear()
+                stretch_ranges[image_data.etag] = get_stretch_range(src, indexes)
+
+        rgb = data[:3]
+        if data.dtype != np.uint8:
+            rgb = stretch_to_uint8(rgb, *stretch_ranges[image_data.etag])
+        alpha = np.where(data[3:] > 0, 255, 0).astype(np.uint8)
+
+        # jpg不支持透明通道
+        bands = rgb if format == "jpg" else np.concatenate([rgb, alpha])
+        tile = encode_image(ep.rearrange(bands, "c h w -> h w c"), format)
+
+        tile_cache.set(cache_key, tile)
+        logger.debug(f"生成影像瓦片: {cache_key}")
+
+        return tile
+
+    def render_image(
+        self,
+        id: int,
+        *,
+        width: int | None = None,
+        height: int | None = None,
+        crop: tuple[int, int, int, int] | None = None,
+        format: str = "webp",
+        quality: int = 85,
+    ) -> str | None:
+        """
+        生成图像的缩放裁剪版本，结果作为派生文件缓存到Minio
+
+        :param id: 图像ID
+        :param width: 输出宽度
+        :param height: 输出高度
+        :param crop: 原图中的裁剪区域 (x0, y0, x1, y1)
+        :param format: 输出格式
+        :param quality: 有损格式的压缩质量
+        :return: 派生文件的分享链接，如果图像不存在则返回None
+        """
+        image_data = self.queries.get_image(id=id, object_id=None)
+        if not image_data:
+            logger.warning(f"未找到ID为{id}的图像")
+            return None
+
+        image_data = Box(image_data)
+        if image_data.content_type == "image/svg+xml":
+            msg = "SVG images cannot be rendered"
+            raise ValueError(msg)
+
+        # 校验裁剪区域
+        if crop:
+            x0, y0, x1, y1 = crop
+            if not (
+                0 <= x0 < x1 <= image_data.width and 0 <= y0 < y1 <= image_data.height
+            ):
+                msg = f"Invalid crop box: {crop}"
+                raise ValueError(msg)
+        else:
+            x0, y0, x1, y1 = 0, 0, image_data.width, image_data.height
+
+        # 只提供一边时，按宽高比计算的另一边也不能超过上限
+        size = get_fit_size(
+            x1 - x0,
+            y1 - y0,
+            width,
+            height,
+            max_dimension=RENDER_MAX_DIMENSION,
+            max_size=RENDER_MAX_DIMENSION,
+        )
+
+        # 命中缓存则直接返回派生文件的链接
+        variant = f"{size[0]}x{size[1]}_{x0}-{y0}-{x1}-{y1}_q{quality}.{format}"
+        derivative_cache = self._get_derivative_cache()
+        if object_name := derivative_cache.get(image_data.etag, variant):
+            return furl(f"{SHARE_LINK_BASE_URL}/{MINIO_BUCKET}/{object_name}").url
+
+        # 解码时尽量只读取输出所需的分辨率
+        source_data = image_data
+        if image_data.get("cog_id"):
+            source_data = Box(
+                self.queries.get_image(id=image_data.cog_id, object_id=None)
+            )
+        object_name = get_object_name(source_data.name, source_data.folders)
+
+        if source_data.content_type == "image/tiff":
+            url = self.minio_client.presigned_get_object(self.bucket_name, object_name)
+            img = read_tiff_region(url, crop, size)
+        else:
+            response = self.minio_client.get_object(self.bucket_name, object_name)
+            try:
+                img = read_image_region(BytesIO(response.read()), crop, size)
+            finally:
+                response.close()
+                response.release_conn()
+
+        data = encode_image(img, format, quality)
+        _, content_type = RENDER_FORMATS[format]
+        object_name = derivative_cache.put(image_data.etag, variant, data, content_type)
+        logger.info(f"生成派生文件: {object_name}")
+
+        return furl(f"{SHARE_LINK_BASE_URL}/{MINIO_BUCKET}/{object_name}").url
+
+    def _get_derivative_cache(self) -> DerivativeCache:
+        # 派生文件缓存需要Redis，未传入redis_client时无法生成派生文件
+        if self.derivative_cache is None:
+            msg = "Derivative files require ObjectService to be created with a Redis client"
+            raise RuntimeError(msg)
+
+        return self.derivative_cache
+
+    def get_pointcloud_preview(self, id: int, *, budget: int) -> str | None:
+        """
+        生成点云的体素降采样预览，结果作为派生文件缓存到Minio
+
+        :param id: 点云ID
+        :param budget: 预览的最大点数
+        :return: 预览文件的分享链接，如果点云不存在则返回None
+        """
+        pointcloud_data = self.queries.get_pointcloud(id=id, object_id=None)
+        if not pointcloud_data:
+            logger.warning(f"未找到ID为{id}的点云")
+            return None
+
+        pointcloud_data = Box(pointcloud_data)
+
+        # 命中缓存则直接返回派生文件的链接
+        variant = f"preview_{budget}.bin"
+        derivative_cache = self._get_derivative_cache()
+        if object_name := derivative_cache.get(pointcloud_data.etag, variant):
+            return furl(f"{SHARE_LINK_BASE_URL}/{MINIO_BUCKET}/{object_name}").url
+
+        input_path = self.copy2local(pointcloud_data)
+        if input_path is None:
+            return None
+
+        try:
+            offset, xyz, classes = voxel_downsample(input_path, budget)
+        finally:
+            Path(input_path).unlink(missing_ok=True)
+
+        data = encode_preview(offset, xyz, classes)
+        object_name = derivative_cache.put(
+            pointcloud_data.etag, variant, data, "application/octet-stream"
+        )
+        logger.info(f"生成点云预览: {object_name}, 点数: {len(xyz)}")
+
+        return furl(f"{SHARE_LINK_BASE_URL}/{MINIO_BUCKET}/{object_name}").url
+
+    def query_pointcloud(
+        self,
+        id: int,
+        *,
+        bbox: tuple[float, float, float, float] | None = None,
+        polygon: np.ndarray | None = None,
+    ) -> bytes | None:
+        """
+        查询点云中位于范围或多边形内的点，只读取与查询范围相交的索引瓦片
+
+        :param id: 点云ID
+        :param bbox: 查询范围 (min_x, min_y, max_x, max_y)，使用点云原始坐标
+        :param polygon: 形状为(M, 2)的查询多边形，使用点云原始坐标
+        :return: 与预览相同格式的二进制数据，如果点云不存在则返回None
+        """
+        pointcloud_data = self.queries.get_pointcloud(id=id, object_id=None)
+        if not pointcloud_data:
+            logger.warning(f"未找到ID为{id}的点云")
+            return None
+
+        pointcloud_data = Box(pointcloud_data)
+        if not pointcloud_data.get("index_path"):
+            msg = f"Pointcloud {id} has no spatial index"
+            raise ValueError(msg)
+
+        if pointcloud_data.etag not in index_manifests:
+            response = self.minio_client.get_object(
+                self.bucket_name, pointcloud_data.index_path
+            )
+            try:
+                manifest = json.loads(response.read())
+            finally:
+                response.close()
+                response.release_conn()
+
+            if len(index_manifests) >= 1024:
+                index_manifests.clear()
+            index_manifests[pointcloud_data.etag] = manifest
+
+        manifest = index_manifests[pointcloud_data.etag]
+        offset = np.asarray(manifest["offset"])
+
+        # 多边形查询先按外包矩形筛选瓦片
+        if polygon is not None:
+            polygon_bbox = (*polygon.min(axis=0), *polygon.max(axis=0))
+            bbox = polygon_bbox if bbox is None else bbox
+
+        prefix = str(Path(pointcloud_data.index_path).parent)
+        results = [np.empty(0, dtype=TILE_POINT_DTYPE)]
+        for name in get_index_tiles(manifest, bbox):
+            response = self.minio_client.get_object(
+                self.bucket_name, f"{prefix}/{name}.bin"
+            )
+            try:
+                records = np.frombuffer(response.read(), dtype=TILE_POINT_DTYPE)
+            finally:
+                response.close()
+                response.release_conn()
+
+            results.append(
+                filter_tile_points(records, offset, bbox=bbox, polygon=polygon)
+            )
+
+        records = np.concatenate(results)
+        logger.info(
+            f"查询点云 {id}: 读取瓦片 {len(results) - 1} 个, 命中 {len(records)} 个点"
+        )
+
+        xyz = np.column_stack([records["x"], records["y"], records["z"]])
+        return encode_preview(offset, xyz, records["classification"])
@@ -1,7 +1,10 @@
+import json
+
 from box import Box, BoxList
 from loguru import logger
 from minio import Minio
 from pugsql.compiler import Module
+from redis import Redis
 
 from app.utils.table_funcs import delete_fields
 
@@ -9,17 +12,31 @@ from .object_service import ObjectService
 
 
 class ProjectService:
-    def __init__(self, queries: Module, minio_client: Minio):
+    def __init__(
+        self, queries: Module, minio_client: Minio, redis_client: Redis | None = None
+    ):
         self.queries = queries
-        self.object_service = ObjectService(queries, minio_client)
+        self.object_service = ObjectService(queries, minio_client, redis_client)
 
-    def create(self, type, name, cover_image_id=None, status="waiting", **kwargs):
+    def create(
+        self,
+        type,
+        name,
+        cover_image_id=None,
+        status="waiting",
+        priority="normal",
+        **kwargs,
+    ):
         logger.debug(f"Creating project of type {type}")
         if not name:
             name = "未命名项目"
 
         return self.queries.create_project(
-            name=name, type=type, cover_image_id=cover_image_id, status=status
+            name=name,
+            type=type,
+            cover_image_id=cover_image_id,
+            status=status,
+            priority=priority,
         )
 
     def get(self, id):
@@ -70,6 +87,10 @@ class ProjectService:
 
         return True
 
+    def update_status(self, id, status):
+        logger.debug(f"Updating project {id} status to {status}")
+        return self.queries.update_project_status(id=id, status=status)
+
     def count(
         self, types: tuple[str] | None = None, statuses: tuple[str] | None = None
     ):
@@ -105,6 +126,27 @@ class ProjectService:
             if "thumbnail_link" in image_info:
                 project[f"{key}_thumbnail_link"] = image_info.thumbnail_link
 
+        # 按类别拆分的mask svg图层，前端只加载可见类别
+        if project.get("mask_layers"):
+            mask_layers = project.pop("mask_layers")
+            if isinstance(mask_layers, str):
+                mask_layers = json.loads(mask_layers)
+
+            layer_ids = [layer["id"] for layer in mask_layers.values()]
+            layer_infos = self.object_service.get_images(
+                ids=layer_ids, should_thumbnail=False
+            )
+            layer_links = {info.id: info.share_link for info in layer_infos or []}
+
+            project["mask_layer_links"] = {
+                label: {
+                    "link": layer_links.get(layer["id"]),
+                    "color": layer["color"],
+                    "polygon_count": layer["polygon_count"],
+                }
+                for label, layer in mask_layers.items()
+            }
+
         for key in ["pointcloud", "result_pointcloud"]:
             column_name = f"{key}_id"
             if not project.get(column_name):
@@ -116,6 +158,7 @@ class ProjectService:
             project[f"{key}_link"] = pointcloud_info.share_link
             # 将key中的pointcloud替换为potree
             key = key.replace("pointcloud", "potree")
+            project[f"{key}_status"] = pointcloud_info.get("potree_status")
             if pointcloud_info.get("potree_link"):
                 project[f"{key}_link"] = pointcloud_info.potree_link
 
@@ -0,0 +1,109 @@
+import json
+import traceback
+
+from box import Box
+from loguru import logger
+from pugsql.compiler import Module
+
+from app.config import RESULT_CACHE_MODE
+from app.utils.inference_funcs import get_model_version
+
+
+class ResultCacheService:
+    def __init__(self, queries: Module, enabled: bool = RESULT_CACHE_MODE == "on"):
+        """
+        推理结果缓存，以任务类型、输入对象的etag和模型版本为键保存complete_*查询的结果参数
+
+        模型配置或推理脚本变化后版本标识改变，旧的结果不再命中。
+
+        :param queries: 数据库查询
+        :param enabled: 是否使用缓存
+        """
+        self.queries = queries
+        self.enabled = enabled
+
+    def get(self, type: str, etags: list[str], model: str) -> Box | None:
+        """
+        获取相同输入和模型版本的推理结果
+
+        :param type: 任务类型
+        :param etags: 输入对象的etag，按输入顺序排列
+        :param model: 模型名称，见INFERENCE_MODELS
+        :return: complete_*查询的结果参数，没有缓存时返回None
+        """
+        if not self.enabled or not etags or not all(etags):
+            return None
+
+        row = self.queries.get_task_result(
+            type=type,
+            input_etags=",".join(etags),
+            model_version=get_model_version(model),
+        )
+        if not row:
+            return None
+
+        return Box(id=row["id"], result=json.loads(row["result"]))
+
+    def save(self, type: str, etags: list[str] | None, model: str, result: dict):
+        """
+        保存推理结果，保存失败不影响任务
+
+        :param type: 任务类型
+        :param etags: 输入对象的etag，按输入顺序排列
+        :param model: 模型名称
+        :param result: complete_*查询的结果参数
+        """
+        if not self.enabled or not etags or not all(etags):
+            return
+
+        try:
+            self.queries.save_task_result(
+                type=type,
+                input_etags=",".join(etags),
+                model=model,
+                model_version=get_model_version(model),
+                result=json.dumps(result, ensure_ascii=False),
+            )
+        except Exception as e:
+            logger.warning(f"保存推理结果缓存时发生错误: {e}")
+            logger.warning(traceback.format_exc())
+
+    def delete(self, id: int):
+        # 删除结果对象已不存在的缓存
+        self.queries.delete_task_result(id=id)
+
+    def invalidate(self, model: str | None = None, type: str | None = None) -> int:
+        """
+        删除缓存的推理结果，更新模型权重而配置和推理脚本不变时使用
+
+        :param model: 模型名称，默认为所有模型
+        :param type: 任务类型，默认为所有类型
+        :return: 删除的结果数量
+        """
+        return self.queries.delete_task_results(model=model, type=type)
+
+
+if __name__ == "__main__":
+    # python -m app.services.result_cache_service invalidate --model 2d_segmentation
+    import fire
+
+    from app.utils.connections_manager import ConnectionsManager
+
+    def invalidate(model: str | None = None, type: str | None = None):
+        """
+        删除缓存的推理结果
+
+        :param model: 模型名称，默认为所有模型
+        :param type: 任务类型，默认为所有类型
+        """
+        connections_manager = ConnectionsManager()
+        connections_manager.open()
+        try:
+            count = ResultCacheService(connections_manager.queries).invalidate(
+                model=model, type=type
+            )
+            logger.info(f"Deleted {count} cached results")
+        finally:
+            connections_manager.close()
+
+    fire.Fire({"invalidate": invalidate})
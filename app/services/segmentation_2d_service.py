@@ -1,31 +1,78 @@
+from io import BytesIO
 import json
 import mimetypes
 from pathlib import Path
+import tempfile
 
 from box import Box, BoxList
 from dotenv import load_dotenv
 from loguru import logger
 from minio import Minio
-from plumbum.cmd import micromamba
+from minio.error import S3Error
+import einops as ep
+import numpy as np
+from PIL import Image
 from pugsql.compiler import Module
+import rasterio
 from redis import Redis
 
-from app.config import SEGMENTATION_2D_BGR, TASK_QUEUE
+from app.config import (
+    INFERENCE_TIMEOUT,
+    MVT_CACHE_TTL,
+    OVERLAY_CACHE_SIZE,
+    RENDER_MAX_DIMENSION,
+    SEGMENTATION_2D_BGR,
+    SEGMENTATION_2D_TILE_MODE,
+    SEGMENTATION_2D_TILE_OVERLAP,
+    SEGMENTATION_2D_TILE_PREFIX,
+    SEGMENTATION_2D_TILE_SIZE,
+    SEGMENTATION_2D_TILE_THRESHOLD,
+    TASK_QUEUE,
+    TMPDIR,
+)
+from app.utils.cache_funcs import LRUCache
+from app.utils.inference_funcs import run_inference, run_inference_batch
+from app.utils.object_funcs import remove_folder
+from app.utils.overlay_funcs import (
+    blend_overlay,
+    colors2labels,
+    encode_image,
+    get_fit_size,
+)
+from app.utils.sliding_window_funcs import get_tile_windows, split_scene, stitch_tiles
 from app.utils.table_funcs import delete_fields
 from app.utils.tasks_funcs import push_task
+from app.utils.tile_funcs import (
+    TILE_SIZE,
+    encode_vector_tile,
+    get_max_zoom,
+    get_tile_window,
+    labels2features,
+    read_window,
+)
 
 from .object_service import ObjectService
 from .project_service import ProjectService
+from .result_cache_service import ResultCacheService
+
+# 叠加图缓存，键为(项目ID, 尺寸, 类别, 不透明度, 格式)
+overlay_cache = LRUCache(OVERLAY_CACHE_SIZE)
+
+# 矢量瓦片中的类别名称，与mask_svg中的类名一致
+tile_class_names = [name.strip().replace(" ", "-") for name in SEGMENTATION_2D_BGR]
 
 
 class Segmentation2DService:
     def __init__(self, queries: Module, minio_client: Minio, redis_client: Redis):
         self.queries = queries
-        self.project_service = ProjectService(queries, minio_client)
-        self.object_service = ObjectService(queries, minio_client)
+        self.project_service = ProjectService(queries, minio_client, redis_client)
+        self.object_service = ObjectService(queries, minio_client, redis_client)
+        self.result_cache_service = ResultCacheService(queries)
         self.redis_client = redis_client
 
-    def create(self, image_id, project_id=None, project_name=None, **kwargs):
+    def create(
+        self, image_id, project_id=None, project_name=None, priority="normal", **kwargs
+    ):
         with self.queries.transaction() as tx:
             if project_id:
                 project = self.project_service.get(project_id)
@@ -44,6 +91,7 @@ class Segmentation2DService:
                     type="2d_segmentation",
                     name=project_name,
                     cover_image_id=cover_image_id,
+                    priority=priority,
                 )
 
             last_id = self.queries.create_2d_segmentation(
@@ -56,7 +104,12 @@ class Segmentation2DService:
                 raise ValueError(msg)
 
         # 将任务推送到redis队列
-        task_info = {"type": "2d_segmentation", "id": last_id, "project_id": project_id}
+        task_info = {
+            "type": "2d_segmentation",
+            "id": last_id,
+            "project_id": project_id,
+            "priority": priority,
+        }
         push_task(self.redis_client, task_info)
 
         return task_info
@@ -87,6 +140,228 @@ class Segmentation2DService:
             msg = "Either id or project_id must be provided"
             raise ValueError(msg)
 
+    def render_overlay(
+        self,
+        project_id: int,
+        *,
+        width: int | None = None,
+        height: int | None = None,
+        classes: list[str] | None = None,
+        opacity: float = 0.5,
+        format: str = "png",
+    ) -> bytes | None:
+        """
+        将分割结果按类别着色后叠加到原图上，结果按参数缓存
+
+        :param project_id: 项目ID
+        :param width: 输出宽度
+        :param height: 输出高度
+        :param classes: 需要叠加的类别名称，为None时叠加所有类别
+        :param opacity: 叠加层不透明度
+        :param format: 输出格式
+        :return: 编码后的图像字节，如果项目不存在或未完成则返回None
+        """
+        project = self.queries.get_2d_segmentation(id=None, project_id=project_id)
+        if not project or not project["plot_image_id"]:
+            logger.warning(f"2D segmentation result not found: project_id={project_id}")
+            return None
+
+        project = Box(project)
+
+        # 获取输出尺寸
+        plot_image_info = self.queries.get_image(
+            id=project.plot_image_id, object_id=None
+        )
+        plot_image_info = Box(plot_image_info)
+        size = get_fit_size(
+            plot_image_info.width,
+            plot_image_info.height,
+            width,
+            height,
+            max_size=RENDER_MAX_DIMENSION,
+        )
+
+        # 将类别名称转换为颜色表中的标签
+        class_names = list(SEGMENTATION_2D_BGR.keys())
+        labels = None
+        if classes is not None:
+            unknown_classes = set(classes) - set(class_names)
+            if unknown_classes:
+                msg = f"Unknown classes: {unknown_classes}"
+                raise ValueError(msg)
+            labels = tuple(sorted(class_names.index(c) for c in classes))
+
+        # 命中缓存则直接返回
+        cache_key = (project_id, project.plot_image_id, size, labels, opacity, format)
+        if (overlay := overlay_cache.get(cache_key)) is not None:
+            logger.debug(f"Overlay cache hit: {cache_key}")
+            return overlay
+
+        # 读取原图和分割图，分割图使用最近邻插值以保留类别颜色
+        # 分割图的缩略图使用LANCZOS缩放，类别边界的颜色被混合，只能读取原图
+        img = self._read_overlay_image(project.image_id, size, Image.BILINEAR)
+        plot_img = self._read_overlay_image(
+            project.plot_image_id, size, Image.NEAREST, use_thumbnail=False
+        )
+
+        # 颜色表为BGR顺序，转换为RGB
+        colors = np.array([bgr[::-1] for bgr in SEGMENTATION_2D_BGR.values()])
+        label_map = colors2labels(plot_img, colors)
+        blended = blend_overlay(img, label_map, colors, classes=labels, opacity=opacity)
+
+        overlay = encode_image(blended, format)
+        overlay_cache.set(cache_key, overlay)
+        logger.debug(f"Overlay rendered: {cache_key}")
+
+        return overlay
+
+    def _read_overlay_image(
+        self,
+        image_id: int,
+        size: tuple[int, int],
+        resample: int,
+        *,
+        use_thumbnail: bool = True,
+    ) -> np.ndarray:
+        """
+        读取图像并缩放到指定尺寸，缩略图足够大时优先使用缩略图
+
+        :param image_id: 图像ID
+        :param size: 输出尺寸 (width, height)
+        :param resample: 缩放插值方法
+        :param use_thumbnail: 是否可以使用缩略图，类别图必须从原图读取
+        :return: RGB图像数组
+        """
+        image_info = self.queries.get_image(id=image_id, object_id=None)
+        image_info = Box(image_info)
+
+        # 缩略图不小于输出尺寸时，使用缩略图避免下载原图
+        if use_thumbnail and image_info.thumbnail_id:
+            thumbnail_info = self.queries.get_image(
+                id=image_info.thumbnail_id, object_id=None
+            )
+            thumbnail_info = Box(thumbnail_info)
+            if thumbnail_info.width >= size[0] and thumbnail_info.height >= size[1]:
+                image_info = thumbnail_info
+
+        file_path = self.object_service.copy2local(image_info)
+        try:
+            with Image.open(file_path) as img:
+                img = img.convert("RGB").resize(size, resample)
+                img = np.asarray(img)
+        finally:
+            file_path.unlink(missing_ok=True)
+
+        return img
+
+    def get_tile_info(self, project_id: int) -> Box | None:
+        """
+        获取分割结果瓦片金字塔的信息
+
+        :param project_id: 项目ID
+        :return: 原图尺寸、瓦片边长和缩放级别范围，如果项目不存在或未完成则返回None
+        """
+        plot_image_info = self._get_plot_image_info(project_id)
+        if not plot_image_info:
+            return None
+
+        width, height = plot_image_info.width, plot_image_info.height
+        return Box(
+            width=width,
+            height=height,
+            tile_size=TILE_SIZE,
+            min_zoom=0,
+            max_zoom=get_max_zoom(width, height),
+            classes=tile_class_names,
+        )
+
+    def get_vector_tile(self, project_id: int, z: int, x: int, y: int) -> bytes | None:
+        """
+        获取分割结果多边形的矢量瓦片，按需生成并缓存到Redis
+
+        :param project_id: 项目ID
+        :param z: 缩放级别
+        :param x: 瓦片列号
+        :param y: 瓦片行号
+        :return: 矢量瓦片字节，如果项目或瓦片不存在则返回None
+        """
+        plot_image_info = self._get_plot_image_info(project_id)
+        if not plot_image_info:
+            return None
+
+        window = get_tile_window(z, x, y, plot_image_info.width, plot_image_info.height)
+        if window is None:
+            logger.warning(f"Tile out of range: {z}/{x}/{y}")
+            return None
+
+        # 以etag为键，分割结果更新后缓存自动失效
+        cache_key = f"mvt:{plot_image_info.etag}:{z}:{x}:{y}"
+        if (tile := self.redis_client.get(cache_key)) is not None:
+            logger.debug(f"Vector tile cache hit: {cache_key}")
+            return tile
+
+        # 只读取瓦片覆盖的区域，使用最近邻插值以保留类别颜色
+        plot_path = self.object_service.get_cached_copy(plot_image_info)
+        col_off, row_off, span = window
+        with rasterio.open(plot_path) as src:
+            data = read_window(
+                src,
+                col_off,
+                row_off,
+                span,
+                min(span, TILE_SIZE * 2),
+                indexes=[1, 2, 3],
+            )
+
+        # 颜色表为BGR顺序，转换为RGB后解码为标签图
+        img = ep.rearrange(data, "c h w -> h w c")
+        colors = np.array([bgr[::-1] for bgr in SEGMENTATION_2D_BGR.values()])
+        labels = colors2labels(img, colors)
+
+        features = labels2features(labels, tile_class_names)
+        tile = encode_vector_tile(features, "segmentation")
+
+        self.redis_client.set(cache_key, tile, ex=MVT_CACHE_TTL)
+        logger.debug(f"Vector tile generated: {cache_key}")
+
+        return tile
+
+    def _get_plot_image_info(self, project_id: int) -> Box | None:
+        """
+        获取项目的分割结果图像信息
+
+        :param project_id: 项目ID
+        :return: 分割结果图像信息，如果项目不存在或未完成则返回None
+        """
+        project = self.queries.get_2d_segmentation(id=None, project_id=project_id)
+        if not project or not project["plot_image_id"]:
+            logger.warning(f"2D segmentation result not found: project_id={project_id}")
+            return None
+
+        plot_image_info = self.queries.get_image(
+            id=project["plot_image_id"], object_id=None
+        )
+        return Box(plot_image_info)
+
+    def get_input_objects(
+        self, id: int | None = None, project_id: int | None = None, **kwargs
+    ) -> list[dict]:
+        """
+        获取任务的输入对象，供后台预取
+
+        :param id: 2D分割任务ID
+        :param project_id: 项目ID
+        :return: 输入的图像数据
+        """
+        project_info = self.get(id=id, project_id=project_id)
+        if not project_info:
+            return []
+
+        image_info = self.object_service.get_image(
+            id=project_info.image_id, should_thumbnail=False
+        )
+        return [image_info] if image_info else []
+
     def run(self, id: int | None = None, project_id: int | None = None, **kwargs):
         """
         Run 2D segmentation task
@@ -95,15 +370,472 @@ class Segmentation2DService:
             id (int, optional): 2D segmentation task ID. Defaults to None.
             project_id (int, optional): Project ID. Defaults to None.
         """
+        if self._link_cached_result(id=id, project_id=project_id):
+            return
+
+        job = self._prepare(id=id, project_id=project_id)
+        if not job:
+            return
+
+        # 大幅影像分块后由多个worker推理，拼接后保存结果
+        if self._should_tile(job.input_path):
+            self._run_tiled(job, priority=kwargs.get("priority") or "normal")
+            return
+
+        # 运行预测脚本
+        run_inference(self.redis_client, "2d_segmentation", **job.args)
+
+        self.complete(job)
+
+    def run_batch(self, tasks: list[dict]) -> list[Exception | None]:
+        """
+        批量运行2D分割任务，所有任务在一次推理调用中完成
 
-        # 获取任务
+        Args:
+            tasks (list[dict]): 任务信息，包含id和project_id
+
+        Returns:
+            list[Exception | None]: 每个任务的异常，成功时为None
+        """
+        # 将结果分别保存到各自的项目
+        errors: list[Exception | None] = []
+        for result in self.infer_batch(tasks):
+            if not isinstance(result, Box):
+                errors.append(result)
+                continue
+
+            try:
+                self.complete(result)
+                errors.append(None)
+            except Exception as e:
+                logger.error(
+                    f"2d segmentation task failed: {result.project_info.id}: {e}"
+                )
+                errors.append(e)
+
+        return errors
+
+    def infer_batch(self, tasks: list[dict]) -> list[Box | Exception | None]:
+        """
+        批量推理2D分割任务，不保存结果，由调用方对返回的任务调用complete
+
+        Args:
+            tasks (list[dict]): 任务信息，包含id和project_id
+
+        Returns:
+            list[Box | Exception | None]: 每个任务推理完成后待保存的任务，
+                推理失败时为异常，不需要保存结果时为None
+        """
+        results: list[Box | Exception | None] = [None] * len(tasks)
+
+        jobs = {}
+        for i, task in enumerate(tasks):
+            try:
+                if self._link_cached_result(
+                    id=task.get("id"), project_id=task.get("project_id")
+                ):
+                    continue
+
+                job = self._prepare(
+                    id=task.get("id"), project_id=task.get("project_id")
+                )
+                if job and self._should_tile(job.input_path):
+                    self._run_tiled(job, priority=task.get("priority") or "normal")
+                    continue
+            except Exception as e:
+                results[i] = e
+                continue
+            if job:
+                jobs[i] = job
+
+        if not jobs:
+            return results
+
+        # 运行预测脚本
+        batch = [job.args for job in jobs.values()]
+        try:
+            inference_errors = run_inference_batch(
+                self.redis_client, "2d_segmentation", batch
+            )
+        except Exception as e:
+            inference_errors = [str(e)] * len(jobs)
+        logger.debug(f"2d segmentation batch inferred: {len(jobs)} tasks")
+
+        for (i, job), error in zip(jobs.items(), inference_errors):
+            if error:
+                logger.error(
+                    f"2d segmentation task failed: {job.project_info.id}: {error}"
+                )
+                msg = f"Inference failed: {error}"
+                results[i] = RuntimeError(msg)
+            else:
+                results[i] = job
+
+        return results
+
+    def run_tile(self, id: str, **kwargs):
+        """
+        Run a tile of a tiled 2D segmentation task
+
+        Args:
+            id (str): Tile task ID, formatted as "{project_id}:{tile_index}"
+        """
+        (error,) = self.run_tile_batch([{"id": id}])
+        if error:
+            raise error
+
+    def run_tile_batch(self, tasks: list[dict]) -> list[Exception | None]:
+        """
+        批量推理2D分割的分块，最后一个完成的分块负责拼接并保存结果
+
+        分块和推理结果保存在Minio中，任意worker都可以执行分块任务。
+
+        Args:
+            tasks (list[dict]): 分块任务信息，id为"{project_id}:{tile_index}"
+
+        Returns:
+            list[Exception | None]: 每个分块的异常，成功时为None
+        """
+        with tempfile.TemporaryDirectory(dir=TMPDIR) as temp_dir:
+            return self._run_tile_batch(tasks, Path(temp_dir))
+
+    def _run_tile_batch(
+        self, tasks: list[dict], temp_dir: Path
+    ) -> list[Exception | None]:
+        # 分块和推理结果在本地的临时目录中，上传后删除
+        errors: list[Exception | None] = [None] * len(tasks)
+        minio_client = self.object_service.minio_client
+        bucket_name = self.object_service.bucket_name
+
+        manifests = {}
+        tiles = {}
+        for i, task in enumerate(tasks):
+            project_id, index = task["id"].split(":")
+            try:
+                if project_id not in manifests:
+                    manifests[project_id] = self._get_tile_manifest(project_id)
+            except Exception as e:
+                logger.error(f"2d segmentation tile failed: {task['id']}: {e}")
+                errors[i] = e
+                continue
+            if manifests[project_id] is None:
+                continue
+
+            tiles[i] = Box(
+                project_id=project_id,
+                index=index,
+                prefix=self._get_tile_prefix(project_id),
+                name=f"{project_id}_{index}",
+            )
+
+        # 已有推理结果的分块不重复推理
+        pending = {}
+        for i, tile in tiles.items():
+            output_name = f"{tile.prefix}/outputs/{tile.index}.tif"
+            try:
+                if self._tile_object_exists(output_name):
+                    continue
+
+                minio_client.fget_object(
+                    bucket_name,
+                    f"{tile.prefix}/tiles/{tile.index}.tif",
+                    str(temp_dir / f"{tile.name}.tif"),
+                )
+                pending[i] = tile
+            except Exception as e:
+                logger.error(f"2d segmentation tile failed: {tasks[i]['id']}: {e}")
+                errors[i] = e
+
+        batch = [
+            {
+                "inputimage": temp_dir / f"{tile.name}.tif",
+                "outputpath": temp_dir / f"{tile.name}_2d_seg.tif",
+                "maskpath": temp_dir / f"{tile.name}_2d_seg_mask.png",
+            }
+            for tile in pending.values()
+        ]
+
+        if batch:
+            try:
+                inference_errors = run_inference_batch(
+                    self.redis_client, "2d_segmentation", batch
+                )
+            except Exception as e:
+                inference_errors = [str(e)] * len(batch)
+
+            for (i, tile), args, error in zip(pending.items(), batch, inference_errors):
+                try:
+                    if error:
+                        msg = f"Inference failed: {error}"
+                        raise RuntimeError(msg)
+
+                    # 上传完成后结果才可见，中断时不会留下不完整的结果
+                    minio_client.fput_object(
+                        bucket_name,
+                        f"{tile.prefix}/outputs/{tile.index}.tif",
+                        str(args["outputpath"]),
+                    )
+                except Exception as e:
+                    logger.error(f"2d segmentation tile failed: {tasks[i]['id']}: {e}")
+                    errors[i] = e
+                finally:
+                    for path in args.values():
+                        Path(path).unlink(missing_ok=True)
+
+        for i, tile in tiles.items():
+            if errors[i]:
+                continue
+            try:
+                self.redis_client.sadd(self._get_tile_key(tile.project_id), tile.index)
+                self._stitch_tiles(tile.project_id, manifests[tile.project_id])
+            except Exception as e:
+                logger.error(f"2d segmentation tile failed: {tasks[i]['id']}: {e}")
+                errors[i] = e
+
+        return errors
+
+    def _should_tile(self, input_path: Path) -> bool:
+        # 只对超过阈值的TIFF分块推理
+        if SEGMENTATION_2D_TILE_MODE != "auto":
+            return False
+        if input_path.suffix.casefold() not in (".tif", ".tiff"):
+            return False
+
+        with rasterio.open(input_path) as src:
+            return src.width * src.height > SEGMENTATION_2D_TILE_THRESHOLD
+
+    def _get_tile_prefix(self, project_id: int | str) -> str:
+        # 分块在Minio中的前缀
+        return f"{SEGMENTATION_2D_TILE_PREFIX}/{project_id}"
+
+    def _get_tile_key(self, project_id: int | str) -> str:
+        # 已完成推理的分块序号集合
+        return f"2d_seg_tiles:{project_id}:done"
+
+    def _tile_object_exists(self, object_name: str) -> bool:
+        try:
+            self.object_service.minio_client.stat_object(
+                self.object_service.bucket_name, object_name
+            )
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                return False
+            raise
+        return True
+
+    def _get_tile_manifest(self, project_id: int | str) -> dict | None:
+        """
+        读取分块清单，拼接完成后清单被删除
+
+        :param project_id: 项目ID
+        :return: 分块清单，项目已完成或已删除时返回None
+        :raises RuntimeError: 项目未完成但清单不存在，任务应重试
+        """
+        try:
+            response = self.object_service.minio_client.get_object(
+                self.object_service.bucket_name,
+                f"{self._get_tile_prefix(project_id)}/manifest.json",
+            )
+            try:
+                return json.loads(response.read())
+            finally:
+                response.close()
+                response.release_conn()
+        except S3Error as e:
+            if e.code != "NoSuchKey":
+                raise
+
+        project = self.get(project_id=int(project_id))
+        if not project or project.status == "completed":
+            logger.info(f"Tiles of 2d segmentation {project_id} already stitched")
+            return None
+
+        msg = f"Tile manifest of 2d segmentation {project_id} not found"
+        raise RuntimeError(msg)
+
+    def _run_tiled(self, job: Box, priority: str = "normal"):
+        """
+        将影像划分为重叠的分块上传到Minio，每个分块作为单独的任务推理
+
+        重复执行时复用已有的分块和推理结果，只推送缺少结果的分块。
+        """
+        project_id = job.project_info.id
+        prefix = self._get_tile_prefix(project_id)
+        minio_client = self.object_service.minio_client
+        bucket_name = self.object_service.bucket_name
+
+        try:
+            with rasterio.open(job.input_path) as src:
+                windows = get_tile_windows(
+                    src.width,
+                    src.height,
+                    SEGMENTATION_2D_TILE_SIZE,
+                    SEGMENTATION_2D_TILE_OVERLAP,
+                )
+
+            existing = {
+                obj.object_name
+                for obj in minio_client.list_objects(bucket_name, f"{prefix}/tiles/")
+            }
+            with tempfile.TemporaryDirectory(dir=TMPDIR) as temp_dir:
+                tile_paths = split_scene(job.input_path, temp_dir, windows)
+                for index, tile_path in enumerate(tile_paths):
+                    object_name = f"{prefix}/tiles/{index}.tif"
+                    if object_name not in existing:
+                        minio_client.fput_object(
+                            bucket_name, object_name, str(tile_path)
+                        )
+        finally:
+            Path(job.input_path).unlink(missing_ok=True)
+
+        # 清单最后上传，存在清单时所有分块都已上传
+        # 拼接时重新获取输入影像，清单中只保存任务ID
+        manifest = json.dumps(
+            {
+                "job": {"id": job.id, "project_id": job.project_id},
+                "windows": windows,
+            }
+        ).encode()
+        minio_client.put_object(
+            bucket_name,
+            f"{prefix}/manifest.json",
+            BytesIO(manifest),
+            len(manifest),
+            content_type="application/json",
+        )
+
+        # 先清空集合再列出已有的推理结果，期间完成的分块的结果已上传或在清空后写入集合
+        tile_key = self._get_tile_key(project_id)
+        self.redis_client.delete(tile_key)
+        outputs = {
+            obj.object_name
+            for obj in minio_client.list_objects(bucket_name, f"{prefix}/outputs/")
+        }
+        done = [
+            index
+            for index in range(len(windows))
+            if f"{prefix}/outputs/{index}.tif" in outputs
+        ]
+        if done:
+            self.redis_client.sadd(tile_key, *done)
+
+        missing = [index for index in range(len(windows)) if index not in done]
+        logger.info(
+            f"2d segmentation {project_id} split into {len(windows)} tiles, "
+            f"{len(missing)} to run"
+        )
+        if not missing:
+            self._stitch_tiles(project_id, json.loads(manifest))
+            return
+
+        push_task(
+            self.redis_client,
+            tasks=[
+                {
+                    "type": "2d_segmentation_tile",
+                    "id": f"{project_id}:{index}",
+                    "priority": priority,
+                }
+                for index in missing
+            ],
+        )
+
+    def _stitch_tiles(self, project_id: int | str, manifest: dict):
+        # 所有分块都有推理结果时拼接，只由一个worker执行
+        windows = [tuple(window) for window in manifest["windows"]]
+
+        tile_key = self._get_tile_key(project_id)
+        if self.redis_client.scard(tile_key) < len(windows):
+            return
+
+        lock_key = f"2d_seg_tiles:{project_id}:stitching"
+        if not self.redis_client.set(lock_key, 1, nx=True, ex=INFERENCE_TIMEOUT):
+            return
+
+        prefix = self._get_tile_prefix(project_id)
+        try:
+            job = self._prepare(**manifest["job"])
+            if not job:
+                return
+
+            with tempfile.TemporaryDirectory(dir=TMPDIR) as temp_dir:
+                self._stitch_job(job, prefix, windows, Path(temp_dir))
+
+            self.complete(job)
+
+            # 先删除清单，重复投递的分块任务据此跳过
+            self.object_service.minio_client.remove_object(
+                self.object_service.bucket_name, f"{prefix}/manifest.json"
+            )
+            remove_folder(
+                self.object_service.minio_client,
+                self.object_service.bucket_name,
+                prefix,
+            )
+            self.redis_client.delete(tile_key)
+        finally:
+            self.redis_client.delete(lock_key)
+
+    def _stitch_job(self, job: Box, prefix: str, windows: list[tuple], temp_dir: Path):
+        # 下载所有分块的推理结果并拼接到任务的输出路径
+        logger.info(f"Stitching {len(windows)} tiles of {prefix}")
+        output_paths = []
+        for index in range(len(windows)):
+            output_path = temp_dir / f"{index}.tif"
+            self.object_service.minio_client.fget_object(
+                self.object_service.bucket_name,
+                f"{prefix}/outputs/{index}.tif",
+                str(output_path),
+            )
+            output_paths.append(output_path)
+
+        stitch_tiles(
+            job.input_path,
+            windows,
+            output_paths,
+            job.output_path,
+            scratch_dir=temp_dir,
+        )
+
+    def _link_cached_result(
+        self, id: int | None = None, project_id: int | None = None
+    ) -> bool:
+        # 相同影像和模型版本已有推理结果时直接关联到任务，不再推理
+        if not self.result_cache_service.enabled:
+            return False
+
+        input_objects = self.get_input_objects(id=id, project_id=project_id)
+        etags = [object_data["etag"] for object_data in input_objects]
+        cached = self.result_cache_service.get(
+            "2d_segmentation", etags, "2d_segmentation"
+        )
+        if not cached:
+            return False
+
+        # 结果图片已删除时重新推理
+        result = cached.result
+        for image_id in [result.plot_image_id, result.mask_svg_id]:
+            if image_id and not self.queries.get_image(id=image_id, object_id=None):
+                logger.info(f"Cached 2d segmentation result is gone: {cached.id}")
+                self.result_cache_service.delete(cached.id)
+                return False
+
+        self.queries.complete_2d_segmentation(id=id, project_id=project_id, **result)
+        logger.info(
+            f"2d segmentation task completed from cached result: "
+            f"id={id}, project_id={project_id}"
+        )
+        return True
+
+    def _prepare(self, id: int | None = None, project_id: int | None = None):
+        # 获取任务和输入文件，生成推理参数
         project_info = self.get(id=id, project_id=project_id)
 
         if not project_info:
             logger.error(
                 f"Segmentation 2D task not found: id={id}, project_id={project_id}"
             )
-            return
+            return None
 
         project_info = Box(project_info)
 
@@ -126,34 +858,32 @@ class Segmentation2DService:
         origin_name = Path(image_info.origin_name)
         result_origin_name = origin_name.with_stem(origin_name.stem + "_2d_seg").name
 
-        # # 都转换为字符串
-        # input_path = str(input_path)
-        # output_path = str(output_path)
-        # mask_path = str(mask_path)
+        return Box(
+            id=id,
+            project_id=project_id,
+            project_info=project_info,
+            input_path=input_path,
+            output_path=output_path,
+            mask_path=mask_path,
+            result_origin_name=result_origin_name,
+            input_etags=[image_info.etag],
+            args={
+                "inputimage": input_path,
+                "outputpath": output_path,
+                "maskpath": mask_path,
+            },
+        )
 
-        # 运行预测脚本
-        micromamba[
-            "run",
-            "-n",
-            "zyb",
-            "python",
-            "/root/autodl-tmp/Zhaoyibei/2D_seg/DPA/predict.py",
-            "--inputimage",
-            input_path,
-            "--outputpath",
-            output_path,
-            "--maskpath",
-            mask_path,
-        ]()
-
-        # 保存输出文件
+    def complete(self, job: Box):
+        # 保存推理结果并更新数据库
         results = self.object_service.save_image(
-            result_origin_name,
-            output_path,
+            job.result_origin_name,
+            job.output_path,
             origin_type="system",
             thumbnail_format="png",
             mask_colors_map=SEGMENTATION_2D_BGR,
             mask_color_mode="bgr",
+            mask_layers=True,
         )
         results = Box(results)
 
@@ -165,15 +895,24 @@ class Segmentation2DService:
         # 更新数据库
         image_info = results.image_info
         mask_svg_info = results.mask_svg_info
+        result = {
+            "plot_image_id": image_info.id,
+            "mask_image_id": None,
+            "mask_svg_id": mask_svg_info.id,
+            "mask_layers": json.dumps(
+                results.get("mask_layers", {}), ensure_ascii=False
+            ),
+        }
         self.queries.complete_2d_segmentation(
-            id=id,
-            project_id=project_id,
-            plot_image_id=image_info.id,
-            mask_image_id=None,
-            mask_svg_id=mask_svg_info.id,
+            id=job.id, project_id=job.project_id, **result
+        )
+
+        # 相同影像和模型版本的任务直接使用该结果
+        self.result_cache_service.save(
+            "2d_segmentation", job.get("input_etags"), "2d_segmentation", result
         )
 
         # 删除临时文件
-        Path(input_path).unlink(missing_ok=True)
-        Path(output_path).unlink(missing_ok=True)
-        Path(mask_path).unlink(missing_ok=True)
+        Path(job.input_path).unlink(missing_ok=True)
+        Path(job.output_path).unlink(missing_ok=True)
+        Path(job.mask_path).unlink(missing_ok=True)
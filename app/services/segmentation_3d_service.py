@@ -22,11 +22,18 @@ from .project_service import ProjectService
 class Segmentation3DService:
     def __init__(self, queries: Module, minio_client: Minio, redis_client: Redis):
         self.queries = queries
-        self.project_service = ProjectService(queries, minio_client)
-        self.object_service = ObjectService(queries, minio_client)
+        self.project_service = ProjectService(queries, minio_client, redis_client)
+        self.object_service = ObjectService(queries, minio_client, redis_client)
         self.redis_client = redis_client
 
-    def create(self, pointcloud_id, project_id=None, project_name=None, **kwargs):
+    def create(
+        self,
+        pointcloud_id,
+        project_id=None,
+        project_name=None,
+        priority="normal",
+        **kwargs,
+    ):
         with self.queries.transaction() as tx:
             if project_id:
                 project = self.project_service.get(project_id)
@@ -36,7 +43,9 @@ class Segmentation3DService:
                     msg = f"Project with id {project_id} does not exist"
                     raise ValueError(msg)
             else:
-                pointcloud_info = self.object_service.get_pointcloud(id=pointcloud_id)
+                pointcloud_info = self.object_service.get_pointcloud(
+                    id=pointcloud_id, should_potree=False
+                )
                 pointcloud_info = Box(pointcloud_info)
 
                 cover_image_id = pointcloud_info.thumbnail_id
@@ -45,6 +54,7 @@ class Segmentation3DService:
                     type="3d_segmentation",
                     name=project_name,
                     cover_image_id=cover_image_id,
+                    priority=priority,
                 )
 
             last_id = self.queries.create_3d_segmentation(
@@ -57,7 +67,12 @@ class Segmentation3DService:
                 raise ValueError(msg)
 
         # 将任务推送到redis队列
-        task_info = {"type": "3d_segmentation", "id": last_id, "project_id": project_id}
+        task_info = {
+            "type": "3d_segmentation",
+            "id": last_id,
+            "project_id": project_id,
+            "priority": priority,
+        }
         push_task(self.redis_client, task_info)
 
         return task_info
@@ -88,6 +103,25 @@ class Segmentation3DService:
             msg = "Either id or project_id must be provided"
             raise ValueError(msg)
 
+    def get_input_objects(
+        self, id: int | None = None, project_id: int | None = None, **kwargs
+    ) -> list[dict]:
+        """
+        获取任务的输入对象，供后台预取
+
+        :param id: 3D分割任务ID
+        :param project_id: 项目ID
+        :return: 输入的点云数据
+        """
+        project_info = self.get(id=id, project_id=project_id)
+        if not project_info:
+            return []
+
+        pointcloud_info = self.object_service.get_pointcloud(
+            id=project_info.pointcloud_id, should_potree=False
+        )
+        return [pointcloud_info] if pointcloud_info else []
+
     def run(self, id: int | None = None, project_id: int | None = None, **kwargs):
         """
         Run 3D segmentation task
@@ -111,13 +145,13 @@ class Segmentation3DService:
         logger.info(f"Running task: {project_info}")
 
         pointcloud_info = self.object_service.get_pointcloud(
-            id=project_info.pointcloud_id
+            id=project_info.pointcloud_id, should_potree=False
         )
 
         logger.info(f"3D Seg task image info: {pointcloud_info}")
 
-        # 从 MinIO 复制文件到临时文件
-        input_path = self.object_service.copy2local(pointcloud_info)
+        # 从 MinIO 复制文件到临时文件，推理脚本只支持LAS
+        input_path = self.object_service.copy2local(pointcloud_info, decompress=True)
 
         # 在 input_path 的基础上生成输出路径和掩码路径
         output_path = input_path.with_stem(input_path.stem + "_3d_seg")
@@ -169,6 +203,13 @@ class Segmentation3DService:
             id=id, project_id=project_id, result_pointcloud_id=result_pointcloud_info.id
         )
 
+        # 使用分割结果的缩略图作为项目封面
+        if result_pointcloud_info.thumbnail_id:
+            self.project_service.update(
+                project_info.project_id,
+                cover_image_id=result_pointcloud_info.thumbnail_id,
+            )
+
         # 删除临时文件
         Path(input_path).unlink(missing_ok=True)
         Path(output_path).unlink(missing_ok=True)
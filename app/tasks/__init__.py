@@ -1,16 +1,184 @@
-from threading import Event, Thread
+from collections import defaultdict, deque
+from itertools import zip_longest
+from queue import Empty, Queue
+from threading import BoundedSemaphore, Event, Lock, Thread
+import time
 import traceback
 
 from box import Box, BoxList
 from loguru import logger
+from redis import Redis
 
-from app.services import get_services
+from app.config import (
+    PREFETCH_CACHE_SIZE,
+    TASK_BACKLOG,
+    TASK_BATCH_SIZES,
+    TASK_BATCH_WAIT,
+    TASK_DEFER_DELAY,
+    TASK_POSTPROCESS_BACKLOG,
+    TASK_POSTPROCESS_WORKERS,
+    TASK_PRIORITIES,
+    TASK_QUEUE,
+    TASK_TYPE_CONCURRENCY,
+    TASK_VISIBILITY_TIMEOUT,
+    TASK_WORKERS,
+)
+from app.services import Services, get_services
 from app.utils.connections_manager import ConnectionsManager
-from app.utils.tasks_funcs import get_task, push_task
+from app.utils.prefetch_funcs import prefetcher
+from app.utils.tasks_funcs import (
+    WeightedScheduler,
+    ack_task,
+    acquire_task_lock,
+    defer_task,
+    extend_lease,
+    extend_task_locks,
+    get_queue_name,
+    get_task,
+    get_task_key,
+    push_task,
+    release_task_lock,
+    requeue_delayed_tasks,
+    requeue_stalled_tasks,
+    retry_task,
+    return_tasks,
+    sync_task_keys,
+)
 
 
-class BackgroudTasksService:
+class TaskWorker:
     def __init__(self):
+        # 每个worker使用独立的连接，避免多个线程共享同一个数据库连接
+        self.connections_manager = ConnectionsManager()
+        self.connections_manager.open()
+
+        self.services: Services = get_services(
+            self.connections_manager.queries,
+            self.connections_manager.minio_client,
+            self.connections_manager.redis_client,
+        )
+
+    def close(self):
+        self.connections_manager.close()
+
+    def is_completed(self, task_info: Box) -> bool:
+        # 项目已完成或已删除时不再执行
+        if not task_info.get("project_id"):
+            return False
+
+        project = self.services.project_service.get(task_info.project_id)
+        return not project or project["status"] == "completed"
+
+    def get_input_objects(self, task_info: Box) -> list[dict]:
+        # 获取任务需要从Minio下载的输入对象，其他任务返回空列表
+        services = {
+            "2d_detection": self.services.detection_2d_service,
+            "2d_segmentation": self.services.segmentation_2d_service,
+            "3d_segmentation": self.services.segmentation_3d_service,
+        }
+        if task_info.type not in services:
+            return []
+
+        return services[task_info.type].get_input_objects(**task_info)
+
+    def run_tasks(
+        self, tasks: list[Box], *, staged: bool = False
+    ) -> list[Box | Exception | None]:
+        """
+        执行同一类型的一批任务，支持批量推理的类型在一次推理调用中完成
+
+        :param tasks: 任务信息列表
+        :param staged: 支持分阶段执行的类型只完成推理，返回待保存结果的任务，
+            由调用方传给complete_task
+        :return: 每个任务的异常或待保存结果的任务，成功时为None
+        """
+        for task_info in tasks:
+            if task_info.get("project_id"):
+                self.services.project_service.update_status(
+                    task_info.project_id, "running"
+                )
+
+        infer_runners = {
+            "2d_detection": self.services.detection_2d_service.infer_batch,
+            "2d_segmentation": self.services.segmentation_2d_service.infer_batch,
+        }
+        if staged and tasks[0].type in infer_runners:
+            try:
+                return infer_runners[tasks[0].type](tasks)
+            except Exception as e:
+                logger.error(f"Error running task inference: {e}")
+                logger.error(traceback.format_exc())
+                return [e] * len(tasks)
+
+        batch_runners = {
+            "2d_detection": self.services.detection_2d_service.run_batch,
+            "2d_segmentation": self.services.segmentation_2d_service.run_batch,
+            "2d_segmentation_tile": self.services.segmentation_2d_service.run_tile_batch,
+        }
+        if len(tasks) > 1 and tasks[0].type in batch_runners:
+            logger.info(f"Running {len(tasks)} {tasks[0].type} tasks as a batch")
+            try:
+                errors = batch_runners[tasks[0].type](tasks)
+            except Exception as e:
+                logger.error(f"Error running task batch: {e}")
+                logger.error(traceback.format_exc())
+                errors = [e] * len(tasks)
+            return errors
+
+        errors = []
+        for task_info in tasks:
+            try:
+                self.run_task(task_info)
+                errors.append(None)
+            except Exception as e:
+                logger.error(f"Error running task: {e}")
+                logger.error(traceback.format_exc())
+                errors.append(e)
+
+        return errors
+
+    def complete_task(self, task_info: Box, job: Box):
+        # 保存分阶段执行的任务的推理结果
+        services = {
+            "2d_detection": self.services.detection_2d_service,
+            "2d_segmentation": self.services.segmentation_2d_service,
+        }
+        logger.info(f"Saving task results: {task_info.type} {job.project_info.id}")
+        services[task_info.type].complete(job)
+
+    def run_task(self, task_info: Box):
+        logger.info(f"Running task: {task_info.id}")
+
+        match task_info.type:
+            case "2d_detection":
+                logger.info(f"Running 2D detection task: {task_info.id}")
+                self.services.detection_2d_service.run(**task_info)
+            case "2d_change_detection":
+                logger.info(f"Running 2D change detection task: {task_info.id}")
+                self.services.change_detection_2d_service.run(**task_info)
+            case "2d_segmentation":
+                logger.info(f"Running 2D segmentation task: {task_info.id}")
+                self.services.segmentation_2d_service.run(**task_info)
+            case "2d_segmentation_tile":
+                logger.info(f"Running 2D segmentation tile task: {task_info.id}")
+                self.services.segmentation_2d_service.run_tile(**task_info)
+            case "3d_segmentation":
+                logger.info(f"Running 3D segmentation task: {task_info.id}")
+                self.services.segmentation_3d_service.run(**task_info)
+            case "potree":
+                logger.info(f"Running Potree publishing task: {task_info.id}")
+                self.services.object_service.publish_potree(**task_info)
+            case _:
+                logger.error(f"Unknown task type: {task_info.type}")
+
+
+class BackgroudTasksService:
+    def __init__(
+        self,
+        workers: int = TASK_WORKERS,
+        type_concurrency: dict[str, int] = TASK_TYPE_CONCURRENCY,
+        backlog: int = TASK_BACKLOG,
+    ):
         self.connections_manager = ConnectionsManager()
         self.connections_manager.open()
 
@@ -20,64 +188,461 @@ class BackgroudTasksService:
             self.connections_manager.redis_client,
         )
         self.project_service = self.services.project_service
-        self.segmentation_2d_service = self.services.segmentation_2d_service
-        self.segmentation_3d_service = self.services.segmentation_3d_service
-        self.change_detection_2d_service = self.services.change_detection_2d_service
-        self.detection_2d_service = self.services.detection_2d_service
+
+        self.workers = workers
+        self.backlog = backlog
+
+        # 全局和每种任务类型的并发槽位，分发任务前获取，任务结束后释放
+        self.type_concurrency = {
+            type: min(limit, workers) for type, limit in type_concurrency.items()
+        }
+        self.worker_slots = BoundedSemaphore(workers)
+        self.type_slots = {
+            type: BoundedSemaphore(limit)
+            for type, limit in self.type_concurrency.items()
+        }
+
+        # 在各类型和优先级的队列之间加权轮询
+        self.scheduler = WeightedScheduler(list(self.type_concurrency))
+
+        # 已从Redis取出、等待槽位的任务，按类型排队，避免一种类型阻塞其他类型
+        # 任务以原始内容和任务信息保存，原始内容用于确认和续期
+        self.pending: defaultdict[str, deque[tuple[bytes, Box]]] = defaultdict(deque)
+        # 已获得槽位、等待worker执行的任务
+        self.work_queue: Queue[tuple[bytes, Box]] = Queue()
+        # 推理完成、等待保存结果的任务，队列满时推理线程等待
+        # 停止时每个后处理线程收到一个None，处理完之前的任务后退出
+        self.postprocess_queue: Queue[tuple[bytes, Box, str, Box] | None] = Queue(
+            TASK_POSTPROCESS_BACKLOG
+        )
+        # 本进程已取出且尚未确认的任务，定期续期租约
+        self.claimed: set[bytes] = set()
+        # 本进程正在执行的任务的执行锁，与租约一起续期
+        self.running: set[str] = set()
+        self.claimed_lock = Lock()
+        # 有任务结束时通知分发线程
+        self.slot_released = Event()
 
         self.stop_event = Event()
+        # 后处理线程退出后再停止续期租约
+        self.leases_stop_event = Event()
 
     def background_tasks(self):
+        """
+        分发线程，从Redis取出任务并在有空闲槽位时交给worker执行
+
+        本地积压达到上限后不再从Redis取任务，多余的任务留在队列中形成背压。
+        本地等待的任务数达到并发数的类型暂不读取，其他类型的任务不会被阻塞。
+        """
+        redis_client = self.connections_manager.redis_client
+
         while not self.stop_event.is_set():
             try:
-                task_info = get_task(self.connections_manager.redis_client)
-                self.run_task(task_info)
+                types = {
+                    type
+                    for type, limit in self.type_concurrency.items()
+                    if len(self.pending[type]) < limit
+                }
+                has_pending = any(self.pending.values())
+                is_full = (
+                    not types or sum(map(len, self.pending.values())) >= self.backlog
+                )
+
+                task = None
+                if not is_full:
+                    # 只在实际读取时推进轮询，保持各优先级的读取比例
+                    queues = self.scheduler.order(types)
+                    # 有任务等待槽位时不阻塞读取，以便槽位释放后立即分发
+                    # 最后读取旧版本推送到单一队列的任务
+                    task = get_task(
+                        redis_client,
+                        [*queues, TASK_QUEUE],
+                        timeout=None if has_pending else 1,
+                    )
+
+                if task:
+                    payload, task_info = task
+                    if task_info.type not in self.type_slots:
+                        logger.error(f"Unknown task type: {task_info.type}")
+                        retry_task(redis_client, payload, "unknown type", retry=False)
+                    else:
+                        with self.claimed_lock:
+                            self.claimed.add(payload)
+                        self.pending[task_info.type].append(task)
+
+                dispatched = self.dispatch()
+
+                # 没有读取到新任务且无法分发时，等待任务结束后再尝试
+                if task is None and not dispatched and (has_pending or is_full):
+                    self.slot_released.wait(timeout=1)
+                    self.slot_released.clear()
             except Exception as e:
-                logger.error(f"Error running task: {e}")
+                logger.error(f"Error dispatching task: {e}")
+                logger.error(traceback.format_exc())
+
+    def dispatch(self) -> int:
+        """
+        将等待中的任务分发到有空闲槽位的worker
+
+        :return: 分发的任务数量
+        """
+        dispatched = 0
+        for type, tasks in self.pending.items():
+            while tasks and self.worker_slots.acquire(blocking=False):
+                if not self.type_slots[type].acquire(blocking=False):
+                    self.worker_slots.release()
+                    break
+
+                self.work_queue.put(tasks.popleft())
+                dispatched += 1
+
+        return dispatched
+
+    def maintain_leases(self):
+        """
+        租约线程，为本进程已取出的任务续期，回收其他worker停滞的任务，并放回到期的延后任务
+        """
+        redis_client = self.connections_manager.redis_client
+        interval = TASK_VISIBILITY_TIMEOUT / 3
+
+        while True:
+            try:
+                with self.claimed_lock:
+                    payloads = list(self.claimed)
+                    keys = list(self.running)
+                extend_lease(redis_client, payloads)
+                extend_task_locks(redis_client, keys)
+
+                if requeued := requeue_stalled_tasks(redis_client):
+                    logger.warning(f"Requeued {requeued} stalled tasks")
+                if requeued := requeue_delayed_tasks(redis_client):
+                    logger.info(f"Requeued {requeued} deferred tasks")
+            except Exception as e:
+                logger.error(f"Error maintaining task leases: {e}")
                 logger.error(traceback.format_exc())
 
+            if self.leases_stop_event.wait(interval):
+                break
+
+    def get_upcoming_tasks(self) -> list[tuple[bytes, Box]]:
+        # 已分发的任务最先执行，之后是各类型等待槽位的任务，按类型交替排列
+        with self.work_queue.mutex:
+            tasks = list(self.work_queue.queue)
+
+        pending = [list(type_tasks) for type_tasks in list(self.pending.values())]
+        tasks.extend(task for group in zip_longest(*pending) for task in group if task)
+
+        return tasks
+
+    def prefetch_inputs(self):
+        """
+        预取线程，在当前任务执行时将后续任务的输入文件下载到本地
+
+        按任务即将执行的顺序预取，磁盘预算用完后等待已预取的文件被任务取走再继续。
+        """
+        worker = TaskWorker()
+        # 后续任务的输入对象，避免重复查询数据库
+        inputs: dict[bytes, list[dict]] = {}
+
+        try:
+            while not self.stop_event.wait(1):
+                try:
+                    upcoming = self.get_upcoming_tasks()
+                    payloads = {payload for payload, _ in upcoming}
+                    inputs = {
+                        payload: objects
+                        for payload, objects in inputs.items()
+                        if payload in payloads
+                    }
+
+                    for payload, task_info in upcoming:
+                        if payload not in inputs:
+                            try:
+                                inputs[payload] = worker.get_input_objects(task_info)
+                            except Exception as e:
+                                # 查询失败的任务不预取，执行时再下载
+                                logger.warning(f"Error getting task inputs: {e}")
+                                inputs[payload] = []
+
+                        if not all(
+                            worker.services.object_service.prefetch(object_data)
+                            for object_data in inputs[payload]
+                        ):
+                            break
+                except Exception as e:
+                    logger.error(f"Error prefetching task inputs: {e}")
+                    logger.error(traceback.format_exc())
+        finally:
+            worker.close()
+
+    def work(self):
+        """
+        worker线程，执行分发的任务并在结束后确认任务、释放槽位
+
+        执行成功的任务从处理中队列删除，失败的任务重新放回队列直到超过重试次数。
+        分阶段执行的任务推理完成后即释放槽位，由后处理线程保存结果后确认。
+        """
+        worker = TaskWorker()
+
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    payload, task_info = self.work_queue.get(timeout=1)
+                except Empty:
+                    continue
+
+                tasks = [(payload, task_info)]
+                try:
+                    tasks = self.collect_batch(worker, payload, task_info)
+                    self.run_tasks(worker, tasks)
+                except Exception as e:
+                    # 确认失败的任务在租约过期后重新执行
+                    logger.error(f"Error handling task: {e}")
+                    logger.error(traceback.format_exc())
+                    for payload, _ in tasks:
+                        self.release(payload)
+                finally:
+                    # 交给后处理线程的任务仍由本进程续期租约
+                    self.type_slots[task_info.type].release()
+                    self.worker_slots.release()
+                    self.slot_released.set()
+        finally:
+            worker.close()
+
+    def collect_batch(
+        self, worker: TaskWorker, payload: bytes, task_info: Box
+    ) -> list[tuple[bytes, Box]]:
+        """
+        在短时间内从队列中收集同类型的任务，与当前任务合并推理
+
+        合并的任务占用当前任务的槽位，由本进程续期租约。
+
+        :param worker: 执行任务的worker
+        :param payload: 当前任务的原始内容
+        :param task_info: 当前任务信息
+        :return: 包含当前任务在内的任务列表
+        """
+        tasks = [(payload, task_info)]
+        batch_size = TASK_BATCH_SIZES.get(task_info.type, 1)
+        if batch_size <= 1:
+            return tasks
+
+        redis_client = worker.connections_manager.redis_client
+        queues = [
+            get_queue_name(task_info.type, priority)
+            for priority in sorted(
+                TASK_PRIORITIES, key=TASK_PRIORITIES.get, reverse=True
+            )
+        ]
+
+        deadline = time.monotonic() + TASK_BATCH_WAIT
+        while len(tasks) < batch_size and not self.stop_event.is_set():
+            task = get_task(redis_client, queues, timeout=None)
+            if task is None:
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(0.05)
+                continue
+
+            with self.claimed_lock:
+                self.claimed.add(task[0])
+            tasks.append(task)
+
+        return tasks
+
+    def run_tasks(self, worker: TaskWorker, tasks: list[tuple[bytes, Box]]):
+        """
+        执行一批同类型的任务并分别确认，已完成或正在其他worker上执行的任务直接跳过
+
+        :param worker: 执行任务的worker
+        :param tasks: 任务原始内容和任务信息的列表
+        """
+        redis_client = worker.connections_manager.redis_client
+
+        runnable = []
+        for payload, task_info in tasks:
+            key = get_task_key(task_info)
+
+            try:
+                if worker.is_completed(task_info):
+                    logger.info(f"Skipping completed task: {key}")
+                    self.release(payload)
+                    ack_task(redis_client, payload)
+                    continue
+
+                if not acquire_task_lock(redis_client, key):
+                    # 执行中的worker可能在完成前退出，直接确认会丢失任务
+                    # 延后放回队列，届时再检查是否已完成，不计入重试次数
+                    logger.info(f"Deferring task running elsewhere: {key}")
+                    self.release(payload)
+                    defer_task(redis_client, payload, TASK_DEFER_DELAY)
+                    continue
+            except Exception as e:
+                # 不再续期租约，任务在租约过期后重新执行
+                logger.error(f"Error checking task {key}: {e}")
+                self.release(payload)
+                continue
+
+            with self.claimed_lock:
+                self.running.add(key)
+            runnable.append((payload, task_info, key))
+
+        if not runnable:
+            return
+
+        results = worker.run_tasks(
+            [task_info for _, task_info, _ in runnable], staged=True
+        )
+
+        for (payload, task_info, key), result in zip(runnable, results):
+            if isinstance(result, Box):
+                # 结果的保存交给后处理线程，当前线程继续执行下一个任务
+                self.postprocess_queue.put((payload, task_info, key, result))
+                continue
+
+            self.finish_task(redis_client, payload, key, result)
+
+    def postprocess(self):
+        """
+        后处理线程，保存推理结果后确认任务
+
+        上传结果、生成缩略图和矢量、视频转码与后续任务的推理同时进行。
+        停止时处理完已推理的任务，收到None后退出。
+        """
+        worker = TaskWorker()
+        redis_client = worker.connections_manager.redis_client
+
+        try:
+            while item := self.postprocess_queue.get():
+                payload, task_info, key, job = item
+
+                error = None
+                try:
+                    worker.complete_task(task_info, job)
+                except Exception as e:
+                    logger.error(f"Error saving task results: {key}: {e}")
+                    logger.error(traceback.format_exc())
+                    error = e
+
+                try:
+                    self.finish_task(redis_client, payload, key, error)
+                except Exception as e:
+                    # 确认失败的任务在租约过期后重新执行
+                    logger.error(f"Error finishing task {key}: {e}")
+                    logger.error(traceback.format_exc())
+        finally:
+            worker.close()
+
+    def finish_task(
+        self, redis_client: Redis, payload: bytes, key: str, error: Exception | None
+    ):
+        """
+        确认执行成功的任务后释放执行锁，失败的任务释放执行锁后放回队列重试
+
+        :param redis_client: Redis客户端
+        :param payload: 任务原始内容
+        :param key: 任务的去重键
+        :param error: 任务的异常，成功时为None
+        """
+        self.release(payload)
+        try:
+            if error is None:
+                ack_task(redis_client, payload)
+        finally:
+            # 确认后再释放执行锁，避免重复的任务在确认前开始执行
+            with self.claimed_lock:
+                self.running.discard(key)
+            release_task_lock(redis_client, key)
+
+        # 放回队列前释放执行锁，否则立即取到重试任务的worker会因锁被占用而跳过
+        if error is not None:
+            retry_task(redis_client, payload, str(error))
+
+    def release(self, payload: bytes):
+        # 不再为任务续期租约
+        with self.claimed_lock:
+            self.claimed.discard(payload)
+
     def push_tasks(self):
         projects = self.project_service.gets(statuses=("waiting", "running"))
         projects = BoxList(projects)
         logger.info(f"Found non-completed projects: {projects}")
 
+        redis_client = self.connections_manager.redis_client
+        if stale := sync_task_keys(redis_client):
+            logger.info(f"Removed {stale} stale task keys")
+
+        # 已在队列中的项目不会重复入队
+        pushed = 0
         for project in projects:
             project.project_id = project.id
             project.id = None
-            push_task(self.connections_manager.redis_client, project)
+            project.priority = project.get("priority") or "normal"
+            pushed += push_task(redis_client, project)
+        logger.info(f"Pushed {pushed} tasks of {len(projects)} projects")
 
     def start(self):
         logger.info("Starting background tasks")
         logger.info("Pushing tasks to queue")
         self.push_tasks()
         logger.info("Tasks pushed to queue")
-        thread = Thread(target=self.background_tasks)
-        thread.start()
-        logger.info("Background tasks started")
+
+        self.worker_threads = [Thread(target=self.work) for _ in range(self.workers)]
+        self.postprocess_threads = [
+            Thread(target=self.postprocess) for _ in range(TASK_POSTPROCESS_WORKERS)
+        ]
+        for thread in self.worker_threads + self.postprocess_threads:
+            thread.start()
+
+        self.dispatcher = Thread(target=self.background_tasks)
+        self.dispatcher.start()
+
+        self.lease_keeper = Thread(target=self.maintain_leases)
+        self.lease_keeper.start()
+
+        self.prefetch_thread = None
+        if PREFETCH_CACHE_SIZE > 0:
+            prefetcher.reset()
+            self.prefetch_thread = Thread(target=self.prefetch_inputs)
+            self.prefetch_thread.start()
+
+        logger.info(f"Background tasks started with {self.workers} workers")
 
     def stop(self):
         logger.info("Stopping background tasks")
 
+        # 等待worker执行完当前任务，推理完成的任务都已放入后处理队列
         self.stop_event.set()
-        self.connections_manager.close()
+        self.dispatcher.join()
+        if self.prefetch_thread:
+            self.prefetch_thread.join()
+        for thread in self.worker_threads:
+            thread.join()
 
-        logger.info("Background tasks stopped")
+        # 后处理线程保存完队列中的结果后退出，期间继续续期租约
+        for _ in self.postprocess_threads:
+            self.postprocess_queue.put(None)
+        for thread in self.postprocess_threads:
+            thread.join()
+        self.leases_stop_event.set()
+        self.lease_keeper.join()
 
-    def run_task(self, task_info: Box):
-        logger.info(f"Running task: {task_info.id}")
+        # 将尚未执行的任务放回队列，下次启动时继续执行
+        tasks = []
+        while True:
+            try:
+                tasks.append(self.work_queue.get_nowait())
+            except Empty:
+                break
+        for pending_tasks in self.pending.values():
+            tasks.extend(pending_tasks)
+        if tasks:
+            payloads = [payload for payload, _ in tasks]
+            with self.claimed_lock:
+                self.claimed.difference_update(payloads)
+            return_tasks(self.connections_manager.redis_client, payloads)
+            logger.info(f"Returned {len(tasks)} tasks to queue")
 
-        match task_info.type:
-            case "2d_detection":
-                logger.info(f"Running 2D detection task: {task_info.id}")
-                self.detection_2d_service.run(**task_info)
-            case "2d_change_detection":
-                logger.info(f"Running 2D change detection task: {task_info.id}")
-                self.change_detection_2d_service.run(**task_info)
-            case "2d_segmentation":
-                logger.info(f"Running 2D segmentation task: {task_info.id}")
-                self.segmentation_2d_service.run(**task_info)
-            case "3d_segmentation":
-                logger.info(f"Running 3D segmentation task: {task_info.id}")
-                self.segmentation_3d_service.run(**task_info)
-            case _:
-                logger.error(f"Unknown task type: {task_info.type}")
+        self.connections_manager.close()
+
+        logger.info("Background tasks stopped")
@@ -0,0 +1,223 @@
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from threading import Lock
+import time
+from typing import Hashable
+
+from loguru import logger
+from minio import Minio
+from redis import Redis
+
+
+class LRUCache:
+    def __init__(self, max_size: int):
+        """
+        初始化线程安全的LRU缓存，容量按缓存值的字节数计算
+
+        :param max_size: 缓存的最大字节数
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.items: OrderedDict[Hashable, bytes] = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: Hashable) -> bytes | None:
+        """
+        获取缓存值，命中时将其移动到队尾
+
+        :param key: 缓存键
+        :return: 缓存值，如果未命中则返回None
+        """
+        with self.lock:
+            if key not in self.items:
+                return None
+
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key: Hashable, value: bytes):
+        """
+        设置缓存值，超出容量时淘汰最久未使用的缓存
+
+        :param key: 缓存键
+        :param value: 缓存值
+        """
+        value_size = len(value)
+        if value_size > self.max_size:
+            logger.warning(f"缓存值大小{value_size}超过缓存容量{self.max_size}，不缓存")
+            return
+
+        with self.lock:
+            if key in self.items:
+                self.size -= len(self.items.pop(key))
+
+            self.items[key] = value
+            self.size += value_size
+
+            # 淘汰最久未使用的缓存
+            while self.size > self.max_size:
+                evicted_key, evicted_value = self.items.popitem(last=False)
+                self.size -= len(evicted_value)
+                logger.debug(f"淘汰缓存: {evicted_key}")
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.lock:
+            return key in self.items
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.items)
+
+
+class DerivativeCache:
+    def __init__(
+        self,
+        minio_client: Minio,
+        redis_client: Redis,
+        bucket_name: str,
+        *,
+        prefix: str,
+        max_size: int,
+    ):
+        """
+        初始化保存在Minio中的派生文件缓存，按总字节数进行LRU淘汰
+
+        派生文件保存在 `{prefix}/{etag}/` 下，原对象更新后etag变化，旧的派生文件不再命中。
+        最近访问时间和文件大小保存在Redis中，所有API进程共享同一份淘汰记录。
+
+        :param minio_client: Minio客户端
+        :param redis_client: Redis客户端
+        :param bucket_name: 存储桶名称
+        :param prefix: 派生文件的对象名前缀
+        :param max_size: 缓存的最大字节数
+        """
+        self.minio_client = minio_client
+        self.redis_client = redis_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.max_size = max_size
+
+        # 最近访问时间的有序集合、文件大小的哈希表和总大小
+        self.lru_key = f"{prefix}:lru"
+        self.sizes_key = f"{prefix}:sizes"
+        self.total_key = f"{prefix}:total"
+
+    def get_object_name(self, etag: str, variant: str) -> str:
+        """
+        获取派生文件的对象名
+
+        :param etag: 原对象的etag
+        :param variant: 派生文件名，包含生成参数和扩展名
+        :return: 对象名
+        """
+        return f"{self.prefix}/{etag}/{variant}"
+
+    def get(self, etag: str, variant: str) -> str | None:
+        """
+        获取派生文件，命中时更新最近访问时间
+
+        :param etag: 原对象的etag
+        :param variant: 派生文件名
+        :return: 派生文件的对象名，如果未命中则返回None
+        """
+        object_name = self.get_object_name(etag, variant)
+        if self.redis_client.zscore(self.lru_key, object_name) is None:
+            return None
+
+        self.redis_client.zadd(self.lru_key, {object_name: time.time()})
+        logger.debug(f"派生文件缓存命中: {object_name}")
+
+        return object_name
+
+    def put(self, etag: str, variant: str, data: bytes, content_type: str) -> str:
+        """
+        保存派生文件，超出容量时淘汰最久未访问的派生文件
+
+        :param etag: 原对象的etag
+        :param variant: 派生文件名
+        :param data: 派生文件内容
+        :param content_type: 内容类型
+        :return: 派生文件的对象名
+        """
+        object_name = self.get_object_name(etag, variant)
+        self.minio_client.put_object(
+            self.bucket_name,
+            object_name,
+            BytesIO(data),
+            len(data),
+            content_type=content_type,
+        )
+
+        # 重复保存同一派生文件时先扣除旧的大小
+        old_size = self.redis_client.hget(self.sizes_key, object_name)
+        with self.redis_client.pipeline() as pipe:
+            pipe.zadd(self.lru_key, {object_name: time.time()})
+            pipe.hset(self.sizes_key, object_name, len(data))
+            pipe.incrby(self.total_key, len(data) - int(old_size or 0))
+            pipe.execute()
+
+        logger.debug(f"保存派生文件: {object_name}, 大小: {len(data)}")
+        self.evict()
+
+        return object_name
+
+    def evict(self):
+        """
+        淘汰最久未访问的派生文件，直到总大小不超过容量
+        """
+        while int(self.redis_client.get(self.total_key) or 0) > self.max_size:
+            popped = self.redis_client.zpopmin(self.lru_key)
+            if not popped:
+                break
+
+            object_name, _ = popped[0]
+            object_name = object_name.decode("utf-8")
+            size = int(self.redis_client.hget(self.sizes_key, object_name) or 0)
+
+            self.minio_client.remove_object(self.bucket_name, object_name)
+            with self.redis_client.pipeline() as pipe:
+                pipe.hdel(self.sizes_key, object_name)
+                pipe.decrby(self.total_key, size)
+                pipe.execute()
+
+            logger.debug(f"淘汰派生文件: {object_name}, 大小: {size}")
+
+
+def evict_files(directory: Path, max_size: int, keep: Path | None = None) -> int:
+    """
+    按修改时间淘汰目录中最久未使用的文件，直到总大小不超过容量
+
+    命中缓存时更新文件的修改时间，多个进程共享同一目录时也按最近使用顺序淘汰。
+    正在下载的.part文件不计入也不淘汰。
+
+    :param directory: 缓存目录
+    :param max_size: 缓存的最大字节数
+    :param keep: 不淘汰的文件，通常为刚写入的文件
+    :return: 淘汰的文件数量
+    """
+    files = []
+    for path in directory.iterdir():
+        if path.suffix == ".part":
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            # 已被其他进程淘汰
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    evicted = 0
+    for _, size, path in sorted(files):
+        if total <= max_size:
+            break
+        if path == keep:
+            continue
+
+        path.unlink(missing_ok=True)
+        total -= size
+        evicted += 1
+        logger.debug(f"淘汰本地缓存文件: {path}, 大小: {size}")
+
+    return evicted
@@ -0,0 +1,111 @@
+"""
+本地测试用的假分割模型，命令行参数和输出格式与2D分割的predict.py一致
+
+按像素邻域的平均亮度划分类别，结果只依赖局部窗口，
+整图推理和分块推理后拼接的结果在重叠足够时应完全一致。
+可以在INFERENCE_MODELS中替换2D分割的脚本，在没有模型环境时测试推理流程：
+
+    INFERENCE_MODELS='{"2d_segmentation": {"env": "base", "script": "app/utils/fake_model.py"}}'
+
+本文件不依赖app包，以便作为推理脚本由模型推理进程直接运行。
+"""
+
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+import rasterio
+
+# 假模型输出的类别颜色（BGR），与SEGMENTATION_2D_BGR中的部分类别一致
+FAKE_COLORS = np.array(
+    [
+        (0, 0, 200),  # river
+        (150, 0, 250),  # arbor forest
+        (0, 200, 0),  # paddy field
+        (250, 0, 150),  # urban residential
+        (250, 250, 250),  # snow
+    ],
+    dtype=np.uint8,
+)
+# 邻域半径，分块推理时重叠需要大于该值的两倍
+RADIUS = 4
+
+
+def box_blur(img: np.ndarray, radius: int = RADIUS) -> np.ndarray:
+    """
+    均值滤波，边缘按最近像素填充
+
+    :param img: 单通道图像
+    :param radius: 邻域半径
+    :return: 滤波后的图像
+    """
+    size = 2 * radius + 1
+    padded = np.pad(img.astype(np.float64), radius, mode="edge")
+
+    # 使用积分图计算窗口和
+    integral = np.pad(padded.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    total = (
+        integral[size:, size:]
+        - integral[:-size, size:]
+        - integral[size:, :-size]
+        + integral[:-size, :-size]
+    )
+    return total / size**2
+
+
+def segment(img: np.ndarray) -> np.ndarray:
+    """
+    按邻域平均亮度划分类别
+
+    :param img: 形状为(bands, height, width)的图像
+    :return: 形状为(3, height, width)的BGR类别颜色图
+    """
+    brightness = img[:3].astype(np.float64).mean(axis=0)
+    if np.issubdtype(img.dtype, np.integer) and img.dtype != np.uint8:
+        # 非8位影像按数值范围缩放，避免不同分块的范围不同导致结果不一致
+        brightness = brightness / np.iinfo(img.dtype).max * 255
+
+    blurred = box_blur(brightness)
+    labels = np.minimum(blurred * len(FAKE_COLORS) // 256, len(FAKE_COLORS) - 1)
+    colors = FAKE_COLORS[labels.astype(np.intp)]
+
+    return np.moveaxis(colors, -1, 0)
+
+
+def load_model():
+    return None
+
+
+def predict(model, inputimage: str, outputpath: str, maskpath: str | None = None):
+    """
+    推理单张图像并保存结果
+
+    :param model: 模型，假模型不需要
+    :param inputimage: 输入图像
+    :param outputpath: 输出的类别颜色图
+    :param maskpath: 掩码图，假模型只保存类别颜色图
+    """
+    with rasterio.open(inputimage) as src:
+        img = src.read()
+        profile = src.profile
+
+    colors = segment(img)
+
+    if Path(outputpath).suffix.casefold() not in (".tif", ".tiff"):
+        Image.fromarray(np.moveaxis(colors, 0, -1)).save(outputpath)
+        return
+
+    profile.update(count=3, dtype="uint8", nodata=None)
+    with rasterio.open(outputpath, "w", **profile) as dst:
+        dst.write(colors)
+
+
+def predict_batch(model, items: list[dict]):
+    for item in items:
+        predict(model, **item)
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(lambda **kwargs: predict(None, **kwargs))
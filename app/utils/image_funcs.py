@@ -1,10 +1,24 @@
+from math import ceil
 from pathlib import Path
 import shutil
 from tempfile import NamedTemporaryFile
 import traceback
+from typing import BinaryIO
 
+import einops as ep
 from loguru import logger
+import numpy as np
 from PIL import Image
+import rasterio
+from rasterio.enums import Resampling
+import rasterio.shutil
+from rasterio.windows import Window
+
+from app.utils.tile_funcs import (
+    get_display_indexes,
+    get_stretch_range,
+    stretch_to_uint8,
+)
 
 
 def get_metadata(file_path: str | Path):
@@ -62,6 +76,19 @@ def tiff2img(
         logger.error(err_msg)
         raise FileNotFoundError(err_msg)
 
+    # 对于带金字塔的TIFF（如COG），直接读取合适的金字塔层级，无需解码整幅图像
+    overview = read_overview(input_path)
+    if overview is not None:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        img = Image.fromarray(overview)
+        if output_format == "jpg":
+            img.save(output_path, format="JPEG")
+        else:
+            img.save(output_path, format="PNG")
+
+        logger.info(f"已从金字塔生成图片并保存至: {output_path}")
+        return str(output_path)
+
     # 尝试打开输入的TIFF图片并转换为JPG格式
     try:
         logger.info(f"开始转换文件: {input_path}")
@@ -104,3 +131,163 @@ def tiff2img(
 
     else:
         return str(output_path)
+
+
+def is_cog(input_path: str | Path) -> bool:
+    """
+    判断TIFF文件是否已经是分块存储并带有内部金字塔的COG
+
+    :param input_path: TIFF文件路径
+    :return: 是否为COG
+    """
+    with rasterio.open(input_path) as src:
+        layout = src.tags(ns="IMAGE_STRUCTURE").get("LAYOUT")
+        return layout == "COG" or (src.profile.get("tiled") and bool(src.overviews(1)))
+
+
+def tiff2cog(
+    input_tiff_path: str | Path,
+    output_path: str | Path | None = None,
+    *,
+    compress: str = "DEFLATE",
+    overview_resampling: str = "AVERAGE",
+    block_size: int = 512,
+) -> str:
+    """
+    将TIFF图片转换为分块、带内部金字塔、压缩的Cloud-Optimized GeoTIFF
+
+    :param input_tiff_path: 输入TIFF路径
+    :param output_path: 输出路径，为None时使用临时文件
+    :param compress: 无损压缩算法，DEFLATE或ZSTD
+    :param overview_resampling: 金字塔重采样方法，分类结果图应使用NEAREST以保留颜色
+    :param block_size: 分块边长
+    :return: 输出COG路径
+    """
+    input_path = Path(input_tiff_path).expanduser()
+
+    if not output_path:
+        with NamedTemporaryFile(delete=False, suffix=".tif") as temp_file:
+            output_path = temp_file.name
+    output_path = Path(output_path).expanduser()
+
+    try:
+        logger.info(f"开始转换COG: {input_path}, 压缩: {compress}")
+        rasterio.shutil.copy(
+            input_path,
+            output_path,
+            driver="COG",
+            COMPRESS=compress,
+            BLOCKSIZE=block_size,
+            OVERVIEW_RESAMPLING=overview_resampling,
+            BIGTIFF="IF_SAFER",
+            NUM_THREADS="ALL_CPUS",
+        )
+        logger.info(
+            f"COG转换完成: {output_path}, "
+            f"大小: {input_path.stat().st_size} -> {output_path.stat().st_size}"
+        )
+    except Exception as e:
+        logger.error(f"COG转换过程中出现错误: {e}")
+        logger.debug(traceback.format_exc())
+        output_path.unlink(missing_ok=True)
+        raise
+    else:
+        return str(output_path)
+
+
+def read_overview(
+    input_path: str | Path, max_dimension: int = 1080
+) -> np.ndarray | None:
+    """
+    从带金字塔的TIFF中读取不超过指定尺寸的RGB图像
+
+    :param input_path: TIFF文件路径
+    :param max_dimension: 输出图像的最长边
+    :return: 形状为(H, W, 3)的uint8数组，如果文件没有金字塔则返回None
+    """
+    try:
+        with rasterio.open(input_path) as src:
+            if not src.overviews(1):
+                return None
+
+            scale = min(1, max_dimension / max(src.width, src.height))
+            indexes = get_display_indexes(src)
+            out_shape = (
+                len(indexes),
+                max(1, round(src.height * scale)),
+                max(1, round(src.width * scale)),
+            )
+
+            # 最近邻插值会直接使用最接近的金字塔层级，也能保留分类结果的颜色
+            data = src.read(indexes, out_shape=out_shape, resampling=Resampling.nearest)
+            if data.dtype != np.uint8:
+                data = stretch_to_uint8(data, *get_stretch_range(src, indexes))
+    except rasterio.RasterioIOError as e:
+        logger.warning(f"无法读取金字塔: {e}")
+        return None
+    else:
+        return ep.rearrange(data, "c h w -> h w c")
+
+
+def read_tiff_region(
+    input_path: str | Path,
+    crop: tuple[int, int, int, int] | None,
+    size: tuple[int, int],
+) -> np.ndarray:
+    """
+    读取TIFF中的区域并缩放到指定尺寸，GDAL会选择合适的金字塔层级
+
+    :param input_path: TIFF文件路径或URL
+    :param crop: 裁剪区域 (x0, y0, x1, y1)，为None时读取整幅图像
+    :param size: 输出尺寸 (width, height)
+    :return: 形状为(H, W, 3)的uint8数组
+    """
+    with (
+        rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR"),
+        rasterio.open(input_path) as src,
+    ):
+        x0, y0, x1, y1 = crop or (0, 0, src.width, src.height)
+        indexes = get_display_indexes(src)
+        width, height = size
+
+        data = src.read(
+            indexes,
+            window=Window(x0, y0, x1 - x0, y1 - y0),
+            out_shape=(len(indexes), height, width),
+            resampling=Resampling.bilinear,
+        )
+        if data.dtype != np.uint8:
+            data = stretch_to_uint8(data, *get_stretch_range(src, indexes))
+
+    return ep.rearrange(data, "c h w -> h w c")
+
+
+def read_image_region(
+    fp: BinaryIO,
+    crop: tuple[int, int, int, int] | None,
+    size: tuple[int, int],
+) -> np.ndarray:
+    """
+    读取图像中的区域并缩放到指定尺寸，JPEG使用降采样解码，无需解码全分辨率图像
+
+    :param fp: 图像文件对象
+    :param crop: 裁剪区域 (x0, y0, x1, y1)，为None时读取整幅图像
+    :param size: 输出尺寸 (width, height)
+    :return: 形状为(H, W, 3)的uint8数组
+    """
+    with Image.open(fp) as img:
+        original_width, original_height = img.size
+        x0, y0, x1, y1 = crop or (0, 0, original_width, original_height)
+
+        # JPEG可以按1/2、1/4、1/8的比例直接解码，非JPEG图像调用draft无效果
+        scale = min(1, max(size[0] / (x1 - x0), size[1] / (y1 - y0)))
+        img.draft("RGB", (ceil(original_width * scale), ceil(original_height * scale)))
+
+        # 将裁剪区域换算到降采样后的坐标
+        factor = img.size[0] / original_width
+        box = (x0 * factor, y0 * factor, x1 * factor, y1 * factor)
+        logger.debug(f"解码尺寸: {img.size}, 裁剪区域: {box}")
+
+        img = img.convert("RGB").resize(size, Image.LANCZOS, box=box)
+
+    return np.asarray(img)
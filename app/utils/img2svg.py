@@ -31,7 +31,8 @@ class ImageToSvgConverter:
 
         # 根据颜色模式调整颜色顺序
         if color_mode == "bgr":
-            self.colors_map = {k: v[::-1] for k, v in colors_map.items()}
+            colors_map = {k: v[::-1] for k, v in colors_map.items()}
+        self.colors_map = colors_map
 
         # 保存到OrderedDict中，保持顺序
         self.colors_map = OrderedDict(self.colors_map)
@@ -78,22 +79,7 @@ class ImageToSvgConverter:
         dwg = svgwrite.Drawing(filename, id="mask-svg")
 
         for contours, (label, color) in zip(contours_list, self.colors_map.items()):
-            if not contours:
-                continue
-
-            color_str = f"rgb{tuple(color)}"
-            for c in contours:
-                points = c.reshape(-1, 2).tolist()
-                polygon = dwg.polygon(
-                    points=points,
-                    fill=color_str,
-                    # fill_opacity=0,
-                    stroke=color_str,
-                    stroke_width=1,
-                    stroke_linejoin="round",
-                    class_=label,
-                )
-                dwg.add(polygon)
+            self.add_polygons(dwg, contours, label, color)
 
         # dwg.embed_stylesheet(
         #     """
@@ -104,6 +90,104 @@ class ImageToSvgConverter:
         # )
         dwg.save()
 
+    def add_polygons(
+        self, dwg: svgwrite.Drawing, contours: list, label: str, color: Iterable
+    ):
+        """
+        将一个类别的轮廓以多边形的形式添加到SVG中
+
+        :param dwg: SVG画布
+        :param contours: 该类别的轮廓
+        :param label: 类别名称
+        :param color: 类别颜色
+        """
+        color_str = f"rgb{tuple(color)}"
+        for c in contours:
+            points = c.reshape(-1, 2).tolist()
+            polygon = dwg.polygon(
+                points=points,
+                fill=color_str,
+                # fill_opacity=0,
+                stroke=color_str,
+                stroke_width=1,
+                stroke_linejoin="round",
+                class_=label,
+            )
+            dwg.add(polygon)
+
+    def contours2layers(
+        self, contours_list: list, output_dir: Path, size: tuple[int, int]
+    ) -> dict:
+        """
+        将每个类别的轮廓分别保存为一个SVG图层
+
+        :param contours_list: 轮廓列表
+        :param output_dir: 输出目录
+        :param size: 原图尺寸 (width, height)，用于对齐各图层
+        :return: 图层清单，键为类别名称
+        """
+        width, height = size
+        manifest = {}
+
+        for contours, (label, color) in zip(contours_list, self.colors_map.items()):
+            # 空类别不生成图层
+            if not contours:
+                continue
+
+            filename = output_dir / f"{label}.svg"
+            logger.info(f"正在生成SVG图层: {filename}")
+
+            # 所有图层使用相同的viewBox，前端叠加时才能对齐
+            dwg = svgwrite.Drawing(
+                str(filename), id=f"mask-svg-{label}", size=(width, height)
+            )
+            dwg.viewbox(0, 0, width, height)
+            self.add_polygons(dwg, contours, label, color)
+            dwg.save()
+
+            manifest[label] = {
+                "path": filename,
+                "color": list(color),
+                "polygon_count": len(contours),
+            }
+
+        return manifest
+
+    def convert_layers(
+        self, input_path: str | Path, output_dir: str | Path | None = None
+    ) -> dict:
+        """
+        将PNG图像按类别转换为多个SVG图层
+
+        :param input_path: 输入PNG文件路径
+        :param output_dir: 输出目录，为None时使用输入文件同名目录
+        :return: 图层清单，键为类别名称，值包含图层路径、颜色和多边形数量
+        """
+        try:
+            input_path = Path(input_path).expanduser().resolve()
+
+            if output_dir is None:
+                output_dir = input_path.with_suffix("")
+            else:
+                output_dir = Path(output_dir).expanduser().resolve()
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+            logger.info(f"正在分图层处理图像: {input_path}")
+            img = cv.imread(str(input_path))
+            height, width = img.shape[:2]
+
+            bin_imgs = self.colors2channels(img)
+            contours_list = self.get_contours_list(bin_imgs)
+            manifest = self.contours2layers(contours_list, output_dir, (width, height))
+
+            logger.success(f"转换完成，共{len(manifest)}个SVG图层保存到: {output_dir}")
+        except Exception as e:
+            logger.error(f"分图层转换过程中发生错误: {e}")
+            logger.error(f"错误详情:\n{traceback.format_exc()}")
+            raise
+        else:
+            return manifest
+
     def convert(self, input_path: str | Path, output_path: str | Path | None = None):
         """
         将PNG图像转换为SVG
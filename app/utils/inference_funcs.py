@@ -0,0 +1,156 @@
+import hashlib
+import json
+from pathlib import Path
+from subprocess import STDOUT
+import time
+from uuid import uuid4
+
+from loguru import logger
+from plumbum import ProcessExecutionError
+from plumbum.cmd import micromamba
+from redis import Redis
+
+from app.config import (
+    INFERENCE_IDLE_TIMEOUT,
+    INFERENCE_MODE,
+    INFERENCE_MODELS,
+    INFERENCE_START_TIMEOUT,
+    INFERENCE_TIMEOUT,
+    TMPDIR,
+)
+from app.utils.model_server import ALIVE_TTL, args2argv, get_keys
+
+MODEL_SERVER_PATH = Path(__file__).with_name("model_server.py")
+# 推理进程连续启动失败的最大次数
+MAX_SERVER_STARTS = 3
+
+
+def get_model_version(name: str) -> str:
+    """
+    获取模型的版本标识，模型配置（包括可选的version）或推理脚本变化时标识随之变化
+
+    :param name: 模型名称，见INFERENCE_MODELS
+    :return: 版本标识
+    """
+    model = INFERENCE_MODELS[name]
+    digest = hashlib.sha1(json.dumps(model, sort_keys=True).encode())
+
+    script = Path(model["script"]).expanduser()
+    if script.is_file():
+        digest.update(script.read_bytes())
+
+    return digest.hexdigest()[:16]
+
+
+def start_model_server(redis_client: Redis, name: str) -> bool:
+    """
+    在模型所在环境中启动推理进程，已在运行或正在启动时不重复启动
+
+    :param redis_client: Redis客户端
+    :param name: 模型名称
+    :return: 是否启动了新的进程
+    """
+    keys = get_keys(name)
+    if redis_client.exists(keys["alive"]):
+        return False
+    if not redis_client.set(keys["starting"], 1, nx=True, ex=INFERENCE_START_TIMEOUT):
+        return False
+
+    model = INFERENCE_MODELS[name]
+    cmd = micromamba[
+        "run",
+        "-n",
+        model["env"],
+        "python",
+        MODEL_SERVER_PATH,
+        "serve",
+        "--name",
+        name,
+        "--script",
+        model["script"],
+        "--idle_timeout",
+        INFERENCE_IDLE_TIMEOUT,
+    ]
+    logger.info(f"Starting model server: {cmd}")
+
+    # 推理进程独立于当前进程运行，日志写入临时目录
+    log_path = Path(TMPDIR) / f"model_server_{name}.log"
+    with log_path.open("ab") as log_file:
+        cmd.popen(stdout=log_file, stderr=STDOUT, start_new_session=True)
+
+    return True
+
+
+def run_inference(redis_client: Redis, name: str, **args):
+    """
+    使用模型推理，参数与推理脚本的命令行参数一致
+
+    :param redis_client: Redis客户端
+    :param name: 模型名称，见INFERENCE_MODELS
+    :param args: 推理参数，True表示开关参数
+    """
+    (error,) = run_inference_batch(redis_client, name, [args])
+    if error:
+        msg = f"Inference failed: {name}\n{error}"
+        raise RuntimeError(msg)
+
+
+def run_inference_batch(
+    redis_client: Redis, name: str, batch: list[dict]
+) -> list[str | None]:
+    """
+    在一次调用中推理多个输入，推理进程空闲时一批任务只需一次往返
+
+    :param redis_client: Redis客户端
+    :param name: 模型名称，见INFERENCE_MODELS
+    :param batch: 每个输入的推理参数
+    :return: 每个输入的错误信息，成功时为None
+    """
+    model = INFERENCE_MODELS[name]
+
+    if INFERENCE_MODE == "subprocess":
+        errors = []
+        for args in batch:
+            cmd = micromamba[
+                "run", "-n", model["env"], "python", *args2argv(model["script"], args)
+            ]
+            logger.debug(f"Running command: {cmd}")
+            try:
+                cmd()
+                errors.append(None)
+            except ProcessExecutionError as e:
+                errors.append(str(e))
+        return errors
+
+    keys = get_keys(name)
+    job_id = uuid4().hex
+    job = json.dumps({"id": job_id, "batch": batch}, ensure_ascii=False, default=str)
+    result_key = f"{keys['results']}:{job_id}"
+
+    redis_client.rpush(keys["jobs"], job)
+    logger.debug(f"Inference job submitted: {name} {job}")
+
+    starts = 0
+    deadline = time.monotonic() + INFERENCE_TIMEOUT * len(batch)
+    while time.monotonic() < deadline:
+        if start_model_server(redis_client, name):
+            starts += 1
+
+        result = redis_client.blpop(result_key, timeout=ALIVE_TTL)
+        if result is not None:
+            return json.loads(result[1])["errors"]
+
+        # 推理进程异常退出时任务已被取出，不会再有结果
+        is_queued = redis_client.lpos(keys["jobs"], job) is not None
+        is_running = redis_client.exists(keys["alive"], keys["starting"])
+        if not is_queued and not is_running:
+            msg = f"Model server exited during inference: {name}"
+            raise RuntimeError(msg)
+        if is_queued and not is_running and starts >= MAX_SERVER_STARTS:
+            redis_client.lrem(keys["jobs"], 1, job)
+            msg = f"Model server failed to start: {name}"
+            raise RuntimeError(msg)
+
+    redis_client.lrem(keys["jobs"], 1, job)
+    msg = f"Inference timed out: {name}"
+    raise TimeoutError(msg)
@@ -0,0 +1,644 @@
+from math import ceil, log
+from pathlib import Path
+import tempfile
+import time
+
+import laspy
+from loguru import logger
+import numpy as np
+from PIL import Image
+from plumbum import local
+
+# 判断点云是否已分类时最多读取的点数
+CLASSIFICATION_SAMPLE_SIZE = 1_000_000
+
+# LAS规范中表示未分类的类别: 0 从未分类, 1 未分类
+UNCLASSIFIED_LABELS = (0, 1)
+
+# 空间索引瓦片中每个点的存储格式，坐标为相对于点云包围盒最小值的偏移
+TILE_POINT_DTYPE = np.dtype(
+    [("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("classification", "u1")]
+)
+
+# 空间索引的最大层级，瓦片数量不超过 4**MAX_INDEX_LEVEL
+MAX_INDEX_LEVEL = 5
+
+# ASPRS标准类别的显示颜色，其余类别显示为灰色
+CLASS_COLORS = {
+    1: (170, 170, 170),
+    2: (160, 110, 60),
+    3: (140, 210, 100),
+    4: (60, 170, 60),
+    5: (20, 110, 20),
+    6: (220, 80, 60),
+    7: (255, 0, 255),
+    9: (50, 120, 230),
+    10: (120, 120, 120),
+    11: (60, 60, 60),
+    13: (250, 200, 0),
+    14: (250, 150, 0),
+    15: (200, 200, 50),
+    17: (180, 130, 200),
+}
+
+# 高程着色的色带，从低到高
+HEIGHT_COLORS = np.array(
+    [
+        (68, 1, 84),
+        (59, 82, 139),
+        (33, 145, 140),
+        (94, 201, 98),
+        (253, 231, 37),
+    ],
+    dtype=np.float32,
+)
+
+
+def has_classification(reader: laspy.LasReader, sample_size: int) -> bool:
+    """
+    读取点云开头的若干点，判断是否包含有效的分类信息
+
+    :param reader: laspy读取器，读取位置需位于第一个点
+    :param sample_size: 最多读取的点数
+    :return: 是否存在未分类以外的类别
+    """
+    count = min(reader.header.point_count, sample_size)
+    if count == 0:
+        return False
+
+    points = reader.read_points(count)
+    classification = np.asarray(points.classification)
+
+    return bool(np.any(~np.isin(classification, UNCLASSIFIED_LABELS)))
+
+
+def get_crs_wkt(header: laspy.LasHeader) -> str | None:
+    """
+    从LAS头的VLR中解析坐标参考系
+
+    :param header: LAS头
+    :return: WKT格式的坐标参考系，无法解析时返回None
+    """
+    try:
+        crs = header.parse_crs()
+    except Exception as e:
+        logger.warning(f"解析点云坐标参考系失败: {e}")
+        return None
+
+    return crs.to_wkt() if crs else None
+
+
+def get_las_metadata(
+    file_path: str | Path, sample_size: int = CLASSIFICATION_SAMPLE_SIZE
+) -> dict:
+    """
+    只读取LAS/LAZ文件头获取点云元数据，不加载全部点
+
+    :param file_path: 点云文件路径
+    :param sample_size: 判断是否已分类时最多读取的点数，为0时不读取点
+    :return: 点云元数据
+    """
+    with laspy.open(file_path) as reader:
+        header = reader.header
+
+        metadata = {
+            "point_count": header.point_count,
+            "point_format": header.point_format.id,
+            "las_version": str(header.version),
+            "min_x": float(header.mins[0]),
+            "min_y": float(header.mins[1]),
+            "min_z": float(header.mins[2]),
+            "max_x": float(header.maxs[0]),
+            "max_y": float(header.maxs[1]),
+            "max_z": float(header.maxs[2]),
+            "scale_x": float(header.scales[0]),
+            "scale_y": float(header.scales[1]),
+            "scale_z": float(header.scales[2]),
+            "offset_x": float(header.offsets[0]),
+            "offset_y": float(header.offsets[1]),
+            "offset_z": float(header.offsets[2]),
+            "crs": get_crs_wkt(header),
+            "is_classified": has_classification(reader, sample_size),
+        }
+
+    logger.debug(f"点云元数据: {metadata}")
+    return metadata
+
+
+class LasStats:
+    def __init__(self, header: laspy.LasHeader, z_bins: int = 64):
+        """
+        逐块累计点云的各类别点数和高程直方图，可以在转换格式等已有的遍历中顺带统计
+
+        :param header: LAS头，直方图范围和点密度取自文件头
+        :param z_bins: 高程直方图的分箱数
+        """
+        self.header = header
+
+        # 直方图范围取自文件头，保证一次遍历即可完成统计
+        min_z, max_z = float(header.mins[2]), float(header.maxs[2])
+        self.z_edges = np.linspace(min_z, max(max_z, min_z + 1e-6), z_bins + 1)
+
+        self.class_counts = np.zeros(256, dtype=np.int64)
+        self.z_counts = np.zeros(z_bins, dtype=np.int64)
+
+    @classmethod
+    def from_file(cls, file_path: str | Path, z_bins: int = 64) -> "LasStats":
+        # 只读取文件头
+        with laspy.open(file_path) as reader:
+            return cls(reader.header, z_bins)
+
+    def update(self, points: laspy.ScaleAwarePointRecord):
+        classification = np.asarray(points.classification, dtype=np.uint8)
+        self.class_counts += np.bincount(classification, minlength=256)
+        self.z_counts += np.histogram(np.asarray(points.z), bins=self.z_edges)[0]
+
+    def result(self) -> dict:
+        """
+        获取统计结果
+
+        :return: 各类别点数、高程直方图、点密度和是否已分类
+        """
+        header = self.header
+
+        # 按包围盒的水平面积计算平均点密度
+        area = float(
+            (header.maxs[0] - header.mins[0]) * (header.maxs[1] - header.mins[1])
+        )
+        density = header.point_count / area if area > 0 else None
+
+        class_counts = {
+            int(label): int(count)
+            for label, count in enumerate(self.class_counts)
+            if count
+        }
+        stats = {
+            "class_counts": class_counts,
+            "z_histogram": {
+                "edges": self.z_edges.round(6).tolist(),
+                "counts": self.z_counts.tolist(),
+            },
+            "density": density,
+            # 根据全部点的类别判断，比抽样判断更准确
+            "is_classified": any(
+                label not in UNCLASSIFIED_LABELS for label in class_counts
+            ),
+        }
+        logger.debug(f"点云统计信息: {stats}")
+
+        return stats
+
+
+def get_las_stats(
+    file_path: str | Path,
+    *,
+    chunk_size: int = CLASSIFICATION_SAMPLE_SIZE,
+    z_bins: int = 64,
+) -> dict:
+    """
+    分块遍历点云统计各类别点数、高程直方图和点密度，内存占用只与分块大小有关
+
+    :param file_path: 点云文件路径
+    :param chunk_size: 每次读取的点数
+    :param z_bins: 高程直方图的分箱数
+    :return: 点云统计信息
+    """
+    with laspy.open(file_path) as reader:
+        stats = LasStats(reader.header, z_bins)
+        for points in reader.chunk_iterator(chunk_size):
+            stats.update(points)
+
+    return stats.result()
+
+
+def convert_las(
+    input: str | Path,
+    output: str | Path,
+    *,
+    compress: bool,
+    chunk_size: int = CLASSIFICATION_SAMPLE_SIZE,
+    stats: LasStats | None = None,
+) -> str:
+    """
+    分块在LAS和LAZ之间转换，内存占用只与分块大小有关
+
+    :param input: 输入点云路径
+    :param output: 输出点云路径
+    :param compress: 是否压缩为LAZ
+    :param chunk_size: 每次读取的点数
+    :param stats: 在同一次遍历中累计统计信息
+    :return: 输出路径
+    """
+    with laspy.open(input) as reader:
+        with laspy.open(
+            output, mode="w", header=reader.header, do_compress=compress
+        ) as writer:
+            for points in reader.chunk_iterator(chunk_size):
+                writer.write_points(points)
+                if stats is not None:
+                    stats.update(points)
+
+    logger.debug(
+        f"转换点云: {input} ({Path(input).stat().st_size}) -> "
+        f"{output} ({Path(output).stat().st_size})"
+    )
+    return str(output)
+
+
+def is_compressed(file_path: str | Path) -> bool:
+    """
+    判断点云文件是否为LAZ压缩格式
+
+    :param file_path: 点云文件路径
+    :return: 是否已压缩
+    """
+    with laspy.open(file_path) as reader:
+        return reader.header.are_points_compressed
+
+
+def is_copc(file_path: str | Path) -> bool:
+    """
+    判断点云文件是否已经是COPC格式
+
+    :param file_path: 点云文件路径
+    :return: 是否为COPC
+    """
+    with laspy.open(file_path) as reader:
+        return any(vlr.user_id == "copc" for vlr in reader.header.vlrs)
+
+
+def las2copc(input: str | Path, output: str | Path | None = None) -> str:
+    """
+    使用PDAL将LAS/LAZ转换为COPC，八叉树按层级连续存储，客户端可通过HTTP范围请求按需读取
+
+    :param input: 输入点云路径
+    :param output: 输出路径，默认与输入同目录，扩展名为 `.copc.laz`
+    :return: 输出路径
+    """
+    if output is None:
+        output = Path(input).with_suffix(".copc.laz")
+
+    # PDAL是可选依赖，只在启用COPC转换时才需要
+    cmd = local["pdal"]["translate", input, output, "--writers.copc.forward=all"]
+    logger.debug(f"运行PDAL: {cmd}")
+    cmd()
+
+    return str(output)
+
+
+def voxel_unique(xyz: np.ndarray, voxel_size: float) -> np.ndarray:
+    """
+    获取每个体素中第一个点的下标
+
+    :param xyz: 形状为(N, 3)的坐标，已减去包围盒最小值
+    :param voxel_size: 体素边长
+    :return: 保留的点的下标，按原顺序排列
+    """
+    voxels = np.floor(xyz / voxel_size).astype(np.int64)
+    dims = voxels.max(axis=0) + 1 if len(voxels) else np.ones(3, dtype=np.int64)
+
+    # 体素数量不会溢出时将三维下标打包为整数，一维去重比按行去重快得多
+    if np.prod(dims.astype(np.float64)) < 2**62:
+        keys = (voxels[:, 0] * dims[1] + voxels[:, 1]) * dims[2] + voxels[:, 2]
+        _, indices = np.unique(keys, return_index=True)
+    else:
+        _, indices = np.unique(voxels, axis=0, return_index=True)
+
+    return np.sort(indices)
+
+
+def voxel_downsample(
+    file_path: str | Path,
+    budget: int,
+    *,
+    chunk_size: int = CLASSIFICATION_SAMPLE_SIZE,
+    seed: int = 0,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    分块读取点云并进行体素降采样，使输出点数不超过预算
+
+    体素边长按包围盒水平面积和点数预算估计，保留的点超过预算两倍时逐步增大体素边长，
+    内存占用只与分块大小和点数预算有关。
+
+    :param file_path: 点云文件路径
+    :param budget: 输出的最大点数
+    :param chunk_size: 每次读取的点数
+    :param seed: 最终随机抽样的随机种子
+    :return: (坐标偏移, float32坐标, uint8类别)
+    """
+    with laspy.open(file_path) as reader:
+        header = reader.header
+        offset = np.asarray(header.mins, dtype=np.float64)
+        extent = np.maximum(np.asarray(header.maxs) - offset, 1e-6)
+
+        # 点云通常分布在地表附近，按水平面积估计初始体素边长
+        voxel_size = float(np.sqrt(extent[0] * extent[1] / budget))
+
+        xyz = np.empty((0, 3), dtype=np.float64)
+        classes = np.empty(0, dtype=np.uint8)
+        for points in reader.chunk_iterator(chunk_size):
+            chunk_xyz = np.column_stack([points.x, points.y, points.z]) - offset
+            chunk_classes = np.asarray(points.classification, dtype=np.uint8)
+
+            xyz = np.concatenate([xyz, chunk_xyz])
+            classes = np.concatenate([classes, chunk_classes])
+
+            indices = voxel_unique(xyz, voxel_size)
+            while len(indices) > 2 * budget:
+                voxel_size *= 1.5
+                indices = voxel_unique(xyz, voxel_size)
+
+            xyz, classes = xyz[indices], classes[indices]
+
+    # 剩余超出预算的点随机抽样
+    if len(xyz) > budget:
+        rng = np.random.default_rng(seed)
+        indices = np.sort(rng.choice(len(xyz), budget, replace=False))
+        xyz, classes = xyz[indices], classes[indices]
+
+    logger.debug(
+        f"体素降采样: {header.point_count} -> {len(xyz)}, 体素边长: {voxel_size}"
+    )
+
+    return offset, xyz.astype(np.float32), classes
+
+
+def encode_preview(offset: np.ndarray, xyz: np.ndarray, classes: np.ndarray) -> bytes:
+    """
+    将降采样后的点云编码为紧凑的二进制格式，所有数值均为小端序
+
+    格式: uint32点数, float64[3]坐标偏移, float32[点数, 3]相对坐标, uint8[点数]类别
+
+    :param offset: 坐标偏移
+    :param xyz: 相对坐标
+    :param classes: 类别
+    :return: 二进制数据
+    """
+    return b"".join(
+        [
+            np.array([len(xyz)], dtype="<u4").tobytes(),
+            np.asarray(offset, dtype="<f8").tobytes(),
+            np.ascontiguousarray(xyz, dtype="<f4").tobytes(),
+            np.ascontiguousarray(classes, dtype=np.uint8).tobytes(),
+        ]
+    )
+
+
+def las2thumbnail(
+    file_path: str | Path,
+    output_path: str | Path,
+    *,
+    max_dimension: int = 1080,
+    color_by: str = "height",
+    chunk_size: int = CLASSIFICATION_SAMPLE_SIZE,
+) -> str:
+    """
+    分块读取点云并渲染俯视正射缩略图，每个像素保留最高点
+
+    :param file_path: 点云文件路径
+    :param output_path: 缩略图输出路径
+    :param max_dimension: 缩略图的最长边
+    :param color_by: 着色方式，height 按高程着色，class 按类别着色
+    :param chunk_size: 每次读取的点数
+    :return: 缩略图路径
+    """
+    with laspy.open(file_path) as reader:
+        header = reader.header
+        min_x, min_y, min_z = header.mins
+        max_x, max_y, max_z = header.maxs
+        extent_x = max(max_x - min_x, 1e-6)
+        extent_y = max(max_y - min_y, 1e-6)
+
+        # 保证平均每个像素至少有四个点，避免稀疏点云出现大量空洞
+        scale = min(
+            max_dimension / max(extent_x, extent_y),
+            np.sqrt(max(header.point_count, 1) / 4 / (extent_x * extent_y)),
+        )
+        width = max(1, round(extent_x * scale))
+        height = max(1, round(extent_y * scale))
+
+        z_buffer = np.full(width * height, -np.inf, dtype=np.float64)
+        class_buffer = np.zeros(width * height, dtype=np.uint8)
+        for points in reader.chunk_iterator(chunk_size):
+            x, y, z = np.asarray(points.x), np.asarray(points.y), np.asarray(points.z)
+            cols = np.clip(((x - min_x) * scale).astype(np.int64), 0, width - 1)
+            # 图像的行号从上到下，对应北向朝上
+            rows = np.clip(((max_y - y) * scale).astype(np.int64), 0, height - 1)
+            pixels = rows * width + cols
+
+            # 按像素和高程排序，取每个像素中最高的点
+            order = np.lexsort((z, pixels))
+            sorted_pixels = pixels[order]
+            is_last = np.append(sorted_pixels[1:] != sorted_pixels[:-1], True)
+            top = order[is_last]
+
+            higher = z[top] > z_buffer[pixels[top]]
+            top = top[higher]
+            z_buffer[pixels[top]] = z[top]
+            class_buffer[pixels[top]] = np.asarray(points.classification)[top]
+
+    filled = np.isfinite(z_buffer)
+    colors = np.full((width * height, 3), 255, dtype=np.uint8)
+    if color_by == "class":
+        lut = np.full((256, 3), 128, dtype=np.uint8)
+        for label, color in CLASS_COLORS.items():
+            lut[label] = color
+        colors[filled] = lut[class_buffer[filled]]
+    else:
+        t = (z_buffer[filled] - min_z) / max(max_z - min_z, 1e-6)
+        anchors = np.linspace(0, 1, len(HEIGHT_COLORS))
+        for channel in range(3):
+            colors[filled, channel] = np.interp(
+                t, anchors, HEIGHT_COLORS[:, channel]
+            ).round()
+
+    Image.fromarray(colors.reshape(height, width, 3)).save(output_path)
+    logger.debug(f"渲染点云缩略图: {output_path}, 尺寸: {width}x{height}")
+
+    return str(output_path)
+
+
+def build_tile_index(
+    file_path: str | Path,
+    output_dir: str | Path,
+    *,
+    tile_points: int = 200_000,
+    chunk_size: int = CLASSIFICATION_SAMPLE_SIZE,
+) -> dict:
+    """
+    分块读取点云，按水平面四叉树的某一层级将点写入各瓦片文件
+
+    层级按平均每个瓦片的点数选择，瓦片文件由连续的TILE_POINT_DTYPE记录组成。
+
+    :param file_path: 点云文件路径
+    :param output_dir: 瓦片文件输出目录
+    :param tile_points: 每个瓦片的目标点数
+    :param chunk_size: 每次读取的点数
+    :return: 索引清单，包含坐标偏移、层级、瓦片尺寸和各瓦片的点数与包围盒
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with laspy.open(file_path) as reader:
+        header = reader.header
+        offset = np.asarray(header.mins, dtype=np.float64)
+        extent = np.maximum(np.asarray(header.maxs) - offset, 1e-6)
+
+        level = ceil(log(max(header.point_count / tile_points, 1), 4))
+        level = min(level, MAX_INDEX_LEVEL)
+        grid = 2**level
+        tile_size = extent[:2] / grid
+
+        tiles: dict[str, dict] = {}
+        for points in reader.chunk_iterator(chunk_size):
+            records = np.empty(len(points), dtype=TILE_POINT_DTYPE)
+            records["x"] = np.asarray(points.x) - offset[0]
+            records["y"] = np.asarray(points.y) - offset[1]
+            records["z"] = np.asarray(points.z) - offset[2]
+            records["classification"] = np.asarray(points.classification)
+
+            cols = np.clip((records["x"] / tile_size[0]).astype(np.int64), 0, grid - 1)
+            rows = np.clip((records["y"] / tile_size[1]).astype(np.int64), 0, grid - 1)
+            keys = rows * grid + cols
+
+            # 按瓦片排序后一次性追加，每个瓦片每个分块只写一次文件
+            order = np.argsort(keys, kind="stable")
+            keys, records = keys[order], records[order]
+            unique_keys, starts = np.unique(keys, return_index=True)
+            for key, tile_records in zip(
+                unique_keys, np.split(records, starts[1:]), strict=True
+            ):
+                name = f"{key % grid}_{key // grid}"
+                with open(output_dir / f"{name}.bin", "ab") as f:
+                    f.write(tile_records.tobytes())
+
+                tile = tiles.setdefault(
+                    name,
+                    {"count": 0, "mins": [np.inf] * 3, "maxs": [-np.inf] * 3},
+                )
+                xyz = np.column_stack(
+                    [tile_records["x"], tile_records["y"], tile_records["z"]]
+                )
+                tile["count"] += len(tile_records)
+                tile["mins"] = np.minimum(tile["mins"], xyz.min(axis=0)).tolist()
+                tile["maxs"] = np.maximum(tile["maxs"], xyz.max(axis=0)).tolist()
+
+    manifest = {
+        "offset": offset.tolist(),
+        "level": level,
+        "tile_size": tile_size.tolist(),
+        "point_count": header.point_count,
+        "tiles": tiles,
+    }
+    logger.debug(f"构建点云空间索引: 层级 {level}, 瓦片数 {len(tiles)}")
+
+    return manifest
+
+
+def get_index_tiles(manifest: dict, bbox: tuple[float, float, float, float]) -> list:
+    """
+    获取与查询范围相交的瓦片名称
+
+    :param manifest: 索引清单
+    :param bbox: 查询范围 (min_x, min_y, max_x, max_y)，使用点云原始坐标
+    :return: 瓦片名称列表
+    """
+    offset_x, offset_y, _ = manifest["offset"]
+    min_x, min_y = bbox[0] - offset_x, bbox[1] - offset_y
+    max_x, max_y = bbox[2] - offset_x, bbox[3] - offset_y
+
+    return [
+        name
+        for name, tile in manifest["tiles"].items()
+        if tile["mins"][0] <= max_x
+        and tile["maxs"][0] >= min_x
+        and tile["mins"][1] <= max_y
+        and tile["maxs"][1] >= min_y
+    ]
+
+
+def points_in_polygon(xy: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """
+    使用射线法判断点是否位于多边形内，按多边形的边向量化
+
+    :param xy: 形状为(N, 2)的点坐标
+    :param polygon: 形状为(M, 2)的多边形顶点，首尾无需重复
+    :return: 形状为(N,)的布尔数组
+    """
+    x, y = xy[:, 0], xy[:, 1]
+    inside = np.zeros(len(xy), dtype=bool)
+
+    for (x0, y0), (x1, y1) in zip(polygon, np.roll(polygon, -1, axis=0), strict=True):
+        crosses = (y0 > y) != (y1 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            intersect_x = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (x < intersect_x)
+
+    return inside
+
+
+def filter_tile_points(
+    records: np.ndarray,
+    offset: np.ndarray,
+    *,
+    bbox: tuple[float, float, float, float] | None = None,
+    polygon: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    筛选瓦片中位于查询范围内的点
+
+    :param records: TILE_POINT_DTYPE记录
+    :param offset: 坐标偏移
+    :param bbox: 查询范围，使用点云原始坐标
+    :param polygon: 查询多边形，使用点云原始坐标
+    :return: 筛选后的记录
+    """
+    xy = np.column_stack([records["x"], records["y"]]).astype(np.float64)
+    xy += offset[:2]
+
+    mask = np.ones(len(records), dtype=bool)
+    if bbox is not None:
+        mask &= (xy[:, 0] >= bbox[0]) & (xy[:, 0] <= bbox[2])
+        mask &= (xy[:, 1] >= bbox[1]) & (xy[:, 1] <= bbox[3])
+    if polygon is not None:
+        mask[mask] = points_in_polygon(xy[mask], polygon)
+
+    return records[mask]
+
+
+def compression_report(*paths: str, chunk_size: int = CLASSIFICATION_SAMPLE_SIZE):
+    """
+    统计点云压缩为LAZ后的大小和节省的存储与传输量
+
+    :param paths: LAS文件路径
+    :param chunk_size: 每次读取的点数
+    """
+    total_las, total_laz = 0, 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for path in paths:
+            laz_path = Path(tmp_dir) / Path(path).with_suffix(".laz").name
+
+            start = time.perf_counter()
+            convert_las(path, laz_path, compress=True, chunk_size=chunk_size)
+            elapsed = time.perf_counter() - start
+
+            las_size, laz_size = Path(path).stat().st_size, laz_path.stat().st_size
+            total_las += las_size
+            total_laz += laz_size
+            print(
+                f"{path}: {las_size / 2**20:.1f} MiB -> {laz_size / 2**20:.1f} MiB, "
+                f"压缩率 {laz_size / las_size:.1%}, 耗时 {elapsed:.1f}s"
+            )
+            laz_path.unlink()
+
+    if total_las:
+        print(
+            f"合计: {total_las / 2**20:.1f} MiB -> {total_laz / 2**20:.1f} MiB, "
+            f"每次上传和下载节省 {(total_las - total_laz) / 2**20:.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(compression_report)
@@ -0,0 +1,222 @@
+"""
+常驻的模型推理进程，在模型所在的micromamba环境中运行，通过Redis接收推理任务
+
+进程启动时加载一次模型脚本，之后的任务不再重复激活环境、启动解释器和导入框架。
+脚本提供 load_model() 和 predict(model, **kwargs) 时只加载一次权重，
+另外提供 predict_batch(model, items) 时一批任务在一次调用中推理，
+否则每个任务按命令行方式重新执行脚本，已导入的模块会被复用。
+空闲超过指定时间后进程退出并释放显存，下次有任务时由客户端重新启动。
+
+本文件不依赖app包，以便在模型环境中直接运行：
+
+    python app/utils/model_server.py serve --name 2d_segmentation --script predict.py
+"""
+
+import ast
+from contextlib import suppress
+import json
+import os
+from pathlib import Path
+import runpy
+import sys
+from threading import Thread
+import time
+import traceback
+
+from loguru import logger
+from redis import Redis
+
+# 推理进程存活标记的过期时间（秒），由心跳线程定期续期
+ALIVE_TTL = 10
+
+
+def get_keys(name: str) -> dict[str, str]:
+    """
+    获取模型推理进程使用的Redis键
+
+    :param name: 模型名称
+    :return: 任务队列、存活标记、启动锁和结果键前缀
+    """
+    prefix = f"inference:{name}"
+    return {
+        "jobs": f"{prefix}:jobs",
+        "alive": f"{prefix}:alive",
+        "starting": f"{prefix}:starting",
+        "results": f"{prefix}:results",
+    }
+
+
+def args2argv(script: str, args: dict) -> list[str]:
+    # 将参数转换为命令行参数，True转换为开关参数，False和None忽略
+    argv = [script]
+    for key, value in args.items():
+        if value is True:
+            argv.append(f"--{key}")
+        elif value is not False and value is not None:
+            argv.extend([f"--{key}", str(value)])
+
+    return argv
+
+
+class ModelServer:
+    def __init__(self, name: str, script: str, idle_timeout: float = 600):
+        """
+        模型推理进程
+
+        :param name: 模型名称，与客户端一致
+        :param script: 模型的推理脚本
+        :param idle_timeout: 空闲多久后退出（秒）
+        """
+        self.name = name
+        self.script = str(Path(script).expanduser().resolve())
+        self.idle_timeout = idle_timeout
+        self.keys = get_keys(name)
+
+        self.redis_client = Redis(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", "6379")),
+            db=int(os.getenv("REDIS_DB", "0")),
+            password=os.getenv("REDIS_PASSWORD") or None,
+        )
+
+        # 脚本中的相对导入以脚本所在目录为准
+        sys.path.insert(0, str(Path(self.script).parent))
+
+        self.model = None
+        self.predict = None
+        self.predict_batch = None
+        # 准备退出时停止续期存活标记
+        self.exiting = False
+
+    def load(self):
+        # 脚本提供加载和推理函数时只加载一次模型
+        # 先检查函数定义，避免执行没有入口判断的命令行脚本
+        tree = ast.parse(Path(self.script).read_text(encoding="utf-8"))
+        functions = {
+            node.name for node in tree.body if isinstance(node, ast.FunctionDef)
+        }
+
+        if {"load_model", "predict"} <= functions:
+            script_globals = runpy.run_path(self.script, run_name="model_server")
+            logger.info(f"Loading model: {self.name}")
+            self.model = script_globals["load_model"]()
+            self.predict = script_globals["predict"]
+            if "predict_batch" in functions:
+                self.predict_batch = script_globals["predict_batch"]
+        else:
+            logger.info(
+                f"Script has no load_model/predict, running as CLI: {self.name}"
+            )
+
+    def run_job(self, args: dict):
+        if self.predict is not None:
+            self.predict(self.model, **args)
+            return
+
+        argv = sys.argv
+        sys.argv = args2argv(self.script, args)
+        try:
+            runpy.run_path(self.script, run_name="__main__")
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                msg = f"Script exited with code {e.code}"
+                raise RuntimeError(msg) from e
+        finally:
+            sys.argv = argv
+
+    def run_batch(self, batch: list[dict]) -> list[str | None]:
+        """
+        执行一批推理任务
+
+        :param batch: 每个任务的推理参数
+        :return: 每个任务的错误信息，成功时为None
+        """
+        if self.predict_batch is not None and len(batch) > 1:
+            try:
+                self.predict_batch(self.model, batch)
+            except Exception as e:
+                logger.error(f"Inference batch failed: {e}")
+                return [traceback.format_exc()] * len(batch)
+            return [None] * len(batch)
+
+        errors = []
+        for args in batch:
+            try:
+                self.run_job(args)
+                errors.append(None)
+            except Exception as e:
+                logger.error(f"Inference job failed: {e}")
+                errors.append(traceback.format_exc())
+
+        return errors
+
+    def heartbeat(self):
+        # 加载模型和执行任务时也续期存活标记，客户端据此判断进程是否异常退出
+        while True:
+            if not self.exiting:
+                with suppress(Exception):
+                    self.redis_client.set(self.keys["alive"], os.getpid(), ex=ALIVE_TTL)
+            time.sleep(ALIVE_TTL / 3)
+
+    def serve(self):
+        Thread(target=self.heartbeat, daemon=True).start()
+        self.redis_client.set(self.keys["alive"], os.getpid(), ex=ALIVE_TTL)
+        self.load()
+        self.redis_client.delete(self.keys["starting"])
+        logger.info(f"Model server started: {self.name}")
+
+        last_active = time.monotonic()
+        while True:
+            result = self.redis_client.blpop(self.keys["jobs"], timeout=1)
+            if result is None:
+                if time.monotonic() - last_active < self.idle_timeout:
+                    continue
+
+                # 先删除存活标记，再确认没有新任务，避免任务在退出时无人处理
+                self.exiting = True
+                self.redis_client.delete(self.keys["alive"])
+                result = self.redis_client.lpop(self.keys["jobs"])
+                if result is None:
+                    logger.info(f"Model server idle, exiting: {self.name}")
+                    return
+
+                self.exiting = False
+                self.redis_client.set(self.keys["alive"], os.getpid(), ex=ALIVE_TTL)
+                result = (self.keys["jobs"], result)
+
+            _, job = result
+            job = json.loads(job)
+            logger.info(f"Running inference job: {job['id']} ({len(job['batch'])})")
+
+            response = {"ok": True, "errors": self.run_batch(job["batch"])}
+
+            result_key = f"{self.keys['results']}:{job['id']}"
+            with self.redis_client.pipeline() as pipe:
+                pipe.rpush(result_key, json.dumps(response))
+                pipe.expire(result_key, ALIVE_TTL * 60)
+                pipe.execute()
+
+            last_active = time.monotonic()
+
+
+def serve(name: str, script: str, idle_timeout: float = 600):
+    """
+    启动模型推理进程
+
+    :param name: 模型名称
+    :param script: 模型的推理脚本
+    :param idle_timeout: 空闲多久后退出（秒）
+    """
+    server = ModelServer(name, script, idle_timeout)
+    try:
+        server.serve()
+    finally:
+        server.exiting = True
+        with suppress(Exception):
+            server.redis_client.delete(server.keys["alive"], server.keys["starting"])
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire({"serve": serve})
@@ -1,4 +1,6 @@
 from base64 import b64encode
+import hashlib
+import mimetypes
 from pathlib import Path
 import shutil
 import socket
@@ -8,6 +10,7 @@ from fire import Fire
 from furl import furl
 from loguru import logger
 from minio import Minio
+from minio.deleteobjects import DeleteObject
 from minio.error import S3Error
 
 
@@ -114,3 +117,107 @@ def get_object_base64(client: Minio, bucket_name: str, object_name: str) -> str:
         logger.error(f"获取对象 {object_name} 的 base64 编码时发生错误: {e}")
         logger.error(f"错误堆栈跟踪:\n{traceback.format_exc()}")
         return None
+
+
+def upload_folder(
+    client: Minio,
+    bucket_name: str,
+    folder: str | Path,
+    prefix: str,
+    *,
+    exclude: tuple[str, ...] = (),
+) -> int:
+    """
+    将本地文件夹按相对路径上传到 minio 对象名前缀下。
+
+    Args:
+        client: Minio 客户端实例
+        bucket_name: 存储桶名称
+        folder: 本地文件夹
+        prefix: 对象名前缀
+        exclude: 不上传的顶层子文件夹名
+
+    Returns:
+        上传的文件数量
+    """
+    folder = Path(folder)
+
+    count = 0
+    for file_path in folder.rglob("*"):
+        relative_path = file_path.relative_to(folder)
+        if not file_path.is_file() or relative_path.parts[0] in exclude:
+            continue
+
+        content_type = mimetypes.guess_type(file_path, strict=False)[0]
+        client.fput_object(
+            bucket_name,
+            f"{prefix}/{relative_path.as_posix()}",
+            str(file_path),
+            content_type=content_type or "application/octet-stream",
+        )
+        count += 1
+
+    logger.info(f"上传文件夹 {folder} 到 {prefix}，共 {count} 个文件")
+    return count
+
+
+def get_folder_version(folder: str | Path, *, exclude: tuple[str, ...] = ()) -> str:
+    """
+    根据文件的相对路径、大小和修改时间计算本地文件夹的版本标识，文件变化后标识随之改变。
+
+    Args:
+        folder: 本地文件夹
+        exclude: 不计入的顶层子文件夹名
+
+    Returns:
+        版本标识
+    """
+    folder = Path(folder)
+
+    digest = hashlib.sha1()
+    for child in sorted(folder.iterdir()):
+        if child.name in exclude:
+            continue
+
+        files = sorted(child.rglob("*")) if child.is_dir() else [child]
+        for file_path in files:
+            if not file_path.is_file():
+                continue
+
+            stat = file_path.stat()
+            relative_path = file_path.relative_to(folder).as_posix()
+            digest.update(
+                f"{relative_path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode()
+            )
+
+    return digest.hexdigest()[:16]
+
+
+def remove_folder(client: Minio, bucket_name: str, prefix: str) -> int:
+    """
+    删除 minio 对象名前缀下的所有对象。
+
+    Args:
+        client: Minio 客户端实例
+        bucket_name: 存储桶名称
+        prefix: 对象名前缀
+
+    Returns:
+        删除的对象数量
+    """
+    object_names = [
+        obj.object_name
+        for obj in client.list_objects(bucket_name, f"{prefix}/", recursive=True)
+    ]
+
+    errors = list(
+        client.remove_objects(
+            bucket_name, [DeleteObject(object_name) for object_name in object_names]
+        )
+    )
+    if errors:
+        msg = f"删除 {prefix} 下的对象时发生错误: {errors}"
+        raise RuntimeError(msg)
+
+    logger.info(f"删除 {prefix} 下的 {len(object_names)} 个对象")
+    return len(object_names)
@@ -0,0 +1,147 @@
+from io import BytesIO
+from typing import Iterable
+
+import einops as ep
+from loguru import logger
+import numpy as np
+from PIL import Image
+
+# 不属于任何类别的像素的标签
+UNKNOWN_LABEL = 255
+
+# 渲染格式到PIL格式和MIME类型的映射
+RENDER_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+
+def get_fit_size(
+    original_width: int,
+    original_height: int,
+    width: int | None = None,
+    height: int | None = None,
+    max_dimension: int = 1080,
+    max_size: int | None = None,
+) -> tuple[int, int]:
+    """
+    根据请求的宽高计算输出尺寸，只提供一边时保持原图宽高比
+
+    :param original_width: 原图宽度
+    :param original_height: 原图高度
+    :param width: 请求的宽度
+    :param height: 请求的高度
+    :param max_dimension: 未提供宽高时输出的最长边
+    :param max_size: 输出边长的上限，按宽高比计算的边超出时等比缩小
+    :return: 输出尺寸 (width, height)
+    """
+    aspect_ratio = original_width / original_height
+
+    if width and height:
+        size = width, height
+    elif width:
+        size = width, max(1, round(width / aspect_ratio))
+    elif height:
+        size = max(1, round(height * aspect_ratio)), height
+    else:
+        # 未提供宽高时，按最长边缩放，但不放大
+        scale = min(1, max_dimension / max(original_width, original_height))
+        size = (
+            max(1, round(original_width * scale)),
+            max(1, round(original_height * scale)),
+        )
+
+    if max_size and max(size) > max_size:
+        scale = max_size / max(size)
+        size = max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+    return size
+
+
+def pack_colors(colors: np.ndarray) -> np.ndarray:
+    """
+    将RGB颜色打包为uint32整数，便于向量化查表
+
+    :param colors: 形状为(..., 3)的颜色数组
+    :return: 形状为(...)的整数数组
+    """
+    colors = colors.astype(np.uint32)
+    return (colors[..., 0] << 16) | (colors[..., 1] << 8) | colors[..., 2]
+
+
+def colors2labels(img: np.ndarray, colors: np.ndarray) -> np.ndarray:
+    """
+    将彩色分割图转换为标签图，未匹配任何颜色的像素标记为UNKNOWN_LABEL
+
+    :param img: 形状为(H, W, 3)的RGB图像
+    :param colors: 形状为(K, 3)的RGB颜色表，下标即标签
+    :return: 形状为(H, W)的uint8标签图
+    """
+    color_keys = pack_colors(colors)
+    order = np.argsort(color_keys)
+    sorted_keys = color_keys[order]
+
+    # 二分查找每个像素颜色在颜色表中的位置
+    keys = pack_colors(img)
+    indices = np.searchsorted(sorted_keys, keys)
+    indices = np.clip(indices, 0, len(sorted_keys) - 1)
+    matched = sorted_keys[indices] == keys
+
+    labels = np.where(matched, order[indices], UNKNOWN_LABEL)
+    return labels.astype(np.uint8)
+
+
+def blend_overlay(
+    img: np.ndarray,
+    labels: np.ndarray,
+    colors: np.ndarray,
+    *,
+    classes: Iterable[int] | None = None,
+    opacity: float = 0.5,
+) -> np.ndarray:
+    """
+    将标签图按颜色表着色后以指定不透明度叠加到原图上
+
+    :param img: 形状为(H, W, 3)的RGB原图
+    :param labels: 形状为(H, W)的标签图
+    :param colors: 形状为(K, 3)的RGB颜色表
+    :param classes: 需要叠加的类别标签，为None时叠加所有类别
+    :param opacity: 叠加层不透明度，范围[0, 1]
+    :return: 叠加后的RGB图像
+    """
+    # 扩展颜色表到256项，使任意uint8标签都能直接查表
+    lut = np.zeros((256, 3), dtype=np.float32)
+    lut[: len(colors)] = colors
+
+    # 选中类别的查找表
+    selected = np.zeros(256, dtype=bool)
+    if classes is None:
+        selected[: len(colors)] = True
+    else:
+        selected[list(classes)] = True
+    selected[UNKNOWN_LABEL] = False
+
+    alpha = selected[labels].astype(np.float32) * opacity
+    alpha = ep.rearrange(alpha, "h w -> h w 1")
+
+    blended = img.astype(np.float32) * (1 - alpha) + lut[labels] * alpha
+    return blended.round().astype(np.uint8)
+
+
+def encode_image(img: np.ndarray, format: str = "png", quality: int = 85) -> bytes:
+    """
+    将RGB数组编码为图像字节
+
+    :param img: RGB图像数组
+    :param format: 输出格式，png、jpg或webp
+    :param quality: 有损格式的压缩质量
+    :return: 编码后的图像字节
+    """
+    pil_format, _ = RENDER_FORMATS[format]
+
+    buffer = BytesIO()
+    Image.fromarray(img).save(buffer, format=pil_format, quality=quality)
+    logger.debug(f"编码图像: {img.shape}, 格式: {format}, 大小: {buffer.tell()}")
+
+    return buffer.getvalue()
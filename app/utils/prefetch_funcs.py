@@ -0,0 +1,140 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+import shutil
+from threading import Lock
+import time
+from typing import Callable
+
+from loguru import logger
+
+from app.config import PREFETCH_CACHE_SIZE, PREFETCH_TTL, PREFETCH_WORKERS, TMPDIR
+
+
+@dataclass
+class PrefetchEntry:
+    path: Path
+    size: int
+    future: Future | None = None
+    created: float = field(default_factory=time.monotonic)
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        root: str | Path,
+        budget: int = PREFETCH_CACHE_SIZE,
+        workers: int = PREFETCH_WORKERS,
+        ttl: float = PREFETCH_TTL,
+    ):
+        """
+        在后台将即将执行的任务的输入文件下载到本地，任务开始时直接使用
+
+        预取的文件被取走后不再占用磁盘预算，超过有效期未被取走的文件会被删除。
+
+        :param root: 预取文件目录
+        :param budget: 预取文件的最大总字节数
+        :param workers: 同时下载的文件数
+        :param ttl: 预取文件的有效期（秒）
+        """
+        self.root = Path(root)
+        self.budget = budget
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="prefetch")
+
+        self.entries: dict[str, PrefetchEntry] = {}
+        self.lock = Lock()
+
+    @property
+    def used(self) -> int:
+        return sum(entry.size for entry in self.entries.values())
+
+    def reset(self):
+        # 删除上次运行留下的预取文件
+        with self.lock:
+            self.entries.clear()
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def prefetch(
+        self, key: str, suffix: str, size: int, download: Callable[[Path], None]
+    ) -> bool:
+        """
+        在后台下载文件，已在下载时不重复下载，超出磁盘预算时跳过
+
+        :param key: 文件的唯一标识，如对象的etag
+        :param suffix: 文件后缀
+        :param size: 文件大小
+        :param download: 将文件下载到指定路径的函数
+        :return: 文件是否已预取或开始预取，超出磁盘预算时返回False
+        """
+        with self.lock:
+            if key in self.entries:
+                return True
+
+            self._evict_expired()
+            if self.used + size > self.budget:
+                return False
+
+            self.root.mkdir(parents=True, exist_ok=True)
+            entry = PrefetchEntry(self.root / f"{key}{suffix}", size)
+            self.entries[key] = entry
+            entry.future = self.executor.submit(self._download, key, entry, download)
+
+        logger.debug(f"Prefetching {key} ({size} bytes)")
+        return True
+
+    def take(self, key: str, output_path: str | Path) -> bool:
+        """
+        取走预取的文件，正在下载时等待下载完成
+
+        :param key: 文件的唯一标识
+        :param output_path: 文件移动到的路径
+        :return: 是否取到预取的文件，未预取或下载失败时返回False
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return False
+
+        try:
+            entry.future.result()
+        except Exception:
+            return False
+
+        # 同一文件只能被一个任务取走
+        with self.lock:
+            if self.entries.get(key) is not entry:
+                return False
+            del self.entries[key]
+
+        shutil.move(entry.path, output_path)
+        logger.debug(f"Using prefetched file {key}")
+        return True
+
+    def _download(
+        self, key: str, entry: PrefetchEntry, download: Callable[[Path], None]
+    ):
+        # 先下载到临时文件，完成后再重命名
+        temp_path = entry.path.with_name(entry.path.name + ".part")
+        try:
+            download(temp_path)
+            temp_path.replace(entry.path)
+        except Exception as e:
+            logger.error(f"Error prefetching {key}: {e}")
+            temp_path.unlink(missing_ok=True)
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+            raise
+
+    def _evict_expired(self):
+        # 删除超过有效期未被取走的文件，对应的任务可能已被跳过或在其他进程执行
+        now = time.monotonic()
+        for key, entry in list(self.entries.items()):
+            if entry.future.done() and now - entry.created > self.ttl:
+                del self.entries[key]
+                entry.path.unlink(missing_ok=True)
+
+
+# 进程内共享的预取器，由后台任务写入，copy2local读取
+prefetcher = Prefetcher(Path(TMPDIR) / "prefetch")
@@ -0,0 +1,235 @@
+from pathlib import Path
+import tempfile
+import time
+
+from loguru import logger
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+
+def get_tile_windows(
+    width: int, height: int, tile_size: int, overlap: int
+) -> list[tuple[int, int, int, int]]:
+    """
+    将影像划分为相互重叠的分块，最后一行和一列的分块与影像边缘对齐
+
+    :param width: 影像宽度
+    :param height: 影像高度
+    :param tile_size: 分块边长
+    :param overlap: 相邻分块的重叠像素数
+    :return: 分块窗口列表，每个窗口为(col_off, row_off, width, height)
+    """
+    if overlap >= tile_size:
+        msg = "overlap must be smaller than tile_size"
+        raise ValueError(msg)
+
+    def get_offsets(length: int) -> list[int]:
+        if length <= tile_size:
+            return [0]
+        stride = tile_size - overlap
+        offsets = list(range(0, length - tile_size, stride))
+        offsets.append(length - tile_size)
+        return offsets
+
+    return [
+        (col_off, row_off, min(tile_size, width), min(tile_size, height))
+        for row_off in get_offsets(height)
+        for col_off in get_offsets(width)
+    ]
+
+
+def get_tile_weights(
+    window: tuple[int, int, int, int], width: int, height: int
+) -> np.ndarray:
+    """
+    计算分块中每个像素到分块内部边缘的距离，作为拼接时的权重
+
+    与影像边缘重合的分块边不计入距离，影像边缘的像素只有一个分块覆盖。
+
+    :param window: 分块窗口(col_off, row_off, width, height)
+    :param width: 影像宽度
+    :param height: 影像高度
+    :return: 形状为(height, width)的权重
+    """
+    col_off, row_off, tile_width, tile_height = window
+
+    def get_distances(offset: int, length: int, total: int) -> np.ndarray:
+        index = np.arange(length)
+        before = index + 1 if offset > 0 else np.full(length, total)
+        after = length - index if offset + length < total else np.full(length, total)
+        return np.minimum(before, after)
+
+    rows = get_distances(row_off, tile_height, height)
+    cols = get_distances(col_off, tile_width, width)
+    return np.minimum(rows[:, None], cols[None, :]).astype(np.uint32)
+
+
+def split_scene(
+    input_path: str | Path,
+    output_dir: str | Path,
+    windows: list[tuple[int, int, int, int]],
+) -> list[Path]:
+    """
+    将影像按窗口保存为分块GeoTIFF，已存在的分块不重复保存
+
+    :param input_path: 输入影像
+    :param output_dir: 分块目录
+    :param windows: 分块窗口
+    :return: 分块文件路径
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    tile_paths = []
+    with rasterio.open(input_path) as src:
+        for index, (col_off, row_off, width, height) in enumerate(windows):
+            tile_path = output_dir / f"{index}.tif"
+            tile_paths.append(tile_path)
+            if tile_path.exists():
+                continue
+
+            window = Window(col_off, row_off, width, height)
+            profile = src.profile
+            profile.update(
+                driver="GTiff",
+                width=width,
+                height=height,
+                transform=src.window_transform(window),
+                tiled=False,
+                compress=None,
+            )
+            profile.pop("blockxsize", None)
+            profile.pop("blockysize", None)
+
+            # 先写入临时文件再重命名，避免中断后留下不完整的分块
+            temp_path = tile_path.with_suffix(".partial.tif")
+            with rasterio.open(temp_path, "w", **profile) as dst:
+                dst.write(src.read(window=window))
+            temp_path.replace(tile_path)
+
+    return tile_paths
+
+
+def stitch_tiles(
+    input_path: str | Path,
+    windows: list[tuple[int, int, int, int]],
+    tile_paths: list[str | Path],
+    output_path: str | Path,
+    scratch_dir: str | Path | None = None,
+) -> Path:
+    """
+    拼接分块的推理结果，重叠区域取离所在分块边缘最远的结果
+
+    类别结果不能取平均，重叠区域按权重选取一个分块的结果，
+    使每个像素都来自上下文最完整的分块。中间结果保存在磁盘上，支持超大影像。
+
+    :param input_path: 输入影像，提供尺寸和地理参考
+    :param windows: 分块窗口
+    :param tile_paths: 每个分块的推理结果
+    :param output_path: 输出路径
+    :param scratch_dir: 中间结果目录，默认为临时目录
+    :return: 输出路径
+    """
+    output_path = Path(output_path)
+
+    with rasterio.open(input_path) as src:
+        profile = src.profile
+        width, height = src.width, src.height
+
+    with tempfile.TemporaryDirectory(dir=scratch_dir) as temp_dir:
+        temp_dir = Path(temp_dir)
+        result = np.lib.format.open_memmap(
+            temp_dir / "result.npy", mode="w+", dtype=np.uint8, shape=(3, height, width)
+        )
+        weights = np.lib.format.open_memmap(
+            temp_dir / "weights.npy", mode="w+", dtype=np.uint32, shape=(height, width)
+        )
+
+        for window, tile_path in zip(windows, tile_paths):
+            col_off, row_off, tile_width, tile_height = window
+            with rasterio.open(tile_path) as tile:
+                colors = tile.read(indexes=[1, 2, 3])
+
+            tile_weights = get_tile_weights(window, width, height)
+            rows = slice(row_off, row_off + tile_height)
+            cols = slice(col_off, col_off + tile_width)
+
+            is_better = tile_weights > weights[rows, cols]
+            weights[rows, cols] = np.where(is_better, tile_weights, weights[rows, cols])
+            result[:, rows, cols] = np.where(is_better, colors, result[:, rows, cols])
+
+        profile.update(
+            driver="GTiff", count=3, dtype="uint8", nodata=None, photometric="RGB"
+        )
+
+        with rasterio.open(output_path, "w", **profile) as dst:
+            for _, window in dst.block_windows(1):
+                rows, cols = window.toslices()
+                dst.write(result[:, rows, cols], window=window)
+
+        del result, weights
+
+    return output_path
+
+
+def check_tiling(
+    input_path: str,
+    tile_size: int = 1024,
+    overlap: int = 128,
+):
+    """
+    使用假模型比较整图推理和分块推理拼接的结果
+
+    假模型的结果只依赖局部窗口，重叠足够时两者应完全一致。
+
+    :param input_path: 输入影像
+    :param tile_size: 分块边长
+    :param overlap: 相邻分块的重叠像素数
+    """
+    from app.utils.fake_model import predict
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = Path(temp_dir)
+
+        start = time.perf_counter()
+        whole_path = temp_dir / "whole.tif"
+        predict(None, input_path, whole_path)
+        whole_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with rasterio.open(input_path) as src:
+            windows = get_tile_windows(src.width, src.height, tile_size, overlap)
+        tile_paths = split_scene(input_path, temp_dir / "tiles", windows)
+
+        output_dir = temp_dir / "outputs"
+        output_dir.mkdir()
+        output_paths = []
+        for tile_path in tile_paths:
+            output_path = output_dir / tile_path.name
+            predict(None, tile_path, output_path)
+            output_paths.append(output_path)
+
+        stitched_path = stitch_tiles(
+            input_path, windows, output_paths, temp_dir / "stitched.tif"
+        )
+        tiled_time = time.perf_counter() - start
+
+        with rasterio.open(whole_path) as whole, rasterio.open(stitched_path) as tiled:
+            mismatch = np.any(whole.read() != tiled.read(), axis=0).mean()
+
+    logger.info(f"Tiles: {len(windows)}, tile size: {tile_size}, overlap: {overlap}")
+    logger.info(f"Whole: {whole_time:.2f}s, tiled: {tiled_time:.2f}s")
+    logger.info(f"Mismatched pixels: {mismatch:.4%}")
+
+    return float(mismatch)
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.path.extend([".", ".."])
+
+    import fire
+
+    fire.Fire(check_tiling)
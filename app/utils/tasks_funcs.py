@@ -1,30 +1,377 @@
 import json
+import time
 
 from box import Box
+from loguru import logger
 from redis import Redis
+from redis.exceptions import WatchError
 
-from app.config import TASK_QUEUE
+from app.config import (
+    TASK_DEAD_LETTER_QUEUE,
+    TASK_DELAYED_QUEUE,
+    TASK_KEYS,
+    TASK_LEASES,
+    TASK_LOCK_PREFIX,
+    TASK_MAX_RETRIES,
+    TASK_PRIORITIES,
+    TASK_PROCESSING_QUEUE,
+    TASK_QUEUE,
+    TASK_VISIBILITY_TIMEOUT,
+)
+
+
+def get_queue_name(type: str, priority: str = "normal") -> str:
+    # 每种任务类型和优先级使用单独的队列
+    return f"{TASK_QUEUE}:{type}:{priority}"
+
+
+def get_task_key(task_info: dict) -> str:
+    # 任务的去重键，项目任务按项目去重，其他任务按对象去重
+    return f"{task_info['type']}:{task_info.get('project_id') or task_info['id']}"
 
 
 def push_task(
     redis_client: Redis,
     task: dict | None = None,
     tasks: list[dict] | None = None,
-    task_queue: str = TASK_QUEUE,
-):
+    task_queue: str | None = None,
+) -> int:
+    """
+    推送任务，去重键已存在的任务不会重复入队
+
+    :param redis_client: Redis客户端
+    :param task: 单个任务
+    :param tasks: 多个任务
+    :param task_queue: 指定的队列名，默认按任务类型和优先级选择
+    :return: 实际入队的任务数量
+    """
     if task:
         tasks = [task]
 
+    pushed = 0
     for task_info in tasks:
-        redis_client.rpush(
-            task_queue,
-            json.dumps(task_info, ensure_ascii=False, indent="\t", default=str),
+        queue = task_queue or _get_task_queue(task_info)
+        key = get_task_key(task_info)
+
+        with redis_client.pipeline() as pipe:
+            while True:
+                try:
+                    # 去重键和任务在同一事务中写入，避免只写入其中一个
+                    pipe.watch(TASK_KEYS)
+                    if pipe.sismember(TASK_KEYS, key):
+                        pipe.reset()
+                        logger.info(f"Task already enqueued: {key}")
+                        break
+
+                    pipe.multi()
+                    pipe.sadd(TASK_KEYS, key)
+                    pipe.rpush(queue, _dumps(task_info))
+                    pipe.execute()
+                    pushed += 1
+                    break
+                except WatchError:
+                    continue
+
+    return pushed
+
+
+def get_task(
+    redis_client: Redis,
+    task_queue: str | list[str] = TASK_QUEUE,
+    timeout: float | None = 0,
+) -> tuple[bytes, Box] | None:
+    """
+    取出任务并移入处理中队列，任务在确认前不会丢失
+
+    提供多个队列时按顺序取第一个非空队列的任务，都为空时阻塞等待第一个队列。
+    取出的任务带有租约，租约过期前未确认或续期的任务会被重新放回队列。
+
+    :param redis_client: Redis客户端
+    :param task_queue: 队列名或队列名列表
+    :param timeout: 为0时一直阻塞，为None时不阻塞，否则超时后返回None
+    :return: 任务原始内容和任务信息，原始内容用于确认和续期
+    """
+    queues = [task_queue] if isinstance(task_queue, str) else task_queue
+
+    payload = next(
+        (
+            item
+            for queue in queues
+            if (item := redis_client.lmove(queue, TASK_PROCESSING_QUEUE))
+        ),
+        None,
+    )
+    if payload is None and timeout is not None:
+        payload = redis_client.blmove(
+            queues[0], TASK_PROCESSING_QUEUE, timeout, "LEFT", "RIGHT"
+        )
+    if payload is None:
+        return None
+
+    extend_lease(redis_client, [payload])
+
+    task_info = Box().from_json(payload.decode("utf-8"))
+    task_info.pop("attempts", None)
+
+    return payload, task_info
+
+
+def extend_lease(redis_client: Redis, payloads: list[bytes]):
+    # 续期处理中任务的租约
+    if payloads:
+        deadline = time.time() + TASK_VISIBILITY_TIMEOUT
+        redis_client.zadd(TASK_LEASES, dict.fromkeys(payloads, deadline))
+
+
+def ack_task(redis_client: Redis, payload: bytes):
+    # 任务执行结束后从处理中队列删除
+    with redis_client.pipeline() as pipe:
+        pipe.lrem(TASK_PROCESSING_QUEUE, 1, payload)
+        pipe.zrem(TASK_LEASES, payload)
+        pipe.srem(TASK_KEYS, get_task_key(json.loads(payload)))
+        pipe.execute()
+
+
+def acquire_task_lock(redis_client: Redis, key: str) -> bool:
+    # 获取任务的执行锁，锁由租约线程续期，进程退出后自动过期
+    return bool(
+        redis_client.set(
+            f"{TASK_LOCK_PREFIX}:{key}", 1, nx=True, ex=TASK_VISIBILITY_TIMEOUT
         )
+    )
+
+
+def extend_task_locks(redis_client: Redis, keys: list[str]):
+    with redis_client.pipeline() as pipe:
+        for key in keys:
+            pipe.expire(f"{TASK_LOCK_PREFIX}:{key}", TASK_VISIBILITY_TIMEOUT)
+        pipe.execute()
+
+
+def release_task_lock(redis_client: Redis, key: str):
+    redis_client.delete(f"{TASK_LOCK_PREFIX}:{key}")
+
+
+def retry_task(
+    redis_client: Redis,
+    payload: bytes,
+    error: str,
+    *,
+    expired_only: bool = False,
+    retry: bool = True,
+) -> bool:
+    """
+    将处理中的任务放回原队列，超过最大重试次数后放入死信队列
+
+    :param redis_client: Redis客户端
+    :param payload: 任务原始内容
+    :param error: 重试原因
+    :param expired_only: 只在租约已过期时重试，用于回收停滞的任务
+    :param retry: 为False时直接放入死信队列
+    :return: 是否重试或放入死信队列
+    """
+    task_info = json.loads(payload)
+    attempts = task_info.get("attempts", 0) + 1
+    is_dead = not retry or attempts > TASK_MAX_RETRIES
+
+    with redis_client.pipeline() as pipe:
+        while True:
+            try:
+                # 租约在检查后被续期或任务已被确认时重新检查
+                pipe.watch(TASK_LEASES)
+                deadline = pipe.zscore(TASK_LEASES, payload)
+                if expired_only and (deadline is None or deadline > time.time()):
+                    pipe.reset()
+                    return False
+
+                pipe.multi()
+                pipe.lrem(TASK_PROCESSING_QUEUE, 1, payload)
+                pipe.zrem(TASK_LEASES, payload)
+                if is_dead:
+                    task_info.update(
+                        attempts=attempts, error=error, failed_at=time.time()
+                    )
+                    pipe.rpush(TASK_DEAD_LETTER_QUEUE, _dumps(task_info))
+                    pipe.srem(TASK_KEYS, get_task_key(task_info))
+                else:
+                    task_info["attempts"] = attempts
+                    pipe.lpush(_get_task_queue(task_info), _dumps(task_info))
+                pipe.execute()
+                break
+            except WatchError:
+                continue
+
+    if is_dead:
+        logger.error(f"Task moved to dead letter queue: {task_info}")
+    else:
+        logger.warning(f"Task retried ({attempts}/{TASK_MAX_RETRIES}): {error}")
+
+    return True
 
 
-def get_task(redis_client: Redis, task_queue: str = TASK_QUEUE) -> Box:
-    _, task_info = redis_client.blpop(task_queue)
-    task_info = task_info.decode("utf-8")
-    task_info = Box().from_json(task_info)
+def defer_task(redis_client: Redis, payload: bytes, delay: float):
+    """
+    将执行锁被占用的任务移出处理中队列，延后放回原队列
 
-    return task_info
+    任务内容不变，不计入重试次数，也不删除去重键，不会因等待而进入死信队列。
+
+    :param redis_client: Redis客户端
+    :param payload: 任务原始内容
+    :param delay: 延后的秒数
+    """
+    with redis_client.pipeline() as pipe:
+        pipe.lrem(TASK_PROCESSING_QUEUE, 1, payload)
+        pipe.zrem(TASK_LEASES, payload)
+        pipe.zadd(TASK_DELAYED_QUEUE, {payload: time.time() + delay})
+        pipe.execute()
+
+
+def requeue_delayed_tasks(redis_client: Redis) -> int:
+    """
+    将到期的延后任务放回原队列的头部
+
+    :param redis_client: Redis客户端
+    :return: 放回的任务数量
+    """
+    requeued = 0
+    for payload in redis_client.zrangebyscore(TASK_DELAYED_QUEUE, 0, time.time()):
+        with redis_client.pipeline() as pipe:
+            while True:
+                try:
+                    # 多个进程同时放回时只有一个成功
+                    pipe.watch(TASK_DELAYED_QUEUE)
+                    if pipe.zscore(TASK_DELAYED_QUEUE, payload) is None:
+                        pipe.reset()
+                        break
+
+                    pipe.multi()
+                    pipe.zrem(TASK_DELAYED_QUEUE, payload)
+                    pipe.lpush(_get_task_queue(json.loads(payload)), payload)
+                    pipe.execute()
+                    requeued += 1
+                    break
+                except WatchError:
+                    continue
+
+    return requeued
+
+
+def requeue_stalled_tasks(redis_client: Redis) -> int:
+    """
+    回收租约过期的任务，worker异常退出后任务会在租约过期后重新执行
+
+    :param redis_client: Redis客户端
+    :return: 回收的任务数量
+    """
+    payloads = redis_client.lrange(TASK_PROCESSING_QUEUE, 0, -1)
+
+    # 移入处理中队列后尚未设置租约的任务，给予完整的租约时间
+    if payloads:
+        deadline = time.time() + TASK_VISIBILITY_TIMEOUT
+        redis_client.zadd(TASK_LEASES, dict.fromkeys(payloads, deadline), nx=True)
+
+    stalled = redis_client.zrangebyscore(TASK_LEASES, 0, time.time())
+    stalled = set(stalled) & set(payloads)
+    requeued = sum(
+        retry_task(redis_client, payload, "lease expired", expired_only=True)
+        for payload in stalled
+    )
+
+    # 清理已不在处理中队列的租约
+    if orphaned := set(redis_client.zrange(TASK_LEASES, 0, -1)) - set(payloads):
+        redis_client.zrem(TASK_LEASES, *orphaned)
+
+    return requeued
+
+
+def sync_task_keys(redis_client: Redis) -> int:
+    """
+    删除已不在任何队列中的去重键，避免任务被手动删除后无法再次入队
+
+    :param redis_client: Redis客户端
+    :return: 删除的去重键数量
+    """
+    queues = {TASK_QUEUE, TASK_PROCESSING_QUEUE}
+    queues.update(
+        queue.decode("utf-8")
+        for queue in redis_client.scan_iter(match=f"{TASK_QUEUE}:*", _type="LIST")
+    )
+    queues.discard(TASK_DEAD_LETTER_QUEUE)
+
+    payloads = [
+        payload for queue in queues for payload in redis_client.lrange(queue, 0, -1)
+    ]
+    payloads.extend(redis_client.zrange(TASK_DELAYED_QUEUE, 0, -1))
+
+    keys = {get_task_key(json.loads(payload)) for payload in payloads}
+    stale = {key.decode("utf-8") for key in redis_client.smembers(TASK_KEYS)} - keys
+    if stale:
+        redis_client.srem(TASK_KEYS, *stale)
+
+    return len(stale)
+
+
+def return_tasks(redis_client: Redis, payloads: list[bytes]):
+    # 将未执行的任务按原顺序放回各自队列的头部，不计入重试次数
+    with redis_client.pipeline() as pipe:
+        for payload in reversed(payloads):
+            pipe.lrem(TASK_PROCESSING_QUEUE, 1, payload)
+            pipe.zrem(TASK_LEASES, payload)
+            pipe.lpush(_get_task_queue(json.loads(payload)), payload)
+        pipe.execute()
+
+
+def _get_task_queue(task_info: dict) -> str:
+    return get_queue_name(task_info["type"], task_info.get("priority") or "normal")
+
+
+def _dumps(task_info: dict) -> str:
+    return json.dumps(task_info, ensure_ascii=False, indent="\t", default=str)
+
+
+class WeightedScheduler:
+    def __init__(self, types: list[str], priorities: dict[str, int] = TASK_PRIORITIES):
+        """
+        按优先级权重在各任务队列之间进行平滑加权轮询
+
+        所有队列都有任务时，各队列被优先读取的次数与权重成正比，
+        权重低的队列不会被饿死；只有部分队列有任务时不会浪费读取机会。
+
+        :param types: 任务类型
+        :param priorities: 优先级及其权重
+        """
+        self.weights = {
+            get_queue_name(type, priority): weight
+            for type in types
+            for priority, weight in priorities.items()
+        }
+        self.current = dict.fromkeys(self.weights, 0)
+
+    def order(self, types: set[str] | None = None) -> list[str]:
+        """
+        获取本次读取队列的顺序
+
+        :param types: 允许读取的任务类型，为None时读取所有类型
+        :return: 队列名列表，第一个为本轮选中的队列，其余按权重降序排列
+        """
+        queues = [
+            queue
+            for queue in self.weights
+            if types is None or queue.split(":")[-2] in types
+        ]
+        if not queues:
+            return []
+
+        total = sum(self.weights[queue] for queue in queues)
+        for queue in queues:
+            self.current[queue] += self.weights[queue]
+
+        selected = max(queues, key=self.current.__getitem__)
+        self.current[selected] -= total
+
+        rest = sorted(
+            (queue for queue in queues if queue != selected),
+            key=self.weights.__getitem__,
+            reverse=True,
+        )
+        return [selected, *rest]
@@ -0,0 +1,251 @@
+from math import ceil, log2
+from pathlib import Path
+
+import cv2 as cv
+from loguru import logger
+import mapbox_vector_tile
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from shapely.geometry import Polygon
+
+# 瓦片边长（像素）
+TILE_SIZE = 256
+
+# 矢量瓦片坐标范围
+MVT_EXTENT = 4096
+
+
+def get_max_zoom(width: int, height: int, tile_size: int = TILE_SIZE) -> int:
+    """
+    获取原图分辨率对应的最大缩放级别，该级别下一个瓦片像素对应一个原图像素
+
+    :param width: 原图宽度
+    :param height: 原图高度
+    :param tile_size: 瓦片边长
+    :return: 最大缩放级别
+    """
+    return max(0, ceil(log2(max(width, height) / tile_size)))
+
+
+def get_tile_window(
+    z: int, x: int, y: int, width: int, height: int, tile_size: int = TILE_SIZE
+) -> tuple[int, int, int] | None:
+    """
+    获取瓦片在原图中覆盖的正方形区域
+
+    :param z: 缩放级别
+    :param x: 瓦片列号
+    :param y: 瓦片行号
+    :param width: 原图宽度
+    :param height: 原图高度
+    :param tile_size: 瓦片边长
+    :return: (列偏移, 行偏移, 边长)，瓦片不在原图范围内时返回None
+    """
+    max_zoom = get_max_zoom(width, height, tile_size)
+    if not (0 <= z <= max_zoom and 0 <= x < 2**z and 0 <= y < 2**z):
+        return None
+
+    span = tile_size * 2 ** (max_zoom - z)
+    col_off, row_off = x * span, y * span
+    if col_off >= width or row_off >= height:
+        return None
+
+    return col_off, row_off, span
+
+
+def parse_tile_name(tile: str) -> tuple[int, str]:
+    """
+    解析形如 `12.webp` 的瓦片文件名
+
+    :param tile: 瓦片文件名
+    :return: (行号, 格式)
+    """
+    tile_path = Path(tile)
+    if not tile_path.stem.isdigit():
+        msg = f"Invalid tile name: {tile}"
+        raise ValueError(msg)
+
+    return int(tile_path.stem), tile_path.suffix.lstrip(".").casefold()
+
+
+def read_window(
+    src: rasterio.DatasetReader,
+    col_off: int,
+    row_off: int,
+    span: int,
+    out_size: int,
+    *,
+    indexes: list[int] | None = None,
+    resampling: Resampling = Resampling.nearest,
+    with_alpha: bool = False,
+) -> np.ndarray:
+    """
+    读取原图中的正方形区域并缩放到指定边长，超出原图的部分填充0
+
+    只读取窗口内的数据，对于分块存储并带有金字塔的TIFF，
+    GDAL会自动选择合适的金字塔层级，无需读取整幅图像。
+
+    :param src: rasterio数据集
+    :param col_off: 列偏移
+    :param row_off: 行偏移
+    :param span: 区域边长
+    :param out_size: 输出边长
+    :param indexes: 读取的波段，为None时读取所有波段
+    :param resampling: 重采样方法
+    :param with_alpha: 是否追加一个alpha波段，原图范围内为255，填充部分为0
+    :return: 形状为(波段数, out_size, out_size)的数组
+    """
+    indexes = indexes or list(src.indexes)
+    scale = out_size / span
+
+    # 将窗口裁剪到原图范围内，避免使用较慢的boundless读取
+    read_width = min(span, src.width - col_off)
+    read_height = min(span, src.height - row_off)
+    out_width = max(1, round(read_width * scale))
+    out_height = max(1, round(read_height * scale))
+
+    data = src.read(
+        indexes,
+        window=Window(col_off, row_off, read_width, read_height),
+        out_shape=(len(indexes), out_height, out_width),
+        resampling=resampling,
+    )
+
+    band_count = len(indexes) + with_alpha
+    tile = np.zeros((band_count, out_size, out_size), dtype=data.dtype)
+    tile[: len(indexes), :out_height, :out_width] = data
+    if with_alpha:
+        tile[-1, :out_height, :out_width] = 255
+
+    return tile
+
+
+def get_display_indexes(src: rasterio.DatasetReader) -> list[int]:
+    """
+    获取用于显示的三个波段，优先使用颜色解释为RGB的波段
+
+    :param src: rasterio数据集
+    :return: 红、绿、蓝对应的波段序号
+    """
+    color_interps = {ci.name: i for i, ci in enumerate(src.colorinterp, start=1)}
+    if all(color in color_interps for color in ("red", "green", "blue")):
+        return [color_interps["red"], color_interps["green"], color_interps["blue"]]
+
+    # 单波段灰度图复制为三个波段
+    if src.count < 3:
+        return [1, 1, 1]
+
+    return [1, 2, 3]
+
+
+def get_stretch_range(
+    src: rasterio.DatasetReader, indexes: list[int], percentiles=(2, 98)
+) -> tuple[float, float]:
+    """
+    基于整幅图像的低分辨率概览计算拉伸范围，所有瓦片使用同一范围避免拼接处色差
+
+    :param src: rasterio数据集
+    :param indexes: 波段序号
+    :param percentiles: 拉伸的百分位数
+    :return: (下限, 上限)
+    """
+    scale = min(1, 1024 / max(src.width, src.height))
+    out_shape = (
+        len(indexes),
+        max(1, round(src.height * scale)),
+        max(1, round(src.width * scale)),
+    )
+    data = src.read(indexes, out_shape=out_shape, resampling=Resampling.average)
+
+    # 忽略全零的无数据像素
+    valid = data[:, np.any(data != 0, axis=0)]
+    if valid.size == 0:
+        return 0.0, 1.0
+
+    low, high = np.percentile(valid, percentiles)
+    return float(low), float(max(high, low + 1))
+
+
+def stretch_to_uint8(data: np.ndarray, low: float, high: float) -> np.ndarray:
+    """
+    将任意位深的数据线性拉伸到uint8
+
+    :param data: 输入数组
+    :param low: 拉伸下限
+    :param high: 拉伸上限
+    :return: uint8数组
+    """
+    if data.dtype == np.uint8:
+        return data
+
+    data = (data.astype(np.float32) - low) / (high - low) * 255
+    return np.clip(data, 0, 255).round().astype(np.uint8)
+
+
+def labels2features(
+    labels: np.ndarray,
+    class_names: list[str],
+    *,
+    extent: int = MVT_EXTENT,
+    epsilon: float = 1.0,
+) -> list[dict]:
+    """
+    将瓦片的标签图转换为矢量瓦片要素，坐标缩放到矢量瓦片坐标范围
+
+    :param labels: 形状为(H, W)的标签图，H与W相等
+    :param class_names: 类别名称，下标即标签
+    :param extent: 矢量瓦片坐标范围
+    :param epsilon: 轮廓简化的容差（像素）
+    :return: 矢量瓦片要素列表
+    """
+    scale = extent / labels.shape[1]
+
+    features = []
+    for label in np.unique(labels):
+        if label >= len(class_names):
+            continue
+
+        mask = (labels == label).astype(np.uint8)
+        contours, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+
+        for contour in contours:
+            contour = cv.approxPolyDP(contour, epsilon, closed=True)
+            if len(contour) < 3:
+                continue
+
+            points = contour.reshape(-1, 2) * scale
+            features.append(
+                {
+                    "geometry": Polygon(points),
+                    "properties": {"class": class_names[label]},
+                }
+            )
+
+    return features
+
+
+def encode_vector_tile(
+    features: list[dict], layer_name: str, extent: int = MVT_EXTENT
+) -> bytes:
+    """
+    将要素编码为Mapbox矢量瓦片
+
+    :param features: 要素列表，坐标已经位于[0, extent]范围内
+    :param layer_name: 图层名称
+    :param extent: 矢量瓦片坐标范围
+    :return: 矢量瓦片字节
+    """
+    tile = mapbox_vector_tile.encode(
+        [{"name": layer_name, "features": features}],
+        default_options={
+            "extents": extent,
+            # 图像坐标的y轴向下，与矢量瓦片一致，无需翻转
+            "y_coord_down": True,
+            "on_invalid_geometry": mapbox_vector_tile.encoder.on_invalid_geometry_make_valid,
+        },
+    )
+    logger.debug(f"编码矢量瓦片: {len(features)}个要素, 大小: {len(tile)}")
+
+    return tile
@@ -24,12 +24,13 @@ CREATE TABLE `objects` (
 	`type` ENUM("image", "pointcloud", "video"),
 	-- 原始上传的名称
 	`origin_name` VARCHAR(255) COMMENT '原始上传的名称',
-	`origin_type` ENUM("user", "system", "thumbnail", "mask_svg") DEFAULT 'user',
+	`origin_type` ENUM("user", "system", "thumbnail", "mask_svg", "cog", "copc") DEFAULT 'user',
 	`size` INT,
 	`thumbnail_id` INT UNIQUE,
 	`versions` INT DEFAULT 1,
 	`is_deleted` BOOLEAN DEFAULT false,
-	PRIMARY KEY(`id`)
+	PRIMARY KEY(`id`),
+	INDEX(`etag`)
 );
 
 
@@ -47,6 +48,8 @@ CREATE TABLE `projects` (
 	`is_deleted` BOOLEAN DEFAULT false,
 	-- 项目状态
 	`status` ENUM("waiting", "running", "completed") DEFAULT 'waiting' COMMENT '项目状态',
+	-- 任务优先级
+	`priority` ENUM("normal", "urgent") DEFAULT 'normal' COMMENT '任务优先级',
 	PRIMARY KEY(`id`)
 ) COMMENT='项目';
 
@@ -62,6 +65,8 @@ CREATE TABLE `images` (
 	`width` INT COMMENT '图片的宽',
 	-- 位深，默认RGB为24位
 	`bit_depth` INT DEFAULT 24 COMMENT '位深，默认RGB为24位',
+	-- 与原图一起保存的COG图像的id
+	`cog_id` INT COMMENT '与原图一起保存的COG图像的id',
 	PRIMARY KEY(`id`)
 );
 
@@ -71,6 +76,41 @@ CREATE TABLE `pointclouds` (
 	`object_id` INT NOT NULL UNIQUE,
 	-- 点云文件的点数量
 	`point_count` INT COMMENT '点云文件的点数量',
+	-- 点格式编号
+	`point_format` INT COMMENT '点格式编号',
+	-- LAS版本
+	`las_version` VARCHAR(8) COMMENT 'LAS版本',
+	-- 点云包围盒
+	`min_x` DOUBLE COMMENT '点云包围盒',
+	`min_y` DOUBLE,
+	`min_z` DOUBLE,
+	`max_x` DOUBLE,
+	`max_y` DOUBLE,
+	`max_z` DOUBLE,
+	-- 坐标缩放系数
+	`scale_x` DOUBLE COMMENT '坐标缩放系数',
+	`scale_y` DOUBLE,
+	`scale_z` DOUBLE,
+	-- 坐标偏移量
+	`offset_x` DOUBLE COMMENT '坐标偏移量',
+	`offset_y` DOUBLE,
+	`offset_z` DOUBLE,
+	-- WKT格式的坐标参考系
+	`crs` TEXT COMMENT 'WKT格式的坐标参考系',
+	-- 是否包含分类信息
+	`is_classified` BOOLEAN COMMENT '是否包含分类信息',
+	-- 各类别点数，键为类别编号
+	`class_counts` JSON COMMENT '各类别点数，键为类别编号',
+	-- 高程直方图，包含分箱边界和各分箱点数
+	`z_histogram` JSON COMMENT '高程直方图，包含分箱边界和各分箱点数',
+	-- 平均点密度（点数/水平面积）
+	`density` DOUBLE COMMENT '平均点密度（点数/水平面积）',
+	-- Minio中Potree页面的对象名
+	`potree_path` VARCHAR(255) COMMENT 'Minio中Potree页面的对象名',
+	-- 与原点云一起保存的COPC对象的id
+	`copc_id` INT COMMENT '与原点云一起保存的COPC对象的id',
+	-- Minio中空间索引清单的对象名
+	`index_path` VARCHAR(255) COMMENT 'Minio中空间索引清单的对象名',
 	PRIMARY KEY(`id`)
 );
 
@@ -101,10 +141,13 @@ CREATE TABLE `2d_segmentations` (
 	`image_id` INT,
 	`mask_image_id` INT,
 	`project_id` INT NOT NULL UNIQUE,
-	`plot_image_id` INT UNIQUE,
+	-- 相同影像的任务共用推理结果，结果图片可以被多个任务引用
+	`plot_image_id` INT,
 	`result` JSON,
 	-- mask svg图片id
-	`mask_svg_id` INT UNIQUE COMMENT 'mask svg图片id',
+	`mask_svg_id` INT COMMENT 'mask svg图片id',
+	-- 按类别拆分的mask svg图层清单
+	`mask_layers` JSON COMMENT '按类别拆分的mask svg图层清单',
 	PRIMARY KEY(`id`)
 );
 
@@ -121,6 +164,24 @@ CREATE TABLE `2d_detections` (
 );
 
 
+/* 推理结果缓存，相同输入和模型版本的任务直接使用已有结果 */
+CREATE TABLE `task_results` (
+	`id` INT NOT NULL AUTO_INCREMENT UNIQUE,
+	`type` VARCHAR(32),
+	-- 输入对象的etag，多个输入按顺序以逗号分隔
+	`input_etags` VARCHAR(255) COMMENT '输入对象的etag，多个输入按顺序以逗号分隔',
+	-- 模型名称
+	`model` VARCHAR(64) COMMENT '模型名称',
+	-- 模型版本标识，模型配置或推理脚本变化时改变
+	`model_version` VARCHAR(64) COMMENT '模型版本标识，模型配置或推理脚本变化时改变',
+	-- complete_*查询的结果参数
+	`result` JSON COMMENT 'complete_*查询的结果参数',
+	`created_time` DATETIME DEFAULT NOW(),
+	PRIMARY KEY(`id`),
+	UNIQUE(`type`, `input_etags`, `model_version`)
+) COMMENT='推理结果缓存';
+
+
 CREATE TABLE `conversation_images` (
 	`id` INT NOT NULL AUTO_INCREMENT UNIQUE,
 	`conversation_id` INT,
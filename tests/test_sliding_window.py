@@ -0,0 +1,92 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from app.config import SEGMENTATION_2D_TILE_OVERLAP, SEGMENTATION_2D_TILE_SIZE
+from app.utils.sliding_window_funcs import check_tiling, get_tile_windows
+
+TILE_SIZE = SEGMENTATION_2D_TILE_SIZE
+OVERLAP = SEGMENTATION_2D_TILE_OVERLAP
+
+
+def write_scene(path: Path, width: int, height: int) -> Path:
+    # 起伏的亮度加上噪声，类别边界遍布全图，拼接错误容易暴露
+    rng = np.random.default_rng(0)
+    rows, cols = np.mgrid[:height, :width]
+    brightness = 128 + 100 * np.sin(cols / 37) * np.cos(rows / 53)
+    noise = rng.normal(0, 20, size=(3, height, width))
+    img = np.clip(brightness + noise, 0, 255).astype(np.uint8)
+
+    profile = {
+        "driver": "GTiff",
+        "width": width,
+        "height": height,
+        "count": 3,
+        "dtype": "uint8",
+        "crs": "EPSG:3857",
+        "transform": from_origin(500000, 4000000, 0.5, 0.5),
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(img)
+
+    return path
+
+
+@pytest.mark.parametrize(
+    ("width", "height"),
+    [
+        (TILE_SIZE // 2, TILE_SIZE // 3),
+        (TILE_SIZE, TILE_SIZE),
+        (TILE_SIZE * 2 - OVERLAP + 37, TILE_SIZE + 1),
+        (TILE_SIZE * 3 + 5, TILE_SIZE * 2 - 3),
+    ],
+)
+def test_windows_cover_scene(width, height):
+    windows = get_tile_windows(width, height, TILE_SIZE, OVERLAP)
+
+    covered = np.zeros((height, width), dtype=bool)
+    for col_off, row_off, tile_width, tile_height in windows:
+        assert tile_width == min(TILE_SIZE, width)
+        assert tile_height == min(TILE_SIZE, height)
+        assert 0 <= col_off and col_off + tile_width <= width
+        assert 0 <= row_off and row_off + tile_height <= height
+        covered[row_off : row_off + tile_height, col_off : col_off + tile_width] = True
+
+    assert covered.all()
+
+
+def test_overlap_must_be_smaller_than_tile():
+    with pytest.raises(ValueError):
+        get_tile_windows(100, 100, 64, 64)
+
+
+@pytest.mark.parametrize(
+    ("width", "height"),
+    [
+        # 宽高都不是分块步长的整数倍，最后一列和一行的分块与影像边缘对齐
+        (TILE_SIZE * 2 - OVERLAP + 37, TILE_SIZE + 11),
+        # 小于一个分块时只有一个分块
+        (TILE_SIZE // 2 + 3, TILE_SIZE // 4),
+    ],
+)
+def test_tiled_matches_whole(tmp_path, width, height):
+    input_path = write_scene(tmp_path / "scene.tif", width, height)
+
+    mismatch = check_tiling(str(input_path), tile_size=TILE_SIZE, overlap=OVERLAP)
+
+    assert mismatch == 0
+
+
+def test_insufficient_overlap_is_detected(tmp_path):
+    # 重叠小于假模型的邻域时接缝处的结果不同，确认上面的比较能发现拼接错误
+    tile_size, overlap = 256, 2
+    input_path = write_scene(
+        tmp_path / "scene.tif", tile_size * 2 - overlap + 37, tile_size + 11
+    )
+
+    mismatch = check_tiling(str(input_path), tile_size=tile_size, overlap=overlap)
+
+    assert mismatch > 0